@@ -3,6 +3,11 @@ import asyncio, time, statistics, aiohttp, psutil
 EDGE_URL = "https://edge.local/api/infer"
 BETA = 0.01  # energy weight (joules per ms)
 SAMPLE_WINDOW = 20
+PROBE_S = 0.5      # background RTT probe / cpu refresh period
+ALPHA = 0.2        # EWMA weight of a new remote service time sample
+WINDOW = 8         # uploads in flight at most
+BATCH_MAX = 1      # payloads per upload; >1 only against an edge that accepts batched bodies
+BATCH_MS = 2.0     # max wait to fill a batch when the window has room
 
 # Rolling estimators
 rtt_samples = []
@@ -17,9 +22,14 @@ async def estimate_network_rtt(session):
         rtt_samples.pop(0)
     return statistics.mean(rtt_samples)
 
-def estimate_local_time(payload_size_bytes):
+def cpu_ratio():
+    # current/max clock; max is 0 or missing on many VMs and containers
+    f = psutil.cpu_freq()
+    return f.current / f.max if f and f.max else 1.0
+
+def estimate_local_time(payload_size_bytes, cpu=None):
     # Use cpu_percent and memory to predict local processing; placeholder model
-    cpu = psutil.cpu_freq().current / psutil.cpu_freq().max
+    cpu = cpu_ratio() if cpu is None else cpu
     base_ms = 50.0 * (payload_size_bytes / 100000.0)  # scale with size
     cpu_factor = max(0.5, 1.5 - cpu)
     return base_ms * cpu_factor
@@ -40,12 +50,262 @@ async def decide_offload(payload_bytes):
         return True
     return False
 
+class RttRing:
+    """Last SAMPLE_WINDOW RTTs (ms) in a ring with a running sum; mean is O(1)."""
+    def __init__(self, n=SAMPLE_WINDOW):
+        self.buf, self.i, self.n, self.total = [0.0] * n, 0, 0, 0.0
+
+    def add(self, ms):
+        self.total += ms - self.buf[self.i]
+        self.buf[self.i] = ms
+        self.i = (self.i + 1) % len(self.buf)
+        self.n = min(self.n + 1, len(self.buf))
+
+    @property
+    def mean(self):
+        return self.total / self.n if self.n else float('inf')
+
+class OffloadEngine:
+    """Offload decisions from cached estimates, uploads pipelined over one session.
+
+    A timer task probes the edge every PROBE_S into an RttRing and refreshes the
+    cpu clock ratio, so decide() is arithmetic only. Offloaded payloads queue up
+    and are posted up to batch_max at a time with at most WINDOW uploads in
+    flight; while the window is full the next batch keeps filling. Upload times feed an EWMA of the remote service
+    time, and the queued backlog is charged to T_tx so a congested link sends
+    work back to the device.
+
+    By default (batch_max=1) each payload is posted raw and the response is its
+    single result, the plain /api/infer contract. Batching is opt-in: the body
+    is then a 4-byte big-endian length before each payload, the count goes in
+    X-Batch-Count, and the edge must answer with a JSON list of one result per
+    payload; any other reply fails the whole batch.
+    """
+    def __init__(self, url=EDGE_URL, probe_url=None, session=None, window=WINDOW,
+                 batch_max=BATCH_MAX, batch_ms=BATCH_MS, probe_s=PROBE_S):
+        self.url, self.probe_url = url, probe_url or url  # a cheap health endpoint if the edge has one
+        self.session, self._own_session = session, session is None
+        self.window, self.batch_max, self.batch_ms, self.probe_s = window, batch_max, batch_ms, probe_s
+        self.rtt = RttRing()
+        self.t_remote = 20.0  # ms, until uploads have been measured
+        self.cpu = cpu_ratio()
+        self.queue, self.inflight, self._tasks, self._uploads = asyncio.Queue(), 0, [], set()
+
+    async def start(self):
+        if self.session is None:
+            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.window + 2))
+        await self.probe()  # one sample before the first decision
+        self._tasks = [asyncio.ensure_future(self._probe_loop()), asyncio.ensure_future(self._upload_loop())]
+        return self
+
+    async def close(self):
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await asyncio.gather(*self._uploads, return_exceptions=True)  # in flight: bounded by the post timeout
+        while not self.queue.empty():  # never sent: callers see CancelledError
+            self.queue.get_nowait()[1].cancel()
+        if self._own_session:
+            await self.session.close()
+
+    async def probe(self):
+        start = time.perf_counter()
+        try:
+            async with self.session.get(self.probe_url, timeout=aiohttp.ClientTimeout(total=1)) as resp:
+                await resp.read()
+            self.rtt.add((time.perf_counter() - start) * 1000.0)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.rtt.add(1000.0)  # unreachable counts as a full timeout: decisions lean local
+        self.cpu = cpu_ratio()
+
+    async def _probe_loop(self):
+        while True:
+            await asyncio.sleep(self.probe_s)
+            await self.probe()
+
+    def decide(self, payload_bytes):
+        rtt = self.rtt.mean
+        # batch fill wait plus the backlog ahead of this payload, in upload rounds
+        backlog = self.queue.qsize() / (self.batch_max * self.window)
+        T_tx = rtt + 5.0 + self.batch_ms + backlog * (rtt + self.t_remote)
+        T_local = estimate_local_time(payload_bytes, self.cpu)
+        E_tx = estimate_energy_tx(rtt, payload_bytes)
+        return T_local > T_tx + self.t_remote + BETA * E_tx
+
+    def offload(self, payload):
+        """Queue payload for upload; the future resolves to the edge's result for it."""
+        fut = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((payload, fut))
+        return fut
+
+    async def _upload_loop(self):
+        slots = asyncio.Semaphore(self.window)
+        def done(t):
+            slots.release(); self._uploads.discard(t)
+        batch = []
+        try:
+            while True:
+                await slots.acquire()
+                batch = [await self.queue.get()]
+                if self.queue.qsize() < self.batch_max - 1 and self.inflight:
+                    await asyncio.sleep(self.batch_ms / 1000.0)
+                while len(batch) < self.batch_max and not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                self.inflight += 1
+                t = asyncio.ensure_future(self._upload(batch))
+                self._uploads.add(t); t.add_done_callback(done)
+                batch = []
+        finally:
+            for _, fut in batch:  # taken off the queue but not sent when cancelled
+                fut.cancel()
+
+    async def _upload(self, batch):
+        start = time.perf_counter()
+        if self.batch_max == 1:
+            body, headers = batch[0][0], None
+        else:
+            body = b"".join(len(p).to_bytes(4, "big") + p for p, _ in batch)
+            headers = {"X-Batch-Count": str(len(batch))}
+        try:
+            async with self.session.post(self.url, data=body, headers=headers,
+                                         timeout=aiohttp.ClientTimeout(total=5)) as resp:
+                resp.raise_for_status()
+                results = await resp.json()
+            if self.batch_max == 1:
+                results = [results]
+            elif not isinstance(results, list) or len(results) != len(batch):
+                raise ValueError(f"edge answered a batch of {len(batch)} with "
+                                 f"{len(results) if isinstance(results, list) else type(results).__name__}")
+            ms = (time.perf_counter() - start) * 1000.0
+            self.t_remote += ALPHA * (max(ms - self.rtt.mean, 0.0) - self.t_remote)
+            for (_, fut), r in zip(batch, results):
+                if not fut.done():
+                    fut.set_result(r)
+        except Exception as e:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+        finally:
+            self.inflight -= 1
+
 # Example usage in an async processing loop
 async def process_loop():
-    while True:
-        payload = await get_next_sensor_payload()  # implemented elsewhere
-        if await decide_offload(len(payload)):
-            await forward_to_edge(payload)  # implement secure channel
+    engine = await OffloadEngine().start()
+    def on_result(fut, payload):
+        if fut.cancelled():
+            return
+        if fut.exception() is not None:
+            process_locally(payload)  # edge failed or shut down: fall back
         else:
-            process_locally(payload)
-        await asyncio.sleep(0.001)
\ No newline at end of file
+            handle_result(fut.result())  # implemented elsewhere
+    try:
+        while True:
+            payload = await get_next_sensor_payload()  # implemented elsewhere
+            if engine.decide(len(payload)):
+                # batched upload; implement secure channel
+                engine.offload(payload).add_done_callback(lambda f, p=payload: on_result(f, p))
+            else:
+                process_locally(payload)
+    finally:
+        await engine.close()
+
+def _edge_process(port, rtt_ms, service_ms, per_item_ms):
+    # emulated edge: each request pays the RTT, an inference call pays service + per-item time
+    from aiohttp import web
+    async def probe(request):
+        await asyncio.sleep(rtt_ms / 1000.0)
+        return web.Response(body=b"ok")
+    async def infer(request):
+        await request.read()
+        n = int(request.headers.get("X-Batch-Count", 1))  # no header: one raw payload
+        await asyncio.sleep((rtt_ms + service_ms + per_item_ms * n) / 1000.0)
+        return web.json_response([{"ok": True}] * n if "X-Batch-Count" in request.headers else {"ok": True})
+    app = web.Application(client_max_size=64 << 20)
+    app.router.add_get("/api/infer", probe)
+    app.router.add_post("/api/infer", infer)
+    web.run_app(app, host="127.0.0.1", port=port, print=None, handle_signals=False)
+
+def bench(port=19200, rate=400, seconds=3.0, rtt_ms=10.0, service_ms=20.0, per_item_ms=0.5):
+    # payload stream at `rate`/s: 80% 200 kB (offload pays off), 20% 2 kB (local);
+    # process_locally stands in as a blocking sleep of the modelled local time
+    import multiprocessing as mp, random
+    global EDGE_URL
+    EDGE_URL = url = f"http://127.0.0.1:{port}/api/infer"
+    proc = mp.get_context("fork").Process(target=_edge_process, args=(port, rtt_ms, service_ms, per_item_ms), daemon=True)
+    proc.start()
+    rng = random.Random(0)
+    sizes = [200_000 if rng.random() < 0.8 else 2_000 for _ in range(int(rate * seconds))]
+    blobs = {s: bytes(s) for s in set(sizes)}
+
+    async def run():
+        for _ in range(100):  # wait for the edge to listen
+            try:
+                async with aiohttp.ClientSession() as s, s.get(url) as r:
+                    await r.read()
+                break
+            except aiohttp.ClientError:
+                await asyncio.sleep(0.05)
+
+        t0 = time.perf_counter()
+        n_old = 50
+        for _ in range(n_old):
+            await decide_offload(200_000)
+        old_rate = n_old / (time.perf_counter() - t0)
+        engine = await OffloadEngine(url, batch_max=32).start()  # the emulated edge takes batches
+        t0 = time.perf_counter()
+        for i in range(100_000):
+            engine.decide(sizes[i % len(sizes)])
+        new_rate = 100_000 / (time.perf_counter() - t0)
+        print(f"decisions : previous {old_rate:10,.0f}/s (new session + probe each), engine {new_rate:10,.0f}/s "
+              f"({1e6 / new_rate:.2f} us)")
+
+        async def stream(label, items):
+            lat, offloaded, pending = [], [0], []
+            start = time.perf_counter()
+            async def done(t_arr, fut):
+                await fut
+                lat.append(time.perf_counter() - t_arr)
+            if label == "previous":
+                async with aiohttp.ClientSession() as session:
+                    for k, size in enumerate(items):  # serial loop, one upload per payload
+                        t_arr = start + k / rate
+                        await asyncio.sleep(max(0.0, t_arr - time.perf_counter()))
+                        if await decide_offload(size):
+                            async with session.post(url, data=len(blobs[size]).to_bytes(4, "big") + blobs[size]) as r:
+                                await r.read()
+                            offloaded[0] += 1
+                        else:
+                            time.sleep(estimate_local_time(size) / 1000.0)
+                        lat.append(time.perf_counter() - t_arr)
+                        await asyncio.sleep(0.001)
+            else:
+                for k, size in enumerate(items):
+                    t_arr = start + k / rate
+                    await asyncio.sleep(max(0.0, t_arr - time.perf_counter()))
+                    if engine.decide(size):
+                        pending.append(asyncio.ensure_future(done(t_arr, engine.offload(blobs[size]))))
+                        offloaded[0] += 1
+                    else:
+                        time.sleep(estimate_local_time(size, engine.cpu) / 1000.0)
+                        lat.append(time.perf_counter() - t_arr)
+                await asyncio.gather(*pending)
+            dt = time.perf_counter() - start
+            lat.sort()
+            print(f"{label:9s} : {len(items)} payloads at {rate}/s offered, {len(items) / dt:6.0f}/s done, "
+                  f"{offloaded[0]} offloaded; end-to-end p50 {lat[len(lat) // 2] * 1e3:7.1f} ms, "
+                  f"p99 {lat[int(len(lat) * 0.99)] * 1e3:7.1f} ms")
+
+        await stream("previous", sizes[:int(rate * 0.5)])
+        await stream("engine", sizes)
+        print(f"engine    : rtt {engine.rtt.mean:.1f} ms, remote (batch) {engine.t_remote:.1f} ms")
+        await engine.close()
+
+    try:
+        asyncio.run(run())
+    finally:
+        proc.kill(); proc.join()
+
+if __name__ == "__main__":
+    import sys
+    if "--bench" in sys.argv:
+        bench(); sys.exit()
@@ -1,29 +1,39 @@
 from kubernetes import client, config
-import heapq
+import requests, numpy as np
 # Load kubeconfig or in-cluster config
 config.load_incluster_config()  # or config.load_kube_config()
 v1 = client.CoreV1Api()
+PROM_URL = "http://prometheus:9090/api/v1/query"
+session = requests.Session()  # one keep-alive connection for all metric queries
 # Fetch nodes and metrics (assumes metrics-server or Prometheus adapter)
 nodes = v1.list_node().items
+names = [n.metadata.name for n in nodes]
 
-def fetch_node_metrics(node_name):
-    # Placeholder: integrate Prometheus or metrics API in production
-    return {"rtt": 20.0, "cpu_used": 0.4, "mem_used": 0.5, "labels": {}}
+def fetch_fleet_metric(query, label, default):
+    # One grouped query per metric for the whole fleet, aligned to `names`
+    try:
+        r = session.get(PROM_URL, params={"query": query}, timeout=5)
+        r.raise_for_status()
+        vals = {s["metric"].get(label): float(s["value"][1]) for s in r.json()["data"]["result"]}
+    except (requests.RequestException, KeyError, ValueError):
+        vals = {}
+    return np.array([vals.get(n, default) for n in names], dtype=np.float64)
+
+def fetch_node_metrics():
+    return {"rtt": fetch_fleet_metric('max by (instance) (probe_rtt_seconds) * 1000', "instance", 20.0),
+            "cpu_used": fetch_fleet_metric('avg by (node) (node_cpu_utilisation)', "node", 0.4),
+            "mem_used": fetch_fleet_metric('avg by (node) (node_memory_utilisation)', "node", 0.5)}
 
 def score_node(metrics, weights):
-    # Lower score is better
+    # Lower score is better; vectorized across nodes
     return weights['rtt']*metrics['rtt'] + weights['cpu']*metrics['cpu_used'] + weights['mem']*metrics['mem_used']
 
 weights = {'rtt': 0.6, 'cpu': 0.3, 'mem': 0.1}
-pq = []
-for node in nodes:
-    nm = fetch_node_metrics(node.metadata.name)
-    s = score_node(nm, weights)
-    heapq.heappush(pq, (s, node.metadata.name))
+scores = score_node(fetch_node_metrics(), weights)
 
 # Select best node and patch a Deployment/Pod with nodeSelector (idempotent)
-best_score, best_node = heapq.heappop(pq)
+best_node = names[int(np.argmin(scores))]
 # Example: patch deployment with nodeSelector (real code must handle RBAC, retries)
 patch = {"spec": {"template": {"spec": {"nodeSelector": {"kubernetes.io/hostname": best_node}}}}}
 apps = client.AppsV1Api()
-apps.patch_namespaced_deployment(name="predictor", namespace="edge", body=patch)
\ No newline at end of file
+apps.patch_namespaced_deployment(name="predictor", namespace="edge", body=patch)
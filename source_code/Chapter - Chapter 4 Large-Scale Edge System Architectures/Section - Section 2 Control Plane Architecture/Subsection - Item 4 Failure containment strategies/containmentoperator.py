@@ -1,22 +1,88 @@
 #!/usr/bin/env python3
 # Production-ready operator fragment for failure containment on K8s edge clusters.
-import time, requests, os
+# One informer per kind (list+watch across all namespaces) feeds a local cache;
+# writes are issued only when the cached object differs from the desired state.
+import time, requests, os, threading, logging
 from kubernetes import client, config, watch
 
+logging.basicConfig(level=logging.INFO)
+
 # Configure in-cluster or local kubeconfig
 config.load_incluster_config() if os.getenv("KUBERNETES_SERVICE_HOST") else config.load_kube_config()
 api = client.NetworkingV1Api()
 core = client.CoreV1Api()
 
-NAMESPACE = os.getenv("TARGET_NAMESPACE", "edge-services")
+# Comma-separated list; one process contains failures for all of them.
+NAMESPACES = [n.strip() for n in os.getenv("TARGET_NAMESPACES",
+              os.getenv("TARGET_NAMESPACE", "edge-services")).split(",") if n.strip()]
 HEALTH_URL = os.getenv("CONTROLLER_HEALTH_URL", "http://10.0.0.5:8080/health")
 FAIL_THRESHOLD = int(os.getenv("FAIL_THRESHOLD", "3"))
 CHECK_INTERVAL = int(os.getenv("CHECK_INTERVAL", "5"))
+RESYNC_SECONDS = int(os.getenv("RESYNC_SECONDS", "300"))
+
+NP_NAME = "restrict-egress-on-failure"
+CM_NAME = "local-fallback-policy"
+CM_DATA = {"mode": "locked"}
+
+class Informer:
+    """List once, then follow a single cluster-wide watch stream into a cache.
+
+    Objects are keyed by (namespace, name). The cache is rebuilt by a fresh
+    list whenever the stream expires (410) or the resync period elapses.
+    """
+    def __init__(self, list_all, field_selector=None):
+        self.list_all = list_all
+        self.field_selector = field_selector
+        self.cache = {}
+        self.lock = threading.Lock()
+        self.synced = threading.Event()
+        self.api_calls = 0  # list+watch requests issued, for load accounting
+
+    def get(self, namespace, name):
+        with self.lock:
+            return self.cache.get((namespace, name))
+
+    def _relist(self):
+        kw = {"field_selector": self.field_selector} if self.field_selector else {}
+        resp = self.list_all(**kw); self.api_calls += 1
+        with self.lock:
+            self.cache = {(o.metadata.namespace, o.metadata.name): o for o in resp.items}
+        self.synced.set()
+        return resp.metadata.resource_version
+
+    def run(self):
+        while True:
+            try:
+                rv = self._relist()
+                kw = {"field_selector": self.field_selector} if self.field_selector else {}
+                self.api_calls += 1
+                for ev in watch.Watch().stream(self.list_all, resource_version=rv,
+                                               timeout_seconds=RESYNC_SECONDS, **kw):
+                    o = ev["object"]; key = (o.metadata.namespace, o.metadata.name)
+                    with self.lock:
+                        if ev["type"] == "DELETED":
+                            self.cache.pop(key, None)
+                        else:
+                            self.cache[key] = o
+            except client.exceptions.ApiException as e:
+                if e.status != 410:  # 410 Gone: resource version too old, relist
+                    logging.warning("watch failed: %s", e.reason); time.sleep(1)
+            except Exception:
+                logging.exception("watch stream dropped"); time.sleep(1)
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+        return self
+
+np_informer = Informer(api.list_network_policy_for_all_namespaces,
+                       field_selector=f"metadata.name={NP_NAME}").start()
+cm_informer = Informer(core.list_config_map_for_all_namespaces,
+                       field_selector=f"metadata.name={CM_NAME}").start()
 
 def make_restrictive_np():
     # Deny egress except to approved endpoints (e.g., local telemetry).
     return client.V1NetworkPolicy(
-        metadata=client.V1ObjectMeta(name="restrict-egress-on-failure"),
+        metadata=client.V1ObjectMeta(name=NP_NAME),
         spec=client.V1NetworkPolicySpec(
             pod_selector=client.V1LabelSelector(match_labels={}),  # apply to all pods
             policy_types=["Egress"],
@@ -30,43 +96,68 @@ def make_restrictive_np():
         )
     )
 
-def ensure_configmap_locked():
+def _egress_rule(r):
+    # peers and ports of one rule; the server defaults a port's protocol to TCP
+    return ([(p.pod_selector.match_labels or {}) if p.pod_selector else None for p in (r.to or [])],
+            [(p.protocol or "TCP", p.port, p.end_port) for p in (r.ports or [])])
+
+def np_matches(cur, desired):
+    # Compare the fields we own; server-side defaults are ignored.
+    c, d = cur.spec, desired.spec
+    return (c.policy_types == d.policy_types and
+            (c.pod_selector.match_labels or {}) == d.pod_selector.match_labels and
+            [_egress_rule(r) for r in (c.egress or [])] == [_egress_rule(r) for r in (d.egress or [])])
+
+def ensure_configmap_locked(namespace):
     # Pin node-local fallback policy to avoid remote pulls during failure.
-    cm = client.V1ConfigMap(metadata=client.V1ObjectMeta(name="local-fallback-policy"), data={"mode":"locked"})
-    try:
-        core.create_namespaced_config_map(NAMESPACE, cm)
-    except client.exceptions.ApiException as e:
-        if e.status == 409:  # already exists, update
-            core.replace_namespaced_config_map("local-fallback-policy", NAMESPACE, cm)
-
-def apply_network_policy():
+    cur = cm_informer.get(namespace, CM_NAME)
+    if cur is not None and (cur.data or {}) == CM_DATA:
+        return False  # already locked; no API call
+    cm = client.V1ConfigMap(metadata=client.V1ObjectMeta(name=CM_NAME), data=CM_DATA)
+    if cur is None:
+        core.create_namespaced_config_map(namespace, cm)
+    else:
+        core.replace_namespaced_config_map(CM_NAME, namespace, cm)
+    return True
+
+def apply_network_policy(namespace):
     np = make_restrictive_np()
-    try:
-        api.create_namespaced_network_policy(NAMESPACE, np)
-    except client.exceptions.ApiException as e:
-        if e.status == 409:
-            api_replace = api.replace_namespaced_network_policy
-            api_replace("restrict-egress-on-failure", NAMESPACE, np)
+    cur = np_informer.get(namespace, NP_NAME)
+    if cur is not None and np_matches(cur, np):
+        return False
+    if cur is None:
+        api.create_namespaced_network_policy(namespace, np)
+    else:
+        api.replace_namespaced_network_policy(NP_NAME, namespace, np)
+    return True
+
+def reconcile(namespaces):
+    # Converge every namespace from cache; only diffs reach the API server.
+    for ns in namespaces:
+        try:
+            if apply_network_policy(ns) | ensure_configmap_locked(ns):
+                logging.info("containment applied in %s", ns)
+        except client.exceptions.ApiException as e:
+            if e.status != 409:  # 409: cache lagging a concurrent create; next cycle fixes it
+                logging.warning("reconcile %s failed: %s", ns, e.reason)
 
 def main():
+    session = requests.Session()  # keep-alive for health probes
+    np_informer.synced.wait(); cm_informer.synced.wait()
     fail_count = 0
     while True:
         try:
-            r = requests.get(HEALTH_URL, timeout=2)
-            if r.status_code == 200:
-                fail_count = 0
-            else:
-                fail_count += 1
+            r = session.get(HEALTH_URL, timeout=2)
+            fail_count = 0 if r.status_code == 200 else fail_count + 1
         except requests.RequestException:
             fail_count += 1
 
         if fail_count >= FAIL_THRESHOLD:
-            apply_network_policy()
-            ensure_configmap_locked()
+            reconcile(NAMESPACES)
             # exponential backoff to limit controller traffic.
             time.sleep(CHECK_INTERVAL * 4)
         else:
             time.sleep(CHECK_INTERVAL)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,10 +1,15 @@
 #!/usr/bin/env python3
 # Score edge nodes for placing data-processing tasks by locality and policy.
-import os, requests, math
+# Each metric is fetched once for the whole fleet (grouped by node label),
+# cached with a TTL, and scored as NumPy vectors.
+import os, requests, time, threading
+import numpy as np
+from requests.adapters import HTTPAdapter
 from kubernetes import client, config
 
 PROM_URL = os.getenv("PROM_URL", "http://prometheus.monitoring:9090/api/v1/query")
 K8S_CONFIG = os.getenv("KUBECONFIG")  # use in-cluster config if None
+METRIC_TTL = float(os.getenv("METRIC_TTL", "15"))  # seconds a fleet vector stays fresh
 
 # load k8s client
 if K8S_CONFIG:
@@ -13,50 +18,83 @@ else:
     config.load_incluster_config()
 v1 = client.CoreV1Api()
 
-def query_prom(query):
-    r = requests.get(PROM_URL, params={'query': query}, timeout=5)
-    r.raise_for_status()
-    return r.json()['data']['result']
-
-def fetch_network_metrics(node_name):
-    # expected to return bandwidth (bytes/s) and rtt (s)
-    bw_q = f'node_network_bandwidth_bytes{{node="{node_name}"}}'
-    rtt_q = f'probe_rtt_seconds{{instance="{node_name}"}}'
-    try:
-        bw = float(query_prom(bw_q)[0]['value'][1])
-    except Exception:
-        bw = 1e6  # fallback
-    try:
-        rtt = float(query_prom(rtt_q)[0]['value'][1])
-    except Exception:
-        rtt = 0.05
+class PromVectorCache:
+    """Fleet-wide Prometheus vectors keyed by a grouping label, with TTL.
+
+    One instant query such as ``max by (node) (metric)`` returns every node's
+    sample; ``vector`` aligns it to a node list and fills gaps with a default.
+    """
+    def __init__(self, url=PROM_URL, ttl=METRIC_TTL, pool=8):
+        self.url, self.ttl = url, ttl
+        self.session = requests.Session()  # pooled keep-alive connections
+        adapter = HTTPAdapter(pool_connections=pool, pool_maxsize=pool)
+        self.session.mount("http://", adapter); self.session.mount("https://", adapter)
+        self._cache = {}  # query -> (fetched_at, {label_value: float})
+        self._lock = threading.Lock()
+
+    def query(self, query, label):
+        now = time.monotonic()
+        with self._lock:
+            hit = self._cache.get(query)
+        if hit and now - hit[0] < self.ttl:
+            return hit[1]
+        r = self.session.get(self.url, params={'query': query}, timeout=5)
+        r.raise_for_status()
+        vals = {}
+        for s in r.json()['data']['result']:
+            key = s['metric'].get(label)
+            if key is not None:
+                vals[key] = float(s['value'][1])
+        with self._lock:
+            self._cache[query] = (now, vals)
+        return vals
+
+    def vector(self, query, label, names, default):
+        try:
+            vals = self.query(query, label)
+        except (requests.RequestException, KeyError, ValueError):
+            vals = {}
+        return np.fromiter((vals.get(n, default) for n in names), dtype=np.float64, count=len(names))
+
+metrics = PromVectorCache()
+
+def fetch_network_metrics(node_names):
+    # bandwidth (bytes/s) and rtt (s) per node, aligned with node_names
+    bw = metrics.vector('max by (node) (node_network_bandwidth_bytes)', 'node', node_names, 1e6)
+    rtt = metrics.vector('max by (instance) (probe_rtt_seconds)', 'instance', node_names, 0.05)
+    bw[bw <= 0] = 1e6  # guard against division by zero from bad exporters
     return bw, rtt
 
-def score_node(size_bytes, node, alpha=1.0, beta=0.5, gamma=0.1):
-    labels = node.metadata.labels or {}
-    # policy: local storage required label
-    if labels.get('edge.local_storage') != 'true':
-        return None
-    bw, rtt = fetch_network_metrics(node.metadata.name)
+def score_nodes(size_bytes, bw, rtt, compute_ms, energy, alpha=1.0, beta=0.5, gamma=0.1):
+    # vectorized cost over all candidate nodes
     T = size_bytes / bw + rtt
-    # simplistic compute and energy proxies from labels
-    compute_ms = float(labels.get('capacity.compute_ms', '50'))
-    energy = float(labels.get('power.per_op', '0.05'))
     cost = alpha * T + beta * (compute_ms/1000.0) + gamma * energy
-    return cost, T, compute_ms
+    return cost, T
 
-def rank_nodes(size_bytes):
-    nodes = v1.list_node().items
-    scored = []
+def candidate_nodes(nodes):
+    # policy: local storage required label; compute and energy proxies from labels
+    names, compute_ms, energy = [], [], []
     for n in nodes:
-        s = score_node(size_bytes, n)
-        if s is not None:
-            scored.append((n.metadata.name,)+s)
-    scored.sort(key=lambda x: x[1])  # sort by cost
-    return scored
+        labels = n.metadata.labels or {}
+        if labels.get('edge.local_storage') != 'true':
+            continue
+        names.append(n.metadata.name)
+        compute_ms.append(float(labels.get('capacity.compute_ms', '50')))
+        energy.append(float(labels.get('power.per_op', '0.05')))
+    return names, np.asarray(compute_ms, dtype=np.float64), np.asarray(energy, dtype=np.float64)
+
+def rank_nodes(size_bytes, nodes=None):
+    nodes = v1.list_node().items if nodes is None else nodes
+    names, compute_ms, energy = candidate_nodes(nodes)
+    if not names:
+        return []
+    bw, rtt = fetch_network_metrics(names)
+    cost, T = score_nodes(size_bytes, bw, rtt, compute_ms, energy)
+    order = np.argsort(cost, kind="stable")  # sort by cost
+    return [(names[i], float(cost[i]), float(T[i]), float(compute_ms[i])) for i in order]
 
 if __name__ == "__main__":
     import sys
     size = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000_000
     for rec in rank_nodes(size):
-        print(f"{rec[0]} cost={rec[1]:.4f} T={rec[2]:.3f}s comp_ms={rec[3]}")
\ No newline at end of file
+        print(f"{rec[0]} cost={rec[1]:.4f} T={rec[2]:.3f}s comp_ms={rec[3]}")
@@ -1,31 +1,70 @@
 #!/usr/bin/env python3
 # Minimal, robust daemon: monitor RTTs and switch preferred route
-import time, subprocess, logging
+# Probes are asyncio TCP connects (no fork per probe), issued to all gateways
+# concurrently; per-target EWMA and windowed quantiles drive the decision.
+import asyncio, time, logging
+from collections import deque
 from pyroute2 import IPRoute
 
 # configure endpoints and routes
 WIRED_GW = '192.0.2.1'        # gateway reachable via eth0
 WIRELESS_GW = '198.51.100.1'  # gateway reachable via wlan0
+PROBE_PORT = 53               # any port the gateway answers (SYN-ACK or RST)
 PREF_TABLE = 100              # policy routing table id
-PING_COUNT = 3
+PING_COUNT = 3                # probes per target per cycle
+PROBE_TIMEOUT = 1.0
 CHECK_INTERVAL = 2.0
+ALPHA = 0.3                   # EWMA smoothing
+WINDOW = 64                   # samples kept for quantiles
 
 ip = IPRoute()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
 
-def ping_rtt(gw):
-    # use system ping for robustness; returns median RTT in ms or None
+class TargetStats:
+    """EWMA plus a bounded sample window for quantiles; None marks a loss."""
+    def __init__(self, alpha=ALPHA, window=WINDOW):
+        self.alpha, self.ewma = alpha, None
+        self.samples = deque(maxlen=window)
+        self.last_ok = None  # monotonic time of last successful probe
+
+    def add(self, rtt_ms):
+        self.samples.append(rtt_ms)
+        if rtt_ms is None:
+            return
+        self.last_ok = time.monotonic()
+        self.ewma = rtt_ms if self.ewma is None else self.alpha*rtt_ms + (1-self.alpha)*self.ewma
+
+    def quantile(self, q):
+        ok = sorted(s for s in self.samples if s is not None)
+        return ok[min(len(ok) - 1, int(q * len(ok)))] if ok else None
+
+    def loss(self):
+        return sum(s is None for s in self.samples) / len(self.samples) if self.samples else 0.0
+
+async def tcp_rtt(host, port=PROBE_PORT, timeout=PROBE_TIMEOUT):
+    # RTT of one TCP handshake in ms; a refused connect still measures the path
+    t0 = time.perf_counter_ns()
     try:
-        out = subprocess.check_output(
-            ['ping', '-c', str(PING_COUNT), '-W', '1', gw],
-            stderr=subprocess.DEVNULL, text=True)
-        # parse rtt line like: rtt min/avg/max/mdev = ...
-        for line in out.splitlines():
-            if 'rtt' in line:
-                parts = line.split('=')[1].split('/')
-                return float(parts[1])
-    except subprocess.CalledProcessError:
+        _, w = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        rtt = (time.perf_counter_ns() - t0) / 1e6
+        w.close()
+        return rtt
+    except ConnectionRefusedError:
+        return (time.perf_counter_ns() - t0) / 1e6
+    except (OSError, asyncio.TimeoutError):
+        return None
+
+async def probe_all(stats, count=PING_COUNT):
+    # every probe to every target in flight at once; raw samples land in stats
+    targets = [t for t in stats for _ in range(count)]
+    for t, rtt in zip(targets, await asyncio.gather(*(tcp_rtt(t) for t in targets))):
+        stats[t].add(rtt)
+
+def ping_rtt(st):
+    # smoothed RTT in ms, or None if the target stopped answering
+    if st.last_ok is None or time.monotonic() - st.last_ok > PING_COUNT * CHECK_INTERVAL:
         return None
+    return st.ewma
 
 def set_preferred(gw_addr):
     # set default route in PREF_TABLE to chosen gateway
@@ -37,12 +76,14 @@ def set_preferred(gw_addr):
     # policy: use table for local source or fwmark as needed
     logging.info('Set preferred gateway %s in table %d', gw_addr, PREF_TABLE)
 
-def main_loop():
+async def main_loop():
     current = None
+    stats = {WIRED_GW: TargetStats(), WIRELESS_GW: TargetStats()}
     while True:
-        r_w = ping_rtt(WIRED_GW)
-        r_wl = ping_rtt(WIRELESS_GW)
-        logging.info('RTT wired=%s ms wireless=%s ms', r_w, r_wl)
+        await probe_all(stats)
+        r_w, r_wl = ping_rtt(stats[WIRED_GW]), ping_rtt(stats[WIRELESS_GW])
+        logging.info('RTT wired=%s ms (p95 %s) wireless=%s ms (p95 %s)', r_w,
+                     stats[WIRED_GW].quantile(0.95), r_wl, stats[WIRELESS_GW].quantile(0.95))
         # simple decision rule: prefer lower RTT if reachable
         if r_w is None and r_wl is None:
             logging.warning('No path available')
@@ -51,7 +92,7 @@ def main_loop():
             if prefer != current:
                 set_preferred(prefer)
                 current = prefer
-        time.sleep(CHECK_INTERVAL)
+        await asyncio.sleep(CHECK_INTERVAL)
 
 if __name__ == '__main__':
-    main_loop()
\ No newline at end of file
+    asyncio.run(main_loop())
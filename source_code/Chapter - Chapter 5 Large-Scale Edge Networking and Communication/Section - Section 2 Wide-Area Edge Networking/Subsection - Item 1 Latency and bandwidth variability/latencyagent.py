@@ -1,36 +1,50 @@
 #!/usr/bin/env python3
 # Production-ready edge agent: active probes, EWMA estimation, tc shaping.
-import asyncio, subprocess, logging, time
+# RTT probes are in-loop TCP connects, iperf3 runs in an executor so the loop
+# never blocks, and the qdisc is changed over netlink only outside a hysteresis band.
+import asyncio, logging, time
+from collections import deque
 import iperf3  # pip install iperf3
+from pyroute2 import IPRoute, NetlinkError
 logging.basicConfig(level=logging.INFO)
 
 DEV='eth0'               # interface to shape
 IP_TARGET='198.51.100.1' # probe target (MEC gateway)
+IPERF_PORT=5201          # iperf3 server on the gateway
+PROBE_PORT=33434         # closed port on the gateway: its RST times the path, iperf3's control port is left alone
 ALPHA=0.25               # EWMA smoothing
 BW_MIN=5e6               # minimum rate in bps to enforce (5 Mbps)
+HYSTERESIS=0.10          # re-shape only when target moves >10% from applied rate
+RTT_INTERVAL=1.0         # seconds between RTT probes
+BW_EVERY=5               # throughput probe every N RTT intervals
 
 class State:
     def __init__(self):
         self.rtt=None
         self.bw=None
+        self.rtt_window=deque(maxlen=120)  # raw samples for quantiles
+        self.applied_rate=None             # last rate pushed to the kernel
 
 state=State()
+ipr=IPRoute()
 
-async def ping_rtt(target):
-    # run single ping, parse output for Linux ping
-    proc=await asyncio.create_subprocess_exec('ping','-c','1','-W','1',target,
-                                             stdout=asyncio.subprocess.PIPE)
-    out=await proc.stdout.read()
-    s=out.decode(errors='ignore')
-    for line in s.splitlines():
-        if 'time=' in line:
-            return float(line.split('time=')[-1].split()[0])
-    return None
+async def ping_rtt(target, port=PROBE_PORT, timeout=1.0):
+    # one TCP handshake, timed in-process; RST still yields a path RTT
+    t0=time.perf_counter_ns()
+    try:
+        _, w=await asyncio.wait_for(asyncio.open_connection(target, port), timeout)
+        w.close()
+    except ConnectionRefusedError:
+        pass
+    except (OSError, asyncio.TimeoutError):
+        return None
+    return (time.perf_counter_ns()-t0)/1e6
 
 def measure_iperf(target, duration=3):
     # synchronous iperf3 client for portability
     client=iperf3.Client()
     client.server_hostname=target
+    client.port=IPERF_PORT
     client.duration=duration
     client.protocol='tcp'
     try:
@@ -45,26 +59,57 @@ def ewma(prev, sample, alpha=ALPHA):
         return prev
     return sample if prev is None else alpha*sample + (1-alpha)*prev
 
+def quantile(samples, q):
+    ok=sorted(s for s in samples if s is not None)
+    return ok[min(len(ok)-1, int(q*len(ok)))] if ok else None
+
 def apply_tc(dev, rate_bps):
-    # use token bucket filter to cap rate and limit queue size
+    # token bucket filter via netlink: caps rate and limits queue size
     rate_kbit = max(int(rate_bps/1000), 1000)
-    qlen = 50
-    cmd=f'tc qdisc replace dev {dev} root tbf rate {rate_kbit}kbit burst 32kbit latency 50ms'
-    subprocess.run(cmd, shell=True, check=False)
-    logging.info('Applied tc: %s', cmd)
+    idx = ipr.link_lookup(ifname=dev)[0]
+    ipr.tc('replace', 'tbf', idx, 0x10000, rate=f'{rate_kbit}kbit', burst=4096, latency='50ms')
+    logging.info('Applied tc tbf on %s: %d kbit', dev, rate_kbit)
 
-async def main_loop():
+def maybe_apply_tc(dev, rate_bps):
+    # skip kernel updates while the target stays inside the hysteresis band
+    cur = state.applied_rate
+    if cur is not None and abs(rate_bps - cur) <= HYSTERESIS*cur:
+        return False
+    try:
+        apply_tc(dev, rate_bps)
+    except (IndexError, OSError, NetlinkError) as e:
+        # missing link or no CAP_NET_ADMIN: applied_rate is unchanged, so the next round retries
+        logging.warning('tc on %s failed: %s', dev, e)
+        return False
+    state.applied_rate = rate_bps
+    return True
+
+async def bw_loop():
+    # throughput probes are long and blocking: run them off the event loop
+    loop=asyncio.get_running_loop()
     while True:
-        rtt = await ping_rtt(IP_TARGET)
-        bw = measure_iperf(IP_TARGET, duration=2)
-        state.rtt = ewma(state.rtt, rtt)
-        state.bw  = ewma(state.bw, bw)
-        logging.info('EWMA rtt=%.1f ms bw=%.1f Mbps', 
-                     (state.rtt or 0.0), (state.bw or 0.0)/1e6)
-        # control policy: if bw drops, reduce shaping to avoid build-up
-        target_rate = max(state.bw*0.8 if state.bw else BW_MIN, BW_MIN)
-        apply_tc(DEV, target_rate)
-        await asyncio.sleep(5)
+        try:
+            bw = await loop.run_in_executor(None, measure_iperf, IP_TARGET, 2)
+            state.bw = ewma(state.bw, bw)
+            # control policy: if bw drops, reduce shaping to avoid build-up
+            target_rate = max(state.bw*0.8 if state.bw else BW_MIN, BW_MIN)
+            maybe_apply_tc(DEV, target_rate)
+        except Exception:
+            logging.exception('bandwidth round failed; retrying')  # the task must outlive one bad round
+        await asyncio.sleep(RTT_INTERVAL*BW_EVERY)
+
+async def main_loop():
+    bw_task = asyncio.create_task(bw_loop())
+    try:
+        while True:
+            rtt = await ping_rtt(IP_TARGET)
+            state.rtt_window.append(rtt)
+            state.rtt = ewma(state.rtt, rtt)
+            logging.info('EWMA rtt=%.1f ms p95=%s bw=%.1f Mbps',
+                         (state.rtt or 0.0), quantile(state.rtt_window, 0.95), (state.bw or 0.0)/1e6)
+            await asyncio.sleep(RTT_INTERVAL)
+    finally:
+        bw_task.cancel()
 
 if __name__=='__main__':
-    asyncio.run(main_loop())
\ No newline at end of file
+    asyncio.run(main_loop())
@@ -1,62 +1,221 @@
 #!/usr/bin/env python3
-# TE solver: networkx topology + pulp LP -> per-commodity flows.
+# TE solver: networkx topology -> per-commodity path splits.
+# solve_lp: exact edge-flow LP (pulp), practical only for small instances.
+# solve_paths: path-based approximation over CSR arrays; capacity is priced
+#   multiplicatively and flow is shifted onto batched shortest paths
+#   (method of successive averages). Scales to thousands of links/commodities
+#   and warm-starts from a previous TEState when demands change.
+import time
 import networkx as nx
+import numpy as np
 import pulp
 from collections import defaultdict
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
 
-# Build topology (replace with BGP-LS / telemetry feed in prod).
-G = nx.DiGraph()
-G.add_edge('A','B',capacity=100,latency=10)
-G.add_edge('B','C',capacity=50,latency=20)
-G.add_edge('A','C',capacity=40,latency=30)
-G.add_edge('C','D',capacity=100,latency=5)
-
-# Commodities: each item is (src, dst, demand, priority_weight)
-commodities = [
-    ('A','D',30,5),      # control loop, high weight
-    ('A','C',20,2),      # video analytics
-]
-
-# Create LP variables f_i_j_k
-prob = pulp.LpProblem("TE", pulp.LpMinimize)
-f = {}
-for (u,v,data) in G.edges(data=True):
+def demo_topology():
+    # Build topology (replace with BGP-LS / telemetry feed in prod).
+    G = nx.DiGraph()
+    G.add_edge('A','B',capacity=100,latency=10)
+    G.add_edge('B','C',capacity=50,latency=20)
+    G.add_edge('A','C',capacity=40,latency=30)
+    G.add_edge('C','D',capacity=100,latency=5)
+    # Commodities: each item is (src, dst, demand, priority_weight)
+    commodities = [
+        ('A','D',30,5),      # control loop, high weight
+        ('A','C',20,2),      # video analytics
+    ]
+    return G, commodities
+
+def solve_lp(G, commodities):
+    """Exact edge x commodity LP; returns {k: [(u, v, flow)]} and objective."""
+    prob = pulp.LpProblem("TE", pulp.LpMinimize)
+    f = {}
+    for (u,v,data) in G.edges(data=True):
+        for k, (s,t,d,w) in enumerate(commodities):
+            f[(u,v,k)] = pulp.LpVariable(f"f_{u}_{v}_{k}", lowBound=0)
+
+    # Objective: minimize latency-weighted flow (weights reflect priority)
+    prob += pulp.lpSum(
+        data['latency'] * f[(u,v,k)] * commodities[k][3]
+        for (u,v,data) in G.edges(data=True) for k in range(len(commodities))
+    )
+    # Capacity constraints
+    for (u,v,data) in G.edges(data=True):
+        prob += pulp.lpSum(f[(u,v,k)] for k in range(len(commodities))) <= data['capacity']
+    # Flow conservation
     for k, (s,t,d,w) in enumerate(commodities):
-        name = f"f_{u}_{v}_{k}"
-        f[(u,v,k)] = pulp.LpVariable(name, lowBound=0)
-
-# Objective: minimize latency-weighted flow (weights reflect priority)
-prob += pulp.lpSum(
-    data['latency'] * f[(u,v,k)] * commodities[k][3]
-    for (u,v,data) in G.edges(data=True) for k in range(len(commodities))
-)
-
-# Capacity constraints
-for (u,v,data) in G.edges(data=True):
-    prob += pulp.lpSum(f[(u,v,k)] for k in range(len(commodities))) <= data['capacity']
-
-# Flow conservation
-for k, (s,t,d,w) in enumerate(commodities):
-    for node in G.nodes():
-        out = pulp.lpSum(f[(node,v,k)] for v in G.successors(node))
-        inn = pulp.lpSum(f[(u,node,k)] for u in G.predecessors(node))
-        rhs = d if node == s else (-d if node == t else 0)
-        prob += out - inn == rhs
-
-# Solve (use CBC or replace with commercial solver)
-prob.solve(pulp.PULP_CBC_CMD(msg=False))
-
-# Emit next-hop routing decisions (simple greedy per-commodity)
-routes = defaultdict(list)
-for k,(s,t,d,w) in enumerate(commodities):
-    # derive per-edge positive flows
-    edges = [(u,v, f[(u,v,k)].value()) for (u,v,_) in G.edges(data=True)]
-    # pick edges with flow > 0 and form simple forwarding table
-    for u,v,val in edges:
-        if val and val > 1e-6:
-            routes[k].append((u,v,val))
-# Print routing hints
-for k,(s,t,d,w) in enumerate(commodities):
-    print(f"Commodity {k} {s}->{t} demand={d}:")
-    for u,v,val in routes[k]:
-        print(f"  {u} -> {v} : {val}")
\ No newline at end of file
+        for node in G.nodes():
+            out = pulp.lpSum(f[(node,v,k)] for v in G.successors(node))
+            inn = pulp.lpSum(f[(u,node,k)] for u in G.predecessors(node))
+            rhs = d if node == s else (-d if node == t else 0)
+            prob += out - inn == rhs
+
+    # Solve (use CBC or replace with commercial solver)
+    prob.solve(pulp.PULP_CBC_CMD(msg=False))
+    routes = defaultdict(list)
+    for k in range(len(commodities)):
+        for u,v in G.edges():
+            val = f[(u,v,k)].value()
+            if val and val > 1e-6:
+                routes[k].append((u,v,val))
+    return routes, pulp.value(prob.objective)
+
+class CSRGraph:
+    """Edge arrays in CSR order; edge id == position in the CSR data array."""
+    def __init__(self, G):
+        self.nodes = list(G.nodes())
+        self.idx = {n: i for i, n in enumerate(self.nodes)}
+        e = sorted(((self.idx[u], self.idx[v], d['capacity'], d['latency'])
+                    for u, v, d in G.edges(data=True)))
+        n = len(self.nodes)
+        self.src = np.array([x[0] for x in e], dtype=np.int32)
+        self.dst = np.array([x[1] for x in e], dtype=np.int32)
+        self.cap = np.array([x[2] for x in e], dtype=np.float64)
+        self.lat = np.array([x[3] for x in e], dtype=np.float64)
+        self.indptr = np.concatenate(([0], np.cumsum(np.bincount(self.src, minlength=n)))).astype(np.int32)
+        self.eid = {(int(u), int(v)): i for i, (u, v) in enumerate(zip(self.src, self.dst))}
+        # one matrix object; only .data is rewritten per pricing round
+        self.mat = csr_matrix((self.lat.copy(), self.dst, self.indptr), shape=(n, n))
+
+    def path_edges(self, pred_row, s, t):
+        # walk the predecessor row back from t; returns edge ids or None
+        path, v = [], t
+        while v != s:
+            u = pred_row[v]
+            if u < 0:
+                return None
+            path.append(self.eid[(int(u), int(v))]); v = u
+        return tuple(reversed(path))
+
+class TEState:
+    """Warm-start state: per-commodity {edge-id path: flow} and the rounds averaged so far.
+
+    Edge loads are not stored; solve_paths rebuilds them from the rescaled splits.
+    """
+    def __init__(self, splits=None, iters=0):
+        self.splits = splits or {}  # (s, t, w) -> {path: flow}
+        self.iters = iters
+
+def solve_paths(G, commodities, rounds=40, eta=20.0, knee=0.9, state=None, csr=None):
+    """Approximate min latency-weighted multi-commodity flow.
+
+    Each round prices edges as w*latency + L*(exp(eta*max(util-knee, 0))-1),
+    so capacity only costs once a link nears saturation, then routes every
+    commodity on its shortest path (one Dijkstra batch per priority weight),
+    and averages that assignment into the current flow with step 1/(r+1).
+    Returns (TEState, objective, max_utilization).
+    """
+    g = csr or CSRGraph(G)
+    agg = defaultdict(float)  # identical (src, dst, weight) commodities share paths
+    for (s, t, d, w) in commodities:
+        agg[(s, t, w)] += d
+    keys = list(agg)
+    demand = np.fromiter(agg.values(), dtype=np.float64, count=len(keys))
+    splits, r0 = {}, 0
+    if state is not None:
+        # warm start: keep path mix, rescale to the new demand
+        r0 = state.iters
+        for key, d in zip(keys, demand):
+            old = state.splits.get(key)
+            tot = sum(old.values()) if old else 0.0
+            if tot > 0:
+                splits[key] = {p: f * d / tot for p, f in old.items()}
+    load = np.zeros(len(g.cap))
+    for paths in splits.values():
+        for p, f in paths.items():
+            load[list(p)] += f
+    L = g.lat.max() * max(k[2] for k in keys) if keys else 0.0
+    by_w = defaultdict(list)
+    for i, key in enumerate(keys):
+        by_w[key[2]].append(i)
+
+    for r in range(r0, r0 + rounds):
+        price = L * np.expm1(eta * np.maximum(load / g.cap - knee, 0.0))
+        step = 1.0 / (r + 1)
+        targets = {}
+        for w, members in by_w.items():
+            g.mat.data[:] = w * g.lat + price + 1e-12  # explicit zeros would drop edges
+            srcs = sorted({g.idx[keys[i][0]] for i in members})
+            _, pred = dijkstra(g.mat, directed=True, indices=srcs, return_predecessors=True)
+            row = {s: j for j, s in enumerate(srcs)}
+            for i in members:
+                s, t = g.idx[keys[i][0]], g.idx[keys[i][1]]
+                p = g.path_edges(pred[row[s]], s, t)
+                if p is not None:
+                    targets[i] = p
+        # shift `step` of every commodity onto its current shortest path
+        for i, p in targets.items():
+            cur = splits.setdefault(keys[i], {})
+            if not cur:
+                cur[p] = demand[i]; continue
+            for q in cur:
+                cur[q] *= (1.0 - step)
+            cur[p] = cur.get(p, 0.0) + step * demand[i]
+        load = np.zeros_like(load)
+        for paths in splits.values():
+            for p, f in paths.items():
+                load[list(p)] += f
+
+    for key, paths in splits.items():  # prune negligible paths
+        d = sum(paths.values())
+        splits[key] = {p: f for p, f in paths.items() if f > 1e-4 * d}
+    obj = sum(key[2] * f * g.lat[list(p)].sum() for key, paths in splits.items() for p, f in paths.items())
+    return TEState(splits, r0 + rounds), obj, float((load / g.cap).max()) if len(load) else 0.0
+
+def flow_rules(G, state, csr=None, scale=100):
+    """Per-switch select-group buckets: {(switch, src, dst): [(next_hop, weight)]}.
+
+    Weights are integer bucket weights (OVS `select` groups / Ryu OFPBucket).
+    """
+    g = csr or CSRGraph(G)
+    hop = defaultdict(lambda: defaultdict(float))
+    for (s, t, w), paths in state.splits.items():
+        for p, f in paths.items():
+            for e in p:
+                hop[(g.nodes[g.src[e]], s, t)][g.nodes[g.dst[e]]] += f
+    rules = {}
+    for key, nh in hop.items():
+        tot = sum(nh.values())
+        rules[key] = [(v, max(1, round(scale * f / tot))) for v, f in nh.items()]
+    return rules
+
+def compare(n=40, extra_edges=160, n_comm=60, seed=1):
+    # solve time and optimality gap of solve_paths vs the exact LP
+    rng = np.random.default_rng(seed)
+    G = nx.DiGraph()
+    for i in range(n):  # bidirectional ring keeps every pair reachable
+        for a, b in ((i, (i + 1) % n), ((i + 1) % n, i)):
+            G.add_edge(a, b, capacity=float(rng.integers(50, 150)), latency=float(rng.integers(1, 20)))
+    while G.number_of_edges() < 2 * n + extra_edges:
+        a, b = rng.integers(0, n, 2)
+        if a != b:
+            G.add_edge(int(a), int(b), capacity=float(rng.integers(20, 100)), latency=float(rng.integers(1, 30)))
+    comm = []
+    while len(comm) < n_comm:
+        s, t = rng.integers(0, n, 2)
+        if s != t:
+            comm.append((int(s), int(t), float(rng.integers(1, 10)), int(rng.integers(1, 6))))
+    t0 = time.perf_counter(); _, lp_obj = solve_lp(G, comm); t_lp = time.perf_counter() - t0
+    t0 = time.perf_counter(); st, obj, umax = solve_paths(G, comm); t_mw = time.perf_counter() - t0
+    comm2 = [(s, t, d * 1.1, w) for (s, t, d, w) in comm]
+    t0 = time.perf_counter(); _, obj2, _ = solve_paths(G, comm2, rounds=10, state=st); t_warm = time.perf_counter() - t0
+    print(f"LP: {t_lp:.3f}s obj={lp_obj:.1f} | paths: {t_mw:.3f}s obj={obj:.1f} "
+          f"gap={(obj - lp_obj) / lp_obj:.2%} max_util={umax:.2f} | warm (+10% demand): {t_warm:.3f}s")
+
+if __name__ == "__main__":
+    import sys
+    if "--compare" in sys.argv:
+        compare()
+        sys.exit(0)
+    G, commodities = demo_topology()
+    g = CSRGraph(G)
+    state, obj, umax = solve_paths(G, commodities, csr=g)
+    # Print routing hints
+    for (s, t, w), paths in state.splits.items():
+        print(f"Commodity {s}->{t} weight={w}:")
+        for p, f in paths.items():
+            hops = [g.nodes[g.src[e]] for e in p] + [t]
+            print(f"  {' -> '.join(map(str, hops))} : {f:.2f}")
+    for (sw, s, t), buckets in flow_rules(G, state, csr=g).items():
+        print(f"  switch {sw} [{s}->{t}] buckets={buckets}")
@@ -0,0 +1,143 @@
+# Breakout intent store shared by the local-breakout controllers
+# (Ch5 S2 I3 localbreakout.py over ovs-ofctl, Ch5 S3 I1 ryulocalbreakout.py over OpenFlow).
+# Intents live in a Patricia trie; overlaps are resolved by priority, and
+# redundant and adjacent same-port prefixes are aggregated to a minimal LPM rule set.
+import ipaddress
+
+RULE_BASE_PRIORITY = 100         # emitted rules use base + prefix length (LPM order)
+MASK32 = 0xffffffff
+
+class _Node:
+    __slots__ = ("net", "plen", "intent", "child")
+    def __init__(self, net, plen, intent=None):
+        self.net, self.plen, self.intent = net, plen, intent  # intent: (priority, port)
+        self.child = [None, None]
+
+class PrefixTrie:
+    """Path-compressed binary (Patricia) trie over IPv4 prefixes."""
+    def __init__(self):
+        self.root = _Node(0, 0)
+
+    @staticmethod
+    def _bit(net, depth):
+        return (net >> (31 - depth)) & 1
+
+    def insert(self, net, plen, intent):
+        cur = self.root
+        while True:
+            if cur.plen == plen:  # exact node (root, or reached by descent)
+                cur.intent = intent; return
+            b = self._bit(net, cur.plen)
+            nxt = cur.child[b]
+            if nxt is None:
+                cur.child[b] = _Node(net, plen, intent); return
+            diff = net ^ nxt.net
+            common = min(plen, nxt.plen, 32 - diff.bit_length())
+            if common == nxt.plen:
+                cur = nxt; continue
+            # split the compressed edge at the first differing bit
+            mid = _Node(net & (MASK32 << (32 - common)) & MASK32, common, intent if common == plen else None)
+            mid.child[self._bit(nxt.net, common)] = nxt
+            if common < plen:
+                mid.child[self._bit(net, common)] = _Node(net, plen, intent)
+            cur.child[b] = mid
+            return
+
+    def remove(self, net, plen):
+        parent, cur = None, self.root
+        while cur is not None and cur.plen < plen:
+            parent, cur = cur, cur.child[self._bit(net, cur.plen)]
+        if cur is None or cur.plen != plen or cur.net != net or cur.intent is None:
+            return False
+        cur.intent = None
+        kids = [c for c in cur.child if c is not None]
+        if parent is not None and len(kids) < 2:  # splice out empty glue
+            parent.child[self._bit(net, parent.plen)] = kids[0] if kids else None
+        return True
+
+    def longest_match(self, addr):
+        # most specific intent covering addr (LPM lookup)
+        best, cur = self.root.intent, self.root
+        while cur.plen < 32:
+            nxt = cur.child[self._bit(addr, cur.plen)]
+            if nxt is None or (addr ^ nxt.net) >> (32 - nxt.plen):
+                break
+            cur = nxt
+            if cur.intent is not None:
+                best = cur.intent
+        return best
+
+class IntentStore:
+    """Breakout intents -> minimal LPM rule set and rule diffs."""
+    def __init__(self):
+        self.trie = PrefixTrie()
+        self.count = 0
+
+    def add(self, cidr, port, priority=100):
+        # same prefix twice: keep the higher priority (ties: latest wins)
+        net = ipaddress.ip_network(cidr, strict=False)
+        key = int(net.network_address)
+        old = self.lookup(key, net.prefixlen)
+        if old is None:
+            self.count += 1
+        elif old[0] > priority:
+            return
+        self.trie.insert(key, net.prefixlen, (priority, port))
+
+    def remove(self, cidr):
+        net = ipaddress.ip_network(cidr, strict=False)
+        if self.trie.remove(int(net.network_address), net.prefixlen):
+            self.count -= 1
+
+    def lookup(self, net, plen):
+        cur = self.trie.root
+        while cur is not None and cur.plen < plen:
+            cur = cur.child[PrefixTrie._bit(net, cur.plen)]
+        return cur.intent if cur is not None and cur.plen == plen and cur.net == net else None
+
+    def aggregate(self):
+        """{(net_int, plen): port} with identical forwarding under LPM.
+
+        A prefix shadowed by a higher-priority covering intent is dropped, as
+        is one whose nearest effective ancestor already uses the same port;
+        then sibling prefixes with equal ports are merged bottom-up.
+        """
+        kept = {}
+        stack = [(self.trie.root, None)]
+        while stack:
+            n, eff = stack.pop()
+            if n.intent is not None:
+                prio, port = n.intent
+                if eff is None or (prio >= eff[0] and port != eff[1]):
+                    kept[(n.net, n.plen)] = port; eff = n.intent
+                elif prio >= eff[0]:
+                    eff = (prio, port)  # redundant, but raises the shadowing bar
+            stack.extend((c, eff) for c in n.child if c is not None)
+        by_len = [set() for _ in range(33)]
+        for net, plen in kept:
+            by_len[plen].add(net)
+        for plen in range(32, 0, -1):
+            for net in sorted(by_len[plen]):
+                port = kept.get((net, plen))
+                sib = net ^ (1 << (32 - plen))
+                if port is None or kept.get((sib, plen)) != port:
+                    continue
+                del kept[(net, plen)], kept[(sib, plen)]
+                parent = (net & ~(1 << (32 - plen)) & MASK32, plen - 1)
+                kept.pop(parent, None)  # fully shadowed by its two children
+                if self._covering(kept, *parent) != port:
+                    kept[parent] = port; by_len[plen - 1].add(parent[0])
+        return kept
+
+    @staticmethod
+    def _covering(kept, net, plen):
+        for q in range(plen - 1, -1, -1):
+            port = kept.get((net & (MASK32 << (32 - q)) & MASK32, q))
+            if port is not None:
+                return port
+        return None
+
+    def rules(self):
+        # {(IPv4Network, priority): port}; priority = base + prefix length keeps LPM order
+        return {(ipaddress.IPv4Network((net, plen)), RULE_BASE_PRIORITY + plen): port
+                for (net, plen), port in self.aggregate().items()}
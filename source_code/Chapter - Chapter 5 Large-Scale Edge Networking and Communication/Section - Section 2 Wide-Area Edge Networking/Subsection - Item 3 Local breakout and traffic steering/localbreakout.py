@@ -1,29 +1,124 @@
 #!/usr/bin/env python3
 # Minimal controller to program OVS flows for local breakout.
+# Intents live in a Patricia trie; overlaps are resolved by priority, redundant
+# and adjacent same-port prefixes are aggregated, and only the rule diff
+# against the bridge is applied, as one atomic `ovs-ofctl --bundle` transaction.
 import subprocess
 import ipaddress
+import re
+import tempfile
+from intenttrie import IntentStore, MASK32  # shared with Ch5 S3 I1 ryulocalbreakout.py
 
 OVS_BRIDGE = "br-edge"           # OVS bridge on edge node
 LOCAL_IFACE = "if-local-out"     # interface to local breakout/MEC
 CORE_IFACE = "if-core-out"       # interface towards core/backhaul
+BREAKOUT_COOKIE = "0xb0"         # tags breakout flows so dumps can be filtered
 
-def run(cmd):
-    subprocess.run(cmd, shell=True, check=True)
+FLOW_RE = re.compile(r'priority=(\d+),ip,nw_dst=([\d.]+(?:/\d+)?) .*actions=output:"?([\w.-]+)"?')
+
+def run(args, **kw):
+    # argv list, no shell: prefixes and names never reach a shell parser
+    return subprocess.run(args, check=True, **kw)
+
+def breakout_match(cidr, priority, cookie=BREAKOUT_COOKIE):
+    net = ipaddress.ip_network(cidr)
+    return f"cookie={cookie},priority={priority},ip,nw_dst={net.network_address}/{net.prefixlen}"
 
 def install_breakout(cidr, priority=100):
     # Match source or destination CIDR, output to LOCAL_IFACE
-    net = ipaddress.ip_network(cidr)
-    match = f"ip, nw_dst={net.network_address}/{net.prefixlen}"
-    cmd = f"ovs-ofctl add-flow {OVS_BRIDGE} \"priority={priority},{match},actions=output:{LOCAL_IFACE}\""
-    run(cmd)
+    run(["ovs-ofctl", "add-flow", OVS_BRIDGE, f"{breakout_match(cidr, priority)},actions=output:{LOCAL_IFACE}"])
 
 def install_core_fallback(priority=50):
     # Default low-priority rule sends remaining traffic to core.
-    cmd = f"ovs-ofctl add-flow {OVS_BRIDGE} \"priority={priority},ip,actions=output:{CORE_IFACE}\""
-    run(cmd)
+    run(["ovs-ofctl", "add-flow", OVS_BRIDGE, f"priority={priority},ip,actions=output:{CORE_IFACE}"])
+
+def installed_breakouts():
+    # {(network, priority): out_port} for flows carrying the breakout cookie;
+    # --names: captured output would otherwise show ofport numbers, not the names rules use
+    out = run(["ovs-ofctl", "dump-flows", "--no-stats", "--names", OVS_BRIDGE, f"cookie={BREAKOUT_COOKIE}/-1"],
+              capture_output=True, text=True).stdout
+    flows = {}
+    for line in out.splitlines():
+        m = FLOW_RE.search(line)
+        if m:
+            flows[(ipaddress.ip_network(m.group(2)), int(m.group(1)))] = m.group(3)
+    return flows
+
+def breakout_diff(desired, installed):
+    """Flow-file lines turning `installed` into `desired`.
+
+    Both map (ip_network, priority) -> out_port. Unchanged flows produce no line.
+    """
+    lines = []
+    for (net, prio), port in desired.items():
+        if installed.get((net, prio)) != port:
+            lines.append(f"add {breakout_match(net, prio)},actions=output:{port}")
+    for net, prio in installed.keys() - desired.keys():
+        # mod/delete_strict only accept a masked cookie (it is a match there, not a value)
+        lines.append(f"delete_strict {breakout_match(net, prio, f'{BREAKOUT_COOKIE}/-1')}")
+    return lines
+
+def sync_breakouts(store):
+    # Apply only the delta of the aggregated rule set, all-or-nothing, in one OpenFlow bundle.
+    lines = breakout_diff(store.rules(), installed_breakouts())
+    if not lines:
+        return 0
+    with tempfile.NamedTemporaryFile("w", suffix=".flows") as f:
+        f.write("\n".join(lines) + "\n"); f.flush()
+        run(["ovs-ofctl", "--bundle", "-O", "OpenFlow14", "add-flows", OVS_BRIDGE, f.name])
+    return len(lines)
+
+def synthetic_mec_prefixes(n=100_000, seed=7):
+    # MEC subnet lists: contiguous /24 runs per site, some duplicates,
+    # more-specific carve-outs to other ports, and a few covering aggregates.
+    import random
+    rng = random.Random(seed)
+    out, base = [], 10 << 24
+    while len(out) < n:
+        site_port = rng.choice([LOCAL_IFACE, LOCAL_IFACE, "if-mec-2", "if-mec-3"])
+        start = base + (rng.randrange(0, 1 << 16) << 8)
+        run_len = rng.choice([1, 2, 4, 8, 16, 32, 64])
+        for i in range(run_len):
+            net = ipaddress.IPv4Network((start + (i << 8), 24))
+            out.append((str(net), site_port, 100))
+            r = rng.random()
+            if r < 0.05:
+                out.append((str(net), site_port, 100))  # duplicate intent
+            elif r < 0.10:
+                sub = ipaddress.IPv4Network((start + (i << 8) + (rng.randrange(4) << 6), 26))
+                out.append((str(sub), rng.choice([CORE_IFACE, "if-mec-2"]), 150))
+        if rng.random() < 0.02:
+            out.append((str(ipaddress.IPv4Network((start & ~0xffff & MASK32, 16))), site_port, 90))
+    return out[:n]
 
 if __name__ == "__main__":
+    import sys, time
+    if len(sys.argv) > 1 and sys.argv[1] == "--tcam-report":
+        # rule count before/after aggregation on a synthetic 100k-prefix MEC list
+        intents = synthetic_mec_prefixes(int(sys.argv[2]) if len(sys.argv) > 2 else 100_000)
+        store = IntentStore()
+        t0 = time.perf_counter()
+        for cidr, port, prio in intents:
+            store.add(cidr, port, prio)
+        t1 = time.perf_counter(); rules = store.rules(); t2 = time.perf_counter()
+        print(f"intents={len(intents)} unique={store.count} rules={len(rules)} "
+              f"({1 - len(rules) / len(intents):.1%} fewer TCAM entries) "
+              f"insert={t1 - t0:.2f}s aggregate={t2 - t1:.2f}s")
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == "--bench":
+        # e.g. --bench 10000: program N /32 prefixes from an empty bridge
+        n = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+        store = IntentStore()
+        for i in range(n):
+            store.add(f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}/32", LOCAL_IFACE if i % 3 else CORE_IFACE)
+        t0 = time.perf_counter(); changed = sync_breakouts(store); dt = time.perf_counter() - t0
+        print(f"{changed} rules in {dt:.2f}s ({changed / dt:.0f} rules/s)")
+        t0 = time.perf_counter(); changed = sync_breakouts(store)
+        print(f"resync: {changed} changes in {time.perf_counter() - t0:.2f}s")
+        sys.exit(0)
     # Example: steer AR/VR service subnet to local MEC
-    install_breakout("10.10.100.0/24", priority=200)
+    store = IntentStore()
+    store.add("10.10.100.0/24", LOCAL_IFACE, priority=200)
+    sync_breakouts(store)
     # Install fallback to core
-    install_core_fallback()
\ No newline at end of file
+    install_core_fallback()
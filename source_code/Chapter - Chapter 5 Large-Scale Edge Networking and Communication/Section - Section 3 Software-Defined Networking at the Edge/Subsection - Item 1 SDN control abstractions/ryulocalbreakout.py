@@ -1,14 +1,28 @@
 # Minimal production-ready Ryu app: install/remove flows via REST.
+# Intents are kept per datapath in a Patricia trie and aggregated to a minimal
+# LPM rule set; FlowMods go out only for the diff against the switch's
+# installed breakout flows, in chunks fenced by barriers.
 from ryu.base import app_manager
 from ryu.controller import ofp_event
-from ryu.controller.handler import MAIN_DISPATCHER
+from ryu.controller.handler import MAIN_DISPATCHER, set_ev_cls
 from ryu.lib import hub
 from ryu.ofproto import ofproto_v1_3
 from ryu.app.wsgi import WSGIApplication, ControllerBase, route
-import json, logging
+import ipaddress, json, logging, os, sys
+
+# the intent store is shared with Ch5 S2 I3 localbreakout.py; INTENTTRIE_DIR overrides its location
+sys.path.append(os.getenv("INTENTTRIE_DIR", os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir,
+    "Section - Section 2 Wide-Area Edge Networking", "Subsection - Item 3 Local breakout and traffic steering")))
+from intenttrie import IntentStore, RULE_BASE_PRIORITY
 
 LOG = logging.getLogger('ryu.app.local_breakout')
 
+BREAKOUT_COOKIE = 0xb0   # marks flows owned by this app
+CHUNK = 512              # FlowMods per barrier
+BARRIER_TIMEOUT = 5.0    # seconds to wait for each barrier reply
+RESYNC_INTERVAL = 60     # seconds between flow dumps that repair drift
+
 class LocalBreakoutController(ControllerBase):
     def __init__(self, req, link, data, **config):
         super(LocalBreakoutController, self).__init__(req, link, data, **config)
@@ -19,13 +33,37 @@ class LocalBreakoutController(ControllerBase):
         body = req.json if req.body else {}
         try:
             dp_id = int(body['dp_id'])
-            ip_prefix = body['ip_prefix']            # e.g., "10.1.0.0/24"
+            ip_prefix = self.app._prefix(body['ip_prefix'])  # e.g., "10.1.0.0/24"
             out_port = int(body['out_port'])
-        except (KeyError, ValueError):
+        except (KeyError, ValueError, TypeError):
             return ('Bad Request', 400)
         self.app.install_local_breakout(dp_id, ip_prefix, out_port)
         return ('OK', 200)
 
+    @route('local_breakout', '/intent', methods=['DELETE'])
+    def remove_intent(self, req, **kwargs):
+        body = req.json if req.body else {}
+        try:
+            dp_id = int(body['dp_id'])
+            ip_prefix = self.app._prefix(body['ip_prefix'])
+        except (KeyError, ValueError, TypeError):
+            return ('Bad Request', 400)
+        sent = self.app.remove_intents(dp_id, [ip_prefix])
+        return (json.dumps({'flow_mods': sent}), 200)
+
+    @route('local_breakout', '/intents', methods=['POST'])
+    def add_intents(self, req, **kwargs):
+        # {"dp_id": 1, "replace": false, "intents": [{"ip_prefix", "out_port", "priority"?}]}
+        body = req.json if req.body else {}
+        try:
+            dp_id = int(body['dp_id'])
+            intents = {(self.app._prefix(i['ip_prefix']), int(i.get('priority', 100))): int(i['out_port'])
+                       for i in body['intents']}
+        except (KeyError, ValueError, TypeError):
+            return ('Bad Request', 400)
+        sent = self.app.install_intents(dp_id, intents, replace=bool(body.get('replace')))
+        return (json.dumps({'flow_mods': sent}), 200)
+
 class LocalBreakoutApp(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
     _CONTEXTS = {'wsgi': WSGIApplication}
@@ -35,30 +73,143 @@ class LocalBreakoutApp(app_manager.RyuApp):
         wsgi = kwargs['wsgi']
         wsgi.register(LocalBreakoutController, {'app': self})
         self.datapaths = {}
+        self.intents = {}      # dp_id -> IntentStore (desired)
+        self._adopt = set()    # dp_ids whose next flow dump seeds their intents
+        self.installed = {}    # dp_id -> {(prefix, priority): out_port} on switch
+        self._dump = {}        # dp_id -> partial flow-stats reply being assembled
+        self._barriers = {}    # xid -> hub.Event
+        self._push_locks = {}  # dp_id -> hub.Semaphore; one diff/push per datapath at a time
         self.monitor_thread = hub.spawn(self._monitor)
 
     def _monitor(self):
         while True:
-            hub.sleep(10)  # periodic tasks, health checks
+            hub.sleep(RESYNC_INTERVAL)  # re-dump flows; the reply handler repairs drift
+            for dp in list(self.datapaths.values()):
+                self._request_flows(dp)
+
+    def _request_flows(self, dp):
+        parser = dp.ofproto_parser; ofp = dp.ofproto
+        self._dump[dp.id] = {}
+        dp.send_msg(parser.OFPFlowStatsRequest(dp, 0, ofp.OFPTT_ALL, ofp.OFPP_ANY, ofp.OFPG_ANY,
+                                               BREAKOUT_COOKIE, 0xffffffffffffffff, parser.OFPMatch()))
 
     @set_ev_cls(ofp_event.EventOFPStateChange, MAIN_DISPATCHER)
     def _state_change_handler(self, ev):
         dp = ev.datapath
         self.datapaths[dp.id] = dp
+        # Learn what survived on the switch, then push only the difference.
+        self._adopt.add(dp.id)
+        self._request_flows(dp)
 
-    def install_local_breakout(self, dp_id, ip_prefix, out_port, priority=100):
-        dp = self.datapaths.get(dp_id)
-        if not dp:
-            LOG.error('Datapath %s not connected', dp_id)
-            return
+    @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER)
+    def _flow_stats_reply_handler(self, ev):
+        dp = ev.msg.datapath
+        seen = self._dump.setdefault(dp.id, {})
+        for st in ev.msg.body:
+            prefix = self._prefix(st.match.get('ipv4_dst'))
+            outs = [a.port for i in st.instructions for a in getattr(i, 'actions', [])
+                    if hasattr(a, 'port')]
+            if prefix and outs:
+                seen[(prefix, st.priority)] = outs[0]
+        if not ev.msg.flags & dp.ofproto.OFPMPF_REPLY_MORE:
+            self.installed[dp.id] = self._dump.pop(dp.id)
+            if dp.id in self._adopt:
+                # after a controller restart the switch is the source of truth;
+                # its (already aggregated) rules become intents again
+                self._adopt.discard(dp.id)
+                store = self.intents.setdefault(dp.id, IntentStore())
+                for (prefix, _), port in self.installed[dp.id].items():
+                    net = ipaddress.ip_network(prefix)
+                    if store.lookup(int(net.network_address), net.prefixlen) is None:
+                        store.add(prefix, port, RULE_BASE_PRIORITY)  # LPM order, no shadowing
+            hub.spawn(self._push, dp.id)
+
+    @set_ev_cls(ofp_event.EventOFPBarrierReply, MAIN_DISPATCHER)
+    def _barrier_reply_handler(self, ev):
+        done = self._barriers.pop(ev.msg.xid, None)
+        if done:
+            done.set()
+
+    @staticmethod
+    def _prefix(ipv4_dst):
+        # OFPMatch reports masked fields as (addr, mask); normalize to "a.b.c.d/len" with host
+        # bits cleared, so "10.1.0.5/24" and a dumped 10.1.0.0/24 are the same rule key
+        if ipv4_dst is None:
+            return None
+        if isinstance(ipv4_dst, tuple):
+            ipv4_dst = '%s/%s' % ipv4_dst
+        return str(ipaddress.ip_network(ipv4_dst, strict=False))
+
+    def _flow_mod(self, dp, prefix, priority, out_port=None, delete=False):
         ofp = dp.ofproto; parser = dp.ofproto_parser
-        match = parser.OFPMatch(eth_type=0x0800, ipv4_dst=ip_prefix)
+        addr, plen = prefix.split('/')
+        mask = '.'.join(str((0xffffffff << (32 - int(plen)) >> s) & 0xff) for s in (24, 16, 8, 0))
+        match = parser.OFPMatch(eth_type=0x0800, ipv4_dst=(addr, mask))
+        if delete:
+            return parser.OFPFlowMod(datapath=dp, command=ofp.OFPFC_DELETE_STRICT, priority=priority,
+                                     out_port=ofp.OFPP_ANY, out_group=ofp.OFPG_ANY, match=match)
         actions = [parser.OFPActionOutput(out_port)]
         inst = [parser.OFPInstructionActions(ofp.OFPIT_APPLY_ACTIONS, actions)]
-        mod = parser.OFPFlowMod(datapath=dp, priority=priority,
-                                match=match, instructions=inst, idle_timeout=300)
-        try:
-            dp.send_msg(mod)
-            LOG.info('Installed breakout on %s -> %s', dp_id, ip_prefix)
-        except Exception as e:
-            LOG.exception('Flow install failed: %s', e)
\ No newline at end of file
+        return parser.OFPFlowMod(datapath=dp, cookie=BREAKOUT_COOKIE, priority=priority,
+                                 match=match, instructions=inst)
+
+    def _barrier(self, dp):
+        req = dp.ofproto_parser.OFPBarrierRequest(dp)
+        dp.set_xid(req)
+        done = self._barriers[req.xid] = hub.Event()
+        dp.send_msg(req)
+        return done
+
+    def _push(self, dp_id):
+        """Send FlowMods for aggregated-vs-installed diffs; returns the count sent."""
+        # REST calls and flow-dump resyncs both push; interleaved diffs would race on `installed`
+        with self._push_locks.setdefault(dp_id, hub.Semaphore()):
+            return self._push_locked(dp_id)
+
+    def _push_locked(self, dp_id):
+        dp = self.datapaths.get(dp_id)
+        if not dp:
+            LOG.error('Datapath %s not connected', dp_id)
+            return 0
+        # rules keyed ("a.b.c.d/len", priority), the form flow dumps are normalized to
+        want = {(str(net), prio): port for (net, prio), port in self.intents.setdefault(dp_id, IntentStore()).rules().items()}
+        have = self.installed.setdefault(dp_id, {})
+        mods = [(k, v) for k, v in want.items() if have.get(k) != v]
+        mods += [(k, None) for k in have.keys() - want.keys()]
+        for i in range(0, len(mods), CHUNK):
+            chunk = mods[i:i + CHUNK]
+            try:
+                for (prefix, prio), port in chunk:
+                    dp.send_msg(self._flow_mod(dp, prefix, prio, port, delete=port is None))
+                if not self._barrier(dp).wait(timeout=BARRIER_TIMEOUT):
+                    LOG.warning('Barrier timeout on %s after %d flow mods', dp_id, i + len(chunk))
+                    return i
+            except Exception as e:
+                LOG.exception('Flow install failed: %s', e)
+                return i
+            for k, port in chunk:  # confirmed by the barrier
+                if port is None:
+                    have.pop(k, None)
+                else:
+                    have[k] = port
+        LOG.info('Synced %d breakout flow mods on %s', len(mods), dp_id)
+        return len(mods)
+
+    def install_intents(self, dp_id, intents, replace=False):
+        # Merge (or replace) the desired set, then program only what changed.
+        if replace or dp_id not in self.intents:
+            self.intents[dp_id] = IntentStore()
+        store = self.intents[dp_id]
+        for (prefix, prio), port in intents.items():
+            store.add(prefix, port, prio)
+        return self._push(dp_id)
+
+    def remove_intents(self, dp_id, prefixes):
+        store = self.intents.setdefault(dp_id, IntentStore())
+        for prefix in prefixes:
+            store.remove(prefix)
+        return self._push(dp_id)
+
+    def install_local_breakout(self, dp_id, ip_prefix, out_port, priority=100):
+        prefix = self._prefix(ip_prefix)
+        return self.install_intents(dp_id, {(prefix, priority): out_port})
@@ -1,14 +1,27 @@
-import sqlite3, json, time
+import sqlite3, json, time, queue, threading, heapq, logging
 import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
 
 DB_PATH = "/var/lib/edge_agg/state.db"
 MQTT_BROKER = "127.0.0.1"
 TOPIC = "telemetry/#"
+BATCH_MAX = 2000        # messages per group commit
+BATCH_DELAY = 0.02      # seconds: upper bound on the durability window
+REORDER_WINDOW = 64     # max sequence gap buffered per producer
+REORDER_TIMEOUT = 0.5   # seconds a gap may stay open before skipping ahead
+COMMIT_RETRY_S = 0.5    # wait between attempts when the group commit fails
+# Unacked QoS1 messages the broker sends before waiting for PUBACKs. Requested as the
+# MQTT v5 Receive Maximum; v3.1.1 clients get the broker's max_inflight_messages
+# (mosquitto default 20), so raise that setting, and max_queued_messages for the
+# backlog, on the broker. Half a window unacked (batch plus reorder buffers) forces a commit.
+RECEIVE_MAX = 4096
 
-# durable DB init (ensure WAL for concurrency, fsync on commit).
-def init_db():
-    conn = sqlite3.connect(DB_PATH, isolation_level="EXCLUSIVE", timeout=10)
+# durable DB init (WAL; synchronous=FULL so each group commit is fsynced).
+def init_db(path=DB_PATH):
+    conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
     conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA synchronous=FULL;")
     conn.execute("""CREATE TABLE IF NOT EXISTS last_seq (
                         producer TEXT PRIMARY KEY,
                         seq INTEGER NOT NULL
@@ -16,44 +29,195 @@ def init_db():
     conn.commit()
     return conn
 
-conn = init_db()
-
-def accept_message(producer: str, seq: int) -> bool:
-    # returns True if message is new and accepted in order
-    cur = conn.cursor()
-    cur.execute("SELECT seq FROM last_seq WHERE producer = ?;", (producer,))
-    row = cur.fetchone()
-    if row is None:
-        # insert first-seen sequence; durable commit
-        cur.execute("INSERT INTO last_seq(producer, seq) VALUES(?,?);", (producer, seq))
-        conn.commit()
-        return True
-    last = row[0]
-    if seq <= last:
-        return False  # duplicate or out-of-order older
-    # allow only monotonic increase; for gaps, could buffer or request retransmit
-    cur.execute("UPDATE last_seq SET seq = ? WHERE producer = ?;", (seq, producer))
-    conn.commit()
-    return True
-
-def on_message(client, userdata, msg):
-    # minimal validation and ordering
-    payload = json.loads(msg.payload.decode())
-    producer = payload["device_id"]
-    seq = int(payload["seq"])
-    if accept_message(producer, seq):
-        process(payload)  # application-specific, idempotent
-    else:
-        # drop duplicate/old; logging for diagnostics
-        pass
+class SequenceTracker:
+    """In-memory last_seq map with a bounded per-producer reorder buffer.
+
+    offer() returns the messages now deliverable in order; duplicates and
+    stale sequences are returned separately so they can be acked and dropped.
+    """
+    def __init__(self, conn):
+        self.last = dict(conn.execute("SELECT producer, seq FROM last_seq;"))
+        self.pending = {}  # producer -> heap of (seq, arrival, tiebreak, msg, payload)
+        self.buffered = 0  # messages across all heaps (held unacked)
+        self.dirty = set()
+
+    def offer(self, producer, seq, msg, payload, now):
+        ready = []
+        last = self.last.get(producer)
+        if last is not None and seq <= last:
+            return ready, [msg]  # duplicate or out-of-order older
+        heap = self.pending.setdefault(producer, [])
+        if any(s == seq for s, *_ in heap):
+            return ready, [msg]
+        heapq.heappush(heap, (seq, now, id(msg), msg, payload)); self.buffered += 1
+        if last is not None and seq - last > REORDER_WINDOW:
+            # too far ahead to wait for: give up on the gap
+            self._release(producer, heap, ready, force=True)
+        else:
+            self._release(producer, heap, ready)
+        return ready, []
+
+    def _release(self, producer, heap, ready, force=False):
+        while heap:
+            last = self.last.get(producer)
+            seq = heap[0][0]
+            if last is not None and seq != last + 1 and not force:
+                break
+            seq, _, _, msg, payload = heapq.heappop(heap); self.buffered -= 1
+            self.last[producer] = seq
+            self.dirty.add(producer)
+            ready.append((msg, payload))
+            force = False
+
+    def expire(self, now, force=False):
+        # gaps older than REORDER_TIMEOUT (all gaps when forced) are skipped; buffered data flows on
+        ready = []
+        for producer, heap in self.pending.items():
+            if heap and (force or now - heap[0][1] > REORDER_TIMEOUT):
+                self._release(producer, heap, ready, force=True)
+        return ready
+
+    def flush(self, conn):
+        # one transaction for every producer advanced in this batch
+        if not self.dirty:
+            return
+        rows = [(p, self.last[p]) for p in self.dirty]
+        with conn:
+            conn.executemany("INSERT INTO last_seq(producer, seq) VALUES(?,?) "
+                             "ON CONFLICT(producer) DO UPDATE SET seq = excluded.seq;", rows)
+        self.dirty.clear()
 
 def process(payload):
     # placeholder: lightweight, idempotent processing
     # ensure downstream at-least-once semantics or transactional write
     print("Processed", payload["device_id"], payload["seq"])
 
-client = mqtt.Client(client_id="edge_aggregator")
-client.on_message = on_message
-client.connect(MQTT_BROKER)
-client.subscribe(TOPIC, qos=1)
-client.loop_forever()
\ No newline at end of file
+def _handle(handler, payload):
+    # a failing handler drops its message (logged) instead of killing the worker thread
+    try:
+        handler(payload)
+    except Exception:
+        logging.exception("handler failed on %s seq %s; message dropped", payload["device_id"], payload["seq"])
+
+def batch_worker(inbox, conn, ack, handler=process, stop=None, window=None):
+    # Drain micro-batches, process in order, group-commit, then ack.
+    # A crash before the commit means redelivery (handler must be idempotent).
+    # With a broker inflight `window`, a batch closes early once half of it is unacked.
+    tracker = SequenceTracker(conn)
+    flush_at = max(1, window // 2) if window else None
+    while stop is None or not stop.is_set():
+        batch, deadline = [], time.monotonic() + BATCH_DELAY
+        while len(batch) < BATCH_MAX and not (flush_at and len(batch) + tracker.buffered >= flush_at):
+            try:
+                batch.append(inbox.get(timeout=max(0.0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        now = time.monotonic()
+        to_ack = []
+        for msg in batch:
+            try:
+                payload = json.loads(msg.payload.decode())
+                producer, seq = payload["device_id"], int(payload["seq"])
+            except (ValueError, KeyError):
+                to_ack.append(msg); continue  # malformed: never deliverable
+            ready, dropped = tracker.offer(producer, seq, msg, payload, now)
+            to_ack.extend(dropped)
+            for m, p in ready:
+                _handle(handler, p); to_ack.append(m)
+        # gaps can't fill while reorder buffers hold the window: the broker sends nothing more
+        for m, p in tracker.expire(now, force=bool(flush_at and tracker.buffered >= flush_at)):
+            _handle(handler, p); to_ack.append(m)
+        while True:
+            try:
+                tracker.flush(conn)
+                break
+            except sqlite3.Error:
+                logging.exception("group commit failed; %d acks held", len(to_ack))
+                if stop is not None and stop.is_set():
+                    return
+                time.sleep(COMMIT_RETRY_S)
+        for m in to_ack:  # only after the group commit is durable
+            ack(m)
+
+def main():
+    conn = init_db()
+    inbox = queue.Queue(maxsize=100_000)
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id="edge_aggregator",
+                         protocol=mqtt.MQTTv5, manual_ack=True)
+    client.on_message = lambda c, u, msg: inbox.put(msg)  # network thread only enqueues
+    ack = lambda m: client.ack(m.mid, m.qos)
+    threading.Thread(target=batch_worker, args=(inbox, conn, ack), kwargs={"window": RECEIVE_MAX},
+                     daemon=True).start()
+    props = Properties(PacketTypes.CONNECT)
+    props.ReceiveMaximum, props.SessionExpiryInterval = RECEIVE_MAX, 3600  # persistent session
+    client.connect(MQTT_BROKER, clean_start=False, properties=props)
+    client.subscribe(TOPIC, qos=1)
+    client.loop_forever()
+
+def bench(n=200_000, producers=500, path="/tmp/mqconsumer_bench.db", seconds=2.0):
+    # broker stand-in: pre-built messages with mild reordering and 1% duplicates
+    import os, random
+    class Msg:
+        __slots__ = ("payload", "mid", "qos")
+        def __init__(self, payload, mid):
+            self.payload, self.mid, self.qos = payload, mid, 1
+    global BATCH_DELAY
+    rng = random.Random(1)
+    seqs = [0] * producers
+    msgs = []
+    for mid in range(n):
+        p = rng.randrange(producers); seqs[p] += 1
+        msgs.append(Msg(json.dumps({"device_id": f"dev{p}", "seq": seqs[p]}).encode(), mid))
+        if rng.random() < 0.01:
+            msgs.append(msgs[-1])
+    for i in range(0, len(msgs) - 1, 7):  # adjacent swaps -> small gaps
+        msgs[i], msgs[i + 1] = msgs[i + 1], msgs[i]
+    for delay in (0.002, 0.02, 0.1):
+        for f in (path, path + "-wal", path + "-shm"):
+            if os.path.exists(f):
+                os.remove(f)
+        BATCH_DELAY = delay
+        conn, inbox, stop = init_db(path), queue.Queue(), threading.Event()
+        acked = [0]
+        def ack(m):
+            acked[0] += 1
+            if acked[0] == len(msgs):
+                stop.set()
+        t0 = time.perf_counter()
+        worker = threading.Thread(target=batch_worker, args=(inbox, conn, ack, lambda p: None, stop))
+        worker.start()
+        for m in msgs:
+            inbox.put(m)
+        worker.join()
+        dt = time.perf_counter() - t0
+        print(f"window={delay * 1000:.0f}ms: {len(msgs) / dt:,.0f} msgs/s")
+
+    # emulated broker: delivers QoS1 messages only while fewer than `window` are unacked,
+    # and each PUBACK (the worker's ack after the group commit) frees a slot
+    BATCH_DELAY = 0.02
+    for label, window, inflight in (("timer commits", 20, None), ("window flush", 20, 20),
+                                    ("window flush", RECEIVE_MAX, RECEIVE_MAX)):
+        for f in (path, path + "-wal", path + "-shm"):
+            if os.path.exists(f):
+                os.remove(f)
+        conn, inbox, stop = init_db(path), queue.Queue(), threading.Event()
+        slots, acked = threading.Semaphore(window), [0]
+        def ack(m):
+            acked[0] += 1; slots.release()
+        def deliver():
+            i = 0
+            while not stop.is_set():
+                if slots.acquire(timeout=0.05):
+                    inbox.put(msgs[i % len(msgs)]); i += 1
+        worker = threading.Thread(target=batch_worker, args=(inbox, conn, ack, lambda p: None, stop, inflight))
+        broker = threading.Thread(target=deliver)
+        worker.start(); broker.start()
+        t0 = time.perf_counter()
+        time.sleep(seconds)
+        n_acked, dt = acked[0], time.perf_counter() - t0
+        stop.set(); broker.join(); worker.join()
+        print(f"broker, inflight {window:5d}, {label:13s}: {n_acked / dt:10,.0f} msgs/s committed and acked")
+
+if __name__ == "__main__":
+    import sys
+    bench() if "--bench" in sys.argv else main()
@@ -2,15 +2,19 @@
 """
 Production-ready edge aggregator:
 - subscribes to local telemetry topics
-- windowed aggregation (count, mean, max)
-- publishes summarized JSON to upstream broker with TLS and backoff
+- windowed aggregation (count, mean, max, optional quantiles) in compact
+  per-key NumPy accumulators; tumbling or sliding (pane-based) windows
+- windows close on a timer, independent of message arrival
+- summaries are queued and published upstream in batches (TLS, backoff),
+  so ingest never waits on the upstream broker
 """
 import os
 import asyncio
 import json
 import ssl
+import time
 from datetime import datetime, timezone
-from collections import defaultdict
+import numpy as np
 import asyncio_mqtt as aiomqtt  # install: pip install asyncio-mqtt
 
 BROKER = os.getenv("UPSTREAM_BROKER", "upstream.example.com")
@@ -19,35 +23,194 @@ TLS_CA = os.getenv("TLS_CA", "/etc/ssl/ca.pem")
 TLS_CERT = os.getenv("TLS_CERT", "/etc/ssl/cert.pem")
 TLS_KEY = os.getenv("TLS_KEY", "/etc/ssl/key.pem")
 AGG_WINDOW = float(os.getenv("AGG_WINDOW", "5.0"))  # seconds
+AGG_HOP = float(os.getenv("AGG_HOP", str(AGG_WINDOW)))  # < AGG_WINDOW gives sliding windows
+QUANTILE_BUCKETS = int(os.getenv("QUANTILE_BUCKETS", "0"))  # 0 disables the sketch
+SKETCH_GAMMA = float(os.getenv("SKETCH_GAMMA", "1.25"))  # bucket ratio; 64 buckets span ~1e-3..1e3
 LOCAL_TOPIC = os.getenv("LOCAL_TOPIC", "devices/+/telemetry")
 OUT_TOPIC = os.getenv("OUT_TOPIC", "site/summary")
+KEYS_PER_PUBLISH = int(os.getenv("KEYS_PER_PUBLISH", "5000"))  # metrics per upstream message
+FLUSH_EVERY = 4096  # staged samples before a vectorized accumulator update
 
-ssl_ctx = ssl.create_default_context(cafile=TLS_CA)
-ssl_ctx.load_cert_chain(certfile=TLS_CERT, keyfile=TLS_KEY)
+class WindowAggregator:
+    """Running count/sum/max per key, held in (panes x keys) arrays.
+
+    A window of AGG_WINDOW seconds is the sum of AGG_WINDOW/AGG_HOP panes,
+    plus one spare pane: advance() moves ingest onto the spare, so the closed
+    window can be summarized by window_stats() off the event loop while
+    samples keep arriving. Samples are staged in flat lists and folded into
+    the arrays with ufunc.at in blocks.
+    The optional sketch is a log-bucketed histogram (relative error ~ gamma-1)
+    with extra bins for values <= 0 and for values below / above the bucket
+    range; quantiles landing there are reported as out of range, not clamped.
+    """
+    def __init__(self, window=AGG_WINDOW, hop=AGG_HOP, buckets=QUANTILE_BUCKETS, capacity=1024, gamma=SKETCH_GAMMA):
+        self.panes = max(1, round(window / hop))
+        self.rows = self.panes + 1
+        self.slot = {}      # key -> column
+        self.keys = []      # column -> key
+        self.cur = 0        # pane receiving samples
+        self._recycle = 1 % self.rows  # pane cleared by the pending window_stats
+        self.buckets, self.log_gamma = buckets, np.log(gamma)
+        self._alloc(capacity)
+        self._s, self._v = [], []
+
+    def _alloc(self, cap):
+        def grow(old, fill, dtype, extra=()):
+            new = np.full((self.rows, cap) + extra, fill, dtype=dtype)
+            if old is not None:
+                new[:, :old.shape[1]] = old
+                new[self._recycle] = fill  # a running window_stats clears it in the old arrays only
+            return new
+        self.count = grow(getattr(self, "count", None), 0, np.uint32)
+        self.sum = grow(getattr(self, "sum", None), 0.0, np.float64)
+        self.max = grow(getattr(self, "max", None), -np.inf, np.float64)
+        if self.buckets:
+            # columns: 0 = value <= 0, 1 = below the lowest bucket, 2.. = buckets, last = above the highest
+            self.hist = grow(getattr(self, "hist", None), 0, np.uint32, (self.buckets + 3,))
+        self.cap = cap
+
+    def add(self, key, value):
+        s = self.slot.get(key)
+        if s is None:
+            s = self.slot[key] = len(self.keys); self.keys.append(key)
+        self._s.append(s); self._v.append(value)
+        if len(self._s) >= FLUSH_EVERY:
+            self.flush()
+
+    def flush(self):
+        if not self._s:
+            return
+        if len(self.keys) > self.cap:
+            self._alloc(max(self.cap * 2, len(self.keys)))
+        s = np.fromiter(self._s, dtype=np.int64, count=len(self._s))
+        v = np.fromiter(self._v, dtype=np.float64, count=len(self._v))
+        self._s.clear(); self._v.clear()
+        np.add.at(self.count[self.cur], s, 1)
+        np.add.at(self.sum[self.cur], s, v)
+        np.maximum.at(self.max[self.cur], s, v)
+        if self.buckets:
+            pos = v > 0
+            k = np.floor(np.log(np.where(pos, v, 1.0)) / self.log_gamma).astype(np.int64) + self.buckets // 2
+            b = np.where(pos, np.clip(k + 2, 1, self.buckets + 2), 0)
+            np.add.at(self.hist[self.cur], (s, b), 1)
+
+    def advance(self):
+        """Close the current hop and move ingest to the spare pane; cheap, runs on the loop."""
+        self.flush()
+        closed, self.cur = self.cur, (self.cur + 1) % self.rows
+        self._recycle = (closed + 2) % self.rows  # drops out of the window at the next hop
+        arrays = (self.count, self.sum, self.max, self.hist if self.buckets else None)
+        return closed, self._recycle, len(self.keys), arrays
+
+    def window_stats(self, snap):
+        """(keys, count, mean, max, quantiles) for a window from advance(); safe in a worker thread.
+
+        Only panes outside ingest are read; the pane leaving the window is cleared at the end.
+        """
+        closed, recycle, n, (cnt, sm, mxa, hist) = snap
+        rows = [(closed - j) % self.rows for j in range(self.panes)]
+        count = cnt[rows[0], :n].astype(np.uint64)
+        for r in rows[1:]:
+            count += cnt[r, :n]
+        live = np.nonzero(count)[0]
+        total, mx = sm[rows[0], live], mxa[rows[0], live]
+        for r in rows[1:]:
+            total += sm[r, live]; np.maximum(mx, mxa[r, live], out=mx)
+        c = count[live]
+        q = None
+        if self.buckets:
+            h = hist[rows[0], live]
+            for r in rows[1:]:
+                h += hist[r, live]
+            cdf = np.cumsum(h, axis=1)
+            q = {}
+            for name, p in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+                idx = (cdf < (p * c)[:, None]).sum(axis=1)
+                inside = (idx >= 2) & (idx < self.buckets + 2)
+                q[name] = np.where(inside, np.exp((idx - 2 - self.buckets // 2 + 0.5) * self.log_gamma), np.nan)
+            q["out_of_range"] = h[:, [0, 1, -1]]  # samples <= 0, below, above the sketch range
+        cnt[recycle] = 0; sm[recycle] = 0.0; mxa[recycle] = -np.inf
+        if self.buckets:
+            hist[recycle] = 0
+        return [self.keys[i] for i in live], c, total / c, mx, q
+
+    def rotate(self):
+        """Close the current hop; return (keys, count, mean, max, quantiles) over the window."""
+        return self.window_stats(self.advance())
+
+    def nbytes(self):
+        arrays = [self.count, self.sum, self.max] + ([self.hist] if self.buckets else [])
+        return sum(a.nbytes for a in arrays)
+
+def make_ssl_ctx():
+    ssl_ctx = ssl.create_default_context(cafile=TLS_CA)
+    ssl_ctx.load_cert_chain(certfile=TLS_CERT, keyfile=TLS_KEY)
+    return ssl_ctx
+
+def summaries(keys, count, mean, mx, q):
+    # window result -> upstream JSON messages of at most KEYS_PER_PUBLISH metrics
+    ts = datetime.now(timezone.utc).isoformat()
+    site = os.getenv("SITE_ID", "site-1")
+    for lo in range(0, len(keys), KEYS_PER_PUBLISH):
+        hi = min(lo + KEYS_PER_PUBLISH, len(keys))
+        cols = [count[lo:hi].tolist(), mean[lo:hi].tolist(), mx[lo:hi].tolist()]
+        names = ["count", "mean", "max"]
+        if q:
+            names += ["p50", "p95", "p99"]
+            # NaN: the quantile lies outside the sketch range -> null
+            cols += [[None if x != x else x for x in q[name][lo:hi].tolist()] for name in names[3:]]
+            oob = q["out_of_range"][lo:hi]
+            oob_rows = set(np.nonzero(oob.any(axis=1))[0].tolist())
+        metrics = {}
+        for j, key in enumerate(keys[lo:hi]):
+            m = dict(zip(names, (col[j] for col in cols)))
+            if q and j in oob_rows:
+                m["out_of_range"] = dict(zip(("nonpos", "below", "above"), oob[j].tolist()))
+            metrics[key] = m
+        yield json.dumps({"ts": ts, "site": site, "metrics": metrics}).encode()
+
+async def emit_loop(agg, outbox):
+    # timer-driven: windows close on schedule even when no messages arrive
+    loop = asyncio.get_running_loop()
+    next_t = loop.time() + AGG_HOP
+    while True:
+        await asyncio.sleep(max(0.0, next_t - loop.time()))
+        next_t += AGG_HOP
+        # window math and JSON encoding run in a worker thread, one message per call,
+        # so ingest only waits for advance() and the interpreter's thread switches
+        result = await loop.run_in_executor(None, agg.window_stats, agg.advance())
+        gen = summaries(*result)
+        while (payload := await loop.run_in_executor(None, next, gen, None)) is not None:
+            try:
+                outbox.put_nowait(payload)
+            except asyncio.QueueFull:
+                outbox.get_nowait(); outbox.put_nowait(payload)  # shed the oldest summary
+
+async def publish_loop(mqtt, outbox):
+    # drains queued summaries; backoff here never stalls ingest
+    while True:
+        payload = await outbox.get()
+        await publish_with_backoff(mqtt, OUT_TOPIC, payload)
 
 async def aggregate_loop(client):
-    buf = defaultdict(list)
-    last_emit = asyncio.get_event_loop().time()
-    async with aiomqtt.Client(BROKER, port=BROKER_PORT, tls=ssl_ctx) as mqtt:
+    agg = WindowAggregator()
+    outbox = asyncio.Queue(maxsize=1024)
+    async with aiomqtt.Client(BROKER, port=BROKER_PORT, tls=make_ssl_ctx()) as mqtt:
         # subscribe to all local telemetry (assumes local broker bridges messages)
         await mqtt.subscribe(LOCAL_TOPIC)
-        async with mqtt.unfiltered_messages() as messages:
-            async for msg in messages:
-                try:
-                    payload = json.loads(msg.payload.decode())
-                except Exception:
-                    continue  # drop malformed
-                key = payload.get("sensor_id", "unknown")
-                value = float(payload.get("value", 0.0))
-                buf[key].append(value)
-                now = asyncio.get_event_loop().time()
-                if now - last_emit >= AGG_WINDOW:
-                    summary = {"ts": datetime.now(timezone.utc).isoformat(), "site": os.getenv("SITE_ID","site-1"), "metrics": {}}
-                    for k, vals in buf.items():
-                        summary["metrics"][k] = {"count": len(vals), "mean": sum(vals)/len(vals), "max": max(vals)}
-                    await publish_with_backoff(mqtt, OUT_TOPIC, json.dumps(summary).encode())
-                    buf.clear()
-                    last_emit = now
+        tasks = [asyncio.create_task(emit_loop(agg, outbox)),
+                 asyncio.create_task(publish_loop(mqtt, outbox))]
+        try:
+            async with mqtt.unfiltered_messages() as messages:
+                async for msg in messages:
+                    try:
+                        payload = json.loads(msg.payload.decode())
+                        agg.add(payload.get("sensor_id", "unknown"), float(payload.get("value", 0.0)))
+                    except Exception:
+                        continue  # drop malformed
+        finally:
+            for t in tasks:
+                t.cancel()
 
 async def publish_with_backoff(mqtt, topic, payload):
     backoff = 0.5
@@ -59,8 +222,33 @@ async def publish_with_backoff(mqtt, topic, payload):
             await asyncio.sleep(backoff)
             backoff = min(backoff * 2, 30.0)  # cap backoff
 
+def bench(sensors=1_000_000, msgs=5_000_000):
+    # ingest rate and accumulator bytes/key; pre-encoded payloads stand in for MQTT
+    import tracemalloc
+    rng = np.random.default_rng(0)
+    ids = [f"s{i}" for i in range(sensors)]
+    for buckets in (0, 32):
+        agg = WindowAggregator(buckets=buckets)
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        for lo in range(0, msgs, 1_000_000):
+            keys = rng.integers(0, sensors, 1_000_000); vals = rng.gamma(2.0, 10.0, 1_000_000)
+            for k, v in zip(keys.tolist(), vals.tolist()):
+                agg.add(ids[k], v)
+        agg.flush()
+        dt = time.perf_counter() - t0
+        _, peak = tracemalloc.get_traced_memory(); tracemalloc.stop()
+        t1 = time.perf_counter(); snap = agg.advance(); t2 = time.perf_counter()
+        result = agg.window_stats(snap); t3 = time.perf_counter()
+        n_out = sum(1 for _ in summaries(*result)); t4 = time.perf_counter()
+        print(f"buckets={buckets}: {msgs / dt:,.0f} msgs/s, keys={len(result[0])}, "
+              f"arrays={agg.nbytes() / len(agg.keys):.0f} B/key, peak={peak / len(agg.keys):.0f} B/key incl. index; "
+              f"close: {(t2 - t1) * 1e3:.1f} ms on the loop, then in a worker {(t3 - t2) * 1e3:.0f} ms window "
+              f"stats + {(t4 - t3) * 1e3:.0f} ms encoding {n_out} messages")
+
 def main():
     asyncio.run(aggregate_loop(None))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    import sys
+    bench() if "--bench" in sys.argv else main()
@@ -59,5 +59,88 @@ async def run_simulation(N=6, steps=200, step=0.2):
             loads = [round(n.load,3) for n in nodes]
             logger.info("t=%d loads=%s", t, loads)
         await asyncio.sleep(0.01)   # real-time pacing
+
+def simulate_vectorized(N=100_000, steps=10_000, steps_sizes=(0.05, 0.1, 0.2, 0.4),
+                        staleness_bound=3, poll_prob=0.9, max_lag=2,
+                        sites=1000, regions=10, site_weight=0.6, region_weight=0.3, tol=0.01, seed=0):
+    """Fleet-scale mode: loads are an (S step sizes x N nodes) array.
+
+    Each step a random poll mask (loss) and per-node lag (jitter, read from a
+    short load history ring) produce versioned measurements; nodes whose
+    measurement age exceeds staleness_bound are frozen. Each node's update is
+    a weighted pull toward its site mean, its region mean and the global mean
+    (site_weight, region_weight, and the remainder for the global term, which
+    is what brings regions together). Returns convergence time (first step with
+    max deviation from the global mean < tol of it, or -1), final dispersion and
+    oscillation (mean fraction of nodes whose deviation flips sign per step) per step size.
+    """
+    rng = np.random.default_rng(seed)
+    alphas = np.asarray(steps_sizes, dtype=np.float64)[:, None]
+    S = len(alphas)
+    site = rng.integers(0, sites, N)
+    region = rng.integers(0, regions, sites)[site]
+    loads = np.tile(1.0 + 0.5 * (np.arange(N) % 3), (S, 1)) + rng.normal(0, 0.05, (S, N))
+    hist = np.repeat(loads[None], max_lag + 1, axis=0)     # ring of past loads
+    measured, version = loads.copy(), np.zeros(N, dtype=np.int64)
+    off_site = (np.arange(S) * sites)[:, None]
+    off_reg = (np.arange(S) * regions)[:, None]
+    cols = np.arange(N)
+    conv = np.full(S, -1)
+    prev_sign = np.sign(loads - loads.mean(axis=1, keepdims=True))
+    flips = np.zeros(S)
+    for t in range(1, steps + 1):
+        # measurement: polled nodes report their load as of `lag` steps ago; hist[s % (max_lag + 1)]
+        # holds loads after step s, so lag 0 is the current load (after step t-1), versioned t
+        polled = rng.random(N) < poll_prob
+        lag = rng.integers(0, max_lag + 1, N)
+        snap = hist[(t - 1 - lag) % (max_lag + 1), :, cols].T    # (S, N)
+        measured[:, polled] = snap[:, polled]
+        version[polled] = t - lag[polled]
+        fresh = (t - version) <= staleness_bound
+        # hierarchical means from fresh measurements (one bincount per level)
+        w = measured * fresh
+        cnt_s = np.bincount(site[fresh], minlength=sites).clip(min=1)
+        site_mean = np.bincount((site + off_site).ravel(), weights=w.ravel(),
+                                minlength=S * sites).reshape(S, sites) / cnt_s
+        cnt_r = np.bincount(region[fresh], minlength=regions).clip(min=1)
+        reg_mean = np.bincount((region + off_reg).ravel(), weights=w.ravel(),
+                               minlength=S * regions).reshape(S, regions) / cnt_r
+        glob_mean = w.sum(axis=1, keepdims=True) / max(int(fresh.sum()), 1)
+        delta = -alphas * (site_weight * (measured - site_mean[:, site]) +
+                           region_weight * (measured - reg_mean[:, region]) +
+                           (1 - site_weight - region_weight) * (measured - glob_mean))
+        loads += np.where(fresh, delta, 0.0)
+        hist[t % (max_lag + 1)] = loads
+        # metrics
+        mean = loads.mean(axis=1, keepdims=True)
+        dev = loads - mean
+        sign = np.sign(dev)
+        flips += (sign != prev_sign).mean(axis=1); prev_sign = sign
+        done = (np.abs(dev).max(axis=1) / mean[:, 0] < tol) & (conv < 0)
+        conv[done] = t
+    return {float(a): {"conv_step": int(c), "final_std": float(d), "oscillation": float(f / steps)}
+            for a, c, d, f in zip(alphas[:, 0], conv, (loads - loads.mean(axis=1, keepdims=True)).std(axis=1), flips)}
+
+def bench(N=10_000, steps=50):
+    # per-step cost: async per-node loop vs vectorized (4 step sizes at once)
+    async def async_steps():
+        nodes = [EdgeNode(i, init_load=1.0 + 0.5*(i%3)) for i in range(N)]
+        ctrl = HierarchicalController(nodes, step=0.2, staleness_bound=3)
+        for _ in range(steps):
+            await ctrl.poll_nodes()
+            await ctrl.apply_updates(ctrl.compute_update())
+    t0 = time.perf_counter(); asyncio.run(async_steps()); t_async = (time.perf_counter() - t0) / steps
+    for n in (N, 100_000):
+        t0 = time.perf_counter(); simulate_vectorized(N=n, steps=steps); t_vec = (time.perf_counter() - t0) / steps
+        logger.info("N=%d: async %.2f ms/step (N=%d, 1 step size) | vectorized %.2f ms/step (4 step sizes)",
+                    n, t_async * 1e3, N, t_vec * 1e3)
+
 if __name__ == "__main__":
-    asyncio.run(run_simulation())
\ No newline at end of file
+    import sys
+    if "--bench" in sys.argv:
+        bench()
+    elif "--fleet" in sys.argv:
+        for a, r in simulate_vectorized(steps=2000).items():
+            logger.info("step=%.2f %s", a, r)
+    else:
+        asyncio.run(run_simulation())
\ No newline at end of file
@@ -1,9 +1,10 @@
 #!/usr/bin/env python3
 # production-ready watcher: detect federation controller loss and apply local fallback CRD
-import logging, time, os
+# Controller readiness comes from one pod watch stream into a local cache; the
+# LocalOverride is only created/deleted when the observed health state flips.
+import logging, time, os, threading
 from kubernetes import client, config, watch
 from kubernetes.client.rest import ApiException
-from tenacity import retry, wait_exponential, stop_after_attempt
 
 logging.basicConfig(level=logging.INFO)
 config.load_kube_config()  # respects KUBECONFIG or in-cluster config
@@ -16,18 +17,63 @@ LOCAL_OVERRIDE_GROUP = "edge.example.com"
 LOCAL_OVERRIDE_VERSION = "v1"
 LOCAL_OVERRIDE_PLURAL = "localoverrides"
 CLUSTER_NAME = os.getenv("CLUSTER_NAME", "region-a")
+# Namespaces receiving the override; one process serves all of them.
+OVERRIDE_NAMESPACES = [n.strip() for n in os.getenv("OVERRIDE_NAMESPACES", "default").split(",") if n.strip()]
+RESYNC_SECONDS = int(os.getenv("RESYNC_SECONDS", "300"))
 
-@retry(wait=wait_exponential(multiplier=1, min=1, max=10), stop=stop_after_attempt(5))
-def is_controller_healthy():
-    # check controller pod readiness as health proxy
-    pods = core_v1.list_namespaced_pod(FED_NAMESPACE, label_selector=f"app={CONTROLLER_NAME}")
-    for p in pods.items:
-        for c in p.status.conditions or []:
-            if c.type == "Ready" and c.status == "True":
-                return True
-    raise RuntimeError("controller not ready")
+class PodReadinessCache:
+    # list+watch controller pods; readiness is answered from memory
+    def __init__(self, namespace, selector):
+        self.namespace, self.selector = namespace, selector
+        self.ready = {}  # pod name -> bool
+        self.lock = threading.Lock()
+        self.changed = threading.Event()  # set on any readiness transition
+        self.synced = threading.Event()   # set once the first list succeeded
 
-def apply_local_override():
+    @staticmethod
+    def _is_ready(pod):
+        return any(c.type == "Ready" and c.status == "True"
+                   for c in (pod.status.conditions or []))
+
+    def healthy(self):
+        with self.lock:
+            return any(self.ready.values())
+
+    def _update(self, name, ready):
+        with self.lock:
+            if self.ready.get(name) is ready:
+                return
+            if ready is None:
+                self.ready.pop(name, None)
+            else:
+                self.ready[name] = ready
+        self.changed.set()
+
+    def run(self):
+        backoff = 1
+        while True:
+            try:
+                pods = core_v1.list_namespaced_pod(self.namespace, label_selector=self.selector)
+                with self.lock:
+                    self.ready = {p.metadata.name: self._is_ready(p) for p in pods.items}
+                self.synced.set()
+                self.changed.set()
+                for ev in watch.Watch().stream(core_v1.list_namespaced_pod, self.namespace,
+                                               label_selector=self.selector,
+                                               resource_version=pods.metadata.resource_version,
+                                               timeout_seconds=RESYNC_SECONDS):
+                    p = ev["object"]
+                    self._update(p.metadata.name, None if ev["type"] == "DELETED" else self._is_ready(p))
+                backoff = 1
+            except ApiException as e:
+                if e.status != 410:  # expired resource version: relist immediately
+                    logging.warning("pod watch failed: %s", e.reason)
+                    time.sleep(backoff); backoff = min(backoff * 2, 60)
+            except Exception:
+                logging.exception("pod watch dropped")
+                time.sleep(backoff); backoff = min(backoff * 2, 60)
+
+def apply_local_override(namespace):
     body = {
         "apiVersion": f"{LOCAL_OVERRIDE_GROUP}/{LOCAL_OVERRIDE_VERSION}",
         "kind": "LocalOverride",
@@ -36,38 +82,54 @@ def apply_local_override():
     }
     try:
         api.create_namespaced_custom_object(LOCAL_OVERRIDE_GROUP, LOCAL_OVERRIDE_VERSION,
-                                            "default", LOCAL_OVERRIDE_PLURAL, body)
-        logging.info("Applied LocalOverride CRD")
+                                            namespace, LOCAL_OVERRIDE_PLURAL, body)
+        logging.info("Applied LocalOverride CRD in %s", namespace)
     except ApiException as e:
         if e.status == 409:
-            logging.info("LocalOverride exists; reconciled")
+            logging.info("LocalOverride exists in %s; reconciled", namespace)
             api.patch_namespaced_custom_object(LOCAL_OVERRIDE_GROUP, LOCAL_OVERRIDE_VERSION,
-                                               "default", LOCAL_OVERRIDE_PLURAL, body)
+                                               namespace, LOCAL_OVERRIDE_PLURAL,
+                                               f"fallback-{CLUSTER_NAME}", body)
         else:
             raise
 
+def remove_local_override(namespace):
+    try:
+        api.delete_namespaced_custom_object(LOCAL_OVERRIDE_GROUP, LOCAL_OVERRIDE_VERSION,
+                                            namespace, LOCAL_OVERRIDE_PLURAL,
+                                            f"fallback-{CLUSTER_NAME}")
+        logging.info("Removed LocalOverride in %s", namespace)
+    except ApiException as e:
+        if e.status != 404:
+            raise
+
 def main_loop():
-    w = watch.Watch()
+    cache = PodReadinessCache(FED_NAMESPACE, f"app={CONTROLLER_NAME}")
+    threading.Thread(target=cache.run, daemon=True).start()
+    applied = None  # last state written; None forces the first reconcile
     backoff = 1
     while True:
+        # wake on readiness transitions, or periodically to repair drift
+        if not cache.changed.wait(timeout=RESYNC_SECONDS):
+            applied = None
+        cache.changed.clear()
+        if not cache.synced.is_set():
+            # an empty, never-listed cache says nothing about the controller
+            logging.warning("pod cache not synced yet; override left as is")
+            continue
+        want = not cache.healthy()
+        if want == applied:
+            continue
         try:
-            if not is_controller_healthy():
-                apply_local_override()
-            else:
-                # ensure override is removed when controller healthy
-                try:
-                    api.delete_namespaced_custom_object(LOCAL_OVERRIDE_GROUP, LOCAL_OVERRIDE_VERSION,
-                                                        "default", LOCAL_OVERRIDE_PLURAL,
-                                                        f"fallback-{CLUSTER_NAME}")
-                    logging.info("Removed LocalOverride")
-                except ApiException as e:
-                    if e.status != 404:
-                        raise
+            for ns in OVERRIDE_NAMESPACES:
+                apply_local_override(ns) if want else remove_local_override(ns)
+            applied = want
             backoff = 1
-        except Exception as exc:
-            logging.exception("health-check cycle failed")
+        except Exception:
+            logging.exception("override reconcile failed")
+            cache.changed.set()  # retry on next iteration
             time.sleep(backoff)
             backoff = min(backoff * 2, 60)
 
 if __name__ == "__main__":
-    main_loop()
\ No newline at end of file
+    main_loop()
@@ -1,10 +1,17 @@
 #!/usr/bin/env python3
 """
 Production-ready: adjust warm replicas per-node based on observed rates.
-Requires: kubernetes, requests.
+Requires: kubernetes, requests, numpy.
 Run as a Deployment with RBAC for Deployments/Scale and access to Prometheus.
+
+One cycle sizes every function at once: rates come from a single grouped
+query, a Holt forecast projects them past the spin-up horizon, Erlang-B is
+evaluated for all functions in lock-step with the B(k) recurrence, and only
+changed deployments are patched, concurrently.
 """
 import math, time, requests
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from kubernetes import client, config
 
 PROM_URL = "http://prometheus:9090/api/v1/query"
@@ -12,6 +19,11 @@ NAMESPACE = "functions"
 FUNCTION_LABEL = "app=function-x"
 SAMPLE_INTERVAL = 15.0  # seconds
 SPIN_UP_S = 0.8
+TARGET_BLOCK = 0.02     # engineer-chosen SLA: <=2% cold starts
+MAX_REPLICAS = 256
+MU = 2.0                # per-replica service rate (1/s)
+SCALE_WORKERS = 32      # concurrent scale PATCHes
+ABSENT_CYCLES = 4       # consecutive samples without a series before its function shrinks to idle
 
 def erlang_b(C, a):
     # stable iterative computation to avoid large factorials
@@ -22,43 +34,185 @@ def erlang_b(C, a):
         B = 1.0 + (k / a) * B
     return 1.0 / B
 
-def prom_rate(query):
-    resp = requests.get(PROM_URL, params={"query": query}, timeout=5)
+def erlang_b_replicas(a, target=TARGET_BLOCK, max_c=MAX_REPLICAS):
+    """Smallest C with B(C, a) <= target, for every offered load in `a`.
+
+    Uses B(k) = a*B(k-1) / (k + a*B(k-1)) across all functions per k, so the
+    whole fleet costs O(C_max) vector steps instead of O(C^2) per function.
+    """
+    a = np.asarray(a, dtype=np.float64)
+    B = np.ones_like(a)
+    C = np.where(a <= 0, 1, max_c)
+    open_ = a > 0
+    for k in range(1, max_c + 1):
+        B = a * B / (k + a * B)
+        hit = open_ & (B <= target)
+        C[hit] = k
+        open_ &= ~hit
+        if not open_.any():
+            break
+    return C
+
+def erlang_b_at(C, a):
+    # B(C_i, a_i) for per-function pool sizes, in one pass up to max(C)
+    a = np.asarray(a, dtype=np.float64); C = np.asarray(C)
+    B, out = np.ones_like(a), np.where(C <= 0, 1.0, 0.0)
+    for k in range(1, int(C.max(initial=0)) + 1):
+        B = a * B / (k + a * B)
+        out[C == k] = B[C == k]
+    return out
+
+class HoltForecaster:
+    """Per-function level/trend smoothing with a residual-based margin."""
+    def __init__(self, alpha=0.5, beta=0.2, z=1.0):
+        self.alpha, self.beta, self.z = alpha, beta, z
+        self.level = self.trend = self.resid = None
+
+    def update(self, x):
+        x = np.asarray(x, dtype=np.float64)
+        if self.level is None or len(self.level) != len(x):
+            self.level, self.trend, self.resid = x.copy(), np.zeros_like(x), np.zeros_like(x)
+            return
+        new = np.isnan(self.level)  # rows added by reindex start from their first sample
+        err = x - (self.level + self.trend)
+        self.resid = np.where(new, 0.0, 0.8 * self.resid + 0.2 * np.abs(err))
+        new_level = self.alpha * x + (1 - self.alpha) * (self.level + self.trend)
+        self.trend = np.where(new, 0.0, self.beta * (new_level - self.level) + (1 - self.beta) * self.trend)
+        self.level = np.where(new, x, new_level)
+
+    def reindex(self, old_names, new_names):
+        """Carry each surviving name's state over to the new row order; new names start cold."""
+        if self.level is None:
+            return
+        pos = {n: i for i, n in enumerate(old_names)}
+        idx = np.fromiter((pos.get(n, -1) for n in new_names), dtype=np.int64, count=len(new_names))
+        keep = idx >= 0
+        def take(a, fill):
+            out = np.full(len(new_names), fill)
+            out[keep] = a[idx[keep]]
+            return out
+        self.level, self.trend, self.resid = take(self.level, np.nan), take(self.trend, 0.0), take(self.resid, 0.0)
+
+    def forecast(self, steps=1.0):
+        return np.maximum(self.level + steps * self.trend + self.z * self.resid, 0.0)
+
+session = requests.Session()  # reuse one keep-alive connection to Prometheus
+
+def prom_result(query):
+    resp = session.get(PROM_URL, params={"query": query}, timeout=5)
     resp.raise_for_status()
-    data = resp.json()["data"]["result"]
-    if not data:
-        return 0.0
-    return float(data[0]["value"][1])
+    return resp.json()["data"]["result"]
+
+def prom_vector(query, label):
+    # one grouped query returns every series, keyed by `label`; series without it are skipped
+    vals = {}
+    for s in prom_result(query):
+        key = s["metric"].get(label)
+        if key is not None:
+            vals[key] = float(s["value"][1])
+    return vals
 
-def desired_replicas(lambda_rate, mu=2.0):
+def prom_rate(query):
+    data = prom_result(query)
+    return float(data[0]["value"][1]) if data else 0.0
+
+def desired_replicas(lambda_rate, mu=MU):
     # choose smallest C with acceptable blocking prob threshold
-    target_block = 0.02  # engineer-chosen SLA: <=2% cold starts
-    for C in range(1, 10):
-        a = lambda_rate / mu
-        if erlang_b(C, a) <= target_block:
-            return C
-    return 10
-
-def scale_deployments(api, replicas):
+    return int(erlang_b_replicas([lambda_rate / mu])[0])
+
+def scale_deployments(api, replicas, name="function-x"):
     # idempotent scale update
     body = {"spec": {"replicas": replicas}}
-    ret = api.patch_namespaced_deployment_scale("function-x", NAMESPACE, body)
+    ret = api.patch_namespaced_deployment_scale(name, NAMESPACE, body)
     return ret
 
 def main():
     config.load_incluster_config()
     apps = client.AppsV1Api()
+    pool = ThreadPoolExecutor(SCALE_WORKERS)
+    names, applied, fc = [], {}, HoltForecaster()
+    last, missing = {}, {}  # last observed rate per function; consecutive samples absent
+    horizon = (SPIN_UP_S + SAMPLE_INTERVAL) / SAMPLE_INTERVAL  # forecast steps ahead
+    idle = int(erlang_b_replicas([0.0])[0])  # pool size at zero offered load
     while True:
         try:
-            # Prometheus query: rate of function invocation counter per second
-            q = 'sum(rate(function_invocations_total{app="function-x"}[1m]))'
-            lam = prom_rate(q)
-            replicas = desired_replicas(lam)
-            scale_deployments(apps, replicas)
+            # 1m window spans 4 scrapes, so one missed scrape does not drop a series;
+            # the forecaster does the smoothing
+            rates = prom_vector('sum by (app) (rate(function_invocations_total[1m]))', "app")
+            for n in last:
+                missing[n] = 0 if n in rates else missing.get(n, 0) + 1
+            last.update(rates)
+            for n in [n for n, c in missing.items() if c >= ABSENT_CYCLES]:
+                del last[n], missing[n]  # gone for good: shrink to idle below
+            if sorted(last) != names:
+                new_names = sorted(last)
+                fc.reindex(names, new_names)  # churn keeps every surviving function's forecast warm
+                names = new_names
+            fc.update([last[n] for n in names])  # a briefly absent series holds its last rate
+            replicas = erlang_b_replicas(fc.forecast(horizon) / MU)
+            changed = [(n, int(r)) for n, r in zip(names, replicas) if applied.get(n) != int(r)]
+            changed += [(n, idle) for n in applied if n not in last]
+            for (n, r), fut in zip(changed, [pool.submit(scale_deployments, apps, r, n) for n, r in changed]):
+                try:
+                    fut.result()
+                    if n in last:
+                        applied[n] = r
+                    else:
+                        applied.pop(n, None)  # scaled down; tracked again if its series returns
+                except Exception as e:
+                    if n in last or getattr(e, "status", None) == 404:
+                        applied.pop(n, None)  # retry next cycle / deployment deleted
         except Exception as e:
             # backoff and continue; real deployments should log to central observability
             time.sleep(5)
         time.sleep(SAMPLE_INTERVAL)
 
+def bench(functions=3000, intervals=480, seed=0):
+    # replayed trace: diurnal base rates, per-function phase, random bursts
+    rng = np.random.default_rng(seed)
+    base = rng.lognormal(0.0, 1.2, functions)
+    t = np.arange(intervals)[:, None]
+    diurnal = 1 + 0.8 * np.sin(2 * np.pi * (t / 240 + rng.random(functions)))
+    bursts = np.where(rng.random((intervals, functions)) < 0.01, rng.uniform(2, 6, (intervals, functions)), 1.0)
+    lam = base * diurnal * bursts                               # true rate per interval
+    observed = rng.poisson(lam * SAMPLE_INTERVAL) / SAMPLE_INTERVAL
+    # churn: each interval ~0.5% of series are missing from the query result (deploys, scrape gaps)
+    present = rng.random((intervals, functions)) >= 0.005
+    for policy in ("last-1m", "holt", "holt, churn, reset", "holt, churn, reindex", "holt, churn, hold"):
+        fc, cold, total, cyc, names = HoltForecaster(), 0.0, 0.0, [], np.arange(functions)
+        last, absent = observed[3].copy(), np.zeros(functions, np.int64)
+        for i in range(4, intervals):
+            t0 = time.perf_counter()
+            if policy == "last-1m":
+                est = observed[i - 4:i].mean(axis=0)            # rate(...[1m]) at 15s sampling
+            elif policy == "holt":
+                fc.update(observed[i - 1]); est = fc.forecast((SPIN_UP_S + SAMPLE_INTERVAL) / SAMPLE_INTERVAL)
+            elif policy.endswith("hold"):  # main(): an absent series holds its last rate for ABSENT_CYCLES
+                absent = np.where(present[i - 1], 0, absent + 1)
+                last = np.where(present[i - 1], observed[i - 1], last)
+                fc.update(last)
+                est = np.where(absent < ABSENT_CYCLES, fc.forecast((SPIN_UP_S + SAMPLE_INTERVAL) / SAMPLE_INTERVAL), 0.0)
+            else:
+                cur = np.flatnonzero(present[i - 1])
+                if len(cur) != len(names) or (cur != names).any():
+                    if policy.endswith("reset"):
+                        fc = HoltForecaster()  # previous behaviour
+                    else:
+                        fc.reindex(names.tolist(), cur.tolist())
+                    names = cur
+                fc.update(observed[i - 1, names])
+                est = np.zeros(functions)  # missing functions sit at the idle pool size
+                est[names] = fc.forecast((SPIN_UP_S + SAMPLE_INTERVAL) / SAMPLE_INTERVAL)
+            C = erlang_b_replicas(est / MU)
+            cyc.append(time.perf_counter() - t0)
+            cold += (erlang_b_at(C, lam[i] / MU) * lam[i]).sum(); total += lam[i].sum()
+        print(f"{policy:20s} cold-start rate={cold / total:.3%} cycle={np.median(cyc) * 1e3:.2f} ms "
+              f"(3k functions, replicas<= {MAX_REPLICAS})")
+    t0 = time.perf_counter()
+    for a in (lam[100] / MU)[:300]:
+        next((C for C in range(1, MAX_REPLICAS) if erlang_b(C, a) <= TARGET_BLOCK), MAX_REPLICAS)
+    print(f"scalar O(C^2) search: {(time.perf_counter() - t0) * 10 * 1e3:.1f} ms for 3k functions (extrapolated)")
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    import sys
+    bench() if "--bench" in sys.argv else main()
@@ -1,6 +1,5 @@
-# Dependencies: numpy, sklearn
+# Dependencies: numpy, scipy (capacity LP), sklearn (small in-memory mode only)
 import numpy as np
-from sklearn.cluster import KMeans
 
 def place_edge_nodes(locations, weights, k, random_state=0):
     """
@@ -9,6 +8,7 @@ def place_edge_nodes(locations, weights, k, random_state=0):
     k: number of edge nodes to place.
     Returns: centers (k,2), assignments (N,), loads (k,)
     """
+    from sklearn.cluster import KMeans
     # Normalize weights to avoid numerical issues
     w = np.array(weights, dtype=float)
     w_sum = w.sum()
@@ -23,10 +23,236 @@ def place_edge_nodes(locations, weights, k, random_state=0):
     assignments = kmeans.labels_
 
     # Compute per-center load (sum of original weights)
-    loads = np.zeros(k, dtype=float)
-    for i, a in enumerate(assignments):
-        loads[a] += weights[i]
+    loads = np.bincount(assignments, weights=weights, minlength=k)
     return centers, assignments, loads
 
+# --- Scalable mode: streamed/mmapped points, capacity-constrained assignment ---
+
+def _chunk_rows(k, budget_bytes=64 << 20):
+    # rows per chunk so the (rows x k) float32 distance block stays within budget
+    return max(4096, budget_bytes // (4 * max(k, 1)))
+
+def _sq_dist(X, centers):
+    # (n,k) squared distances in float32 without an (n,k,2) temporary
+    X = X.astype(np.float32, copy=False); C = centers.astype(np.float32)
+    d = (X * X).sum(1)[:, None] - 2.0 * (X @ C.T) + (C * C).sum(1)[None, :]
+    return np.maximum(d, 0.0, out=d)
+
+def _init_centers(locations, weights, k, rng, sample=200_000):
+    # weighted k-means++ on a uniform sample of the (possibly mmapped) points
+    idx = np.sort(rng.choice(len(locations), min(sample, len(locations)), replace=False))
+    X, w = np.asarray(locations[idx], dtype=np.float64), np.asarray(weights[idx], dtype=np.float64)
+    centers = [X[rng.choice(len(X), p=w / w.sum())]]
+    d = ((X - centers[0]) ** 2).sum(1)
+    for _ in range(1, k):
+        p = w * d
+        centers.append(X[rng.choice(len(X), p=p / p.sum())] if p.sum() > 0 else X[rng.integers(len(X))])
+        d = np.minimum(d, ((X - centers[-1]) ** 2).sum(1))
+    return np.array(centers)
+
+class GeoPlacer:
+    """Weighted mini-batch k-means plus capacity-constrained assignment.
+
+    Points are read in chunks from an array or np.memmap (see load_points),
+    so memory is O(chunk * k) regardless of N. For capacities, demand is
+    binned onto a grid in one streamed bincount pass and clustered with
+    constrained k-means (Bradley, Bennett & Demiriz 2000): the assignment
+    step is a transportation LP (min-cost flow), so loads never exceed
+    capacity. Points follow their cell's flow; an LP vertex splits at most
+    k-1 cells. update() after an hourly weight shift warm-starts from the
+    current sites.
+    """
+    def __init__(self, k, capacity=None, batch=8192, grid=96, random_state=0):
+        self.k, self.batch, self.grid = k, batch, grid
+        self.capacity = capacity  # scalar or (k,), in weight units; None = unconstrained
+        self.rng = np.random.default_rng(random_state)
+        self.centers = None
+        self.bbox = None
+        self.counts = np.zeros(k)  # accumulated weight per center (mini-batch step sizes)
+        self.prices = np.zeros(k)  # capacity duals, used for points outside known cells
+        self.cell_site = None
+
+    def fit(self, locations, weights, epochs=1):
+        if self.centers is None:
+            self.centers = _init_centers(locations, weights, self.k, self.rng)
+        n, step = len(locations), _chunk_rows(self.k)
+        lo_xy, hi_xy = np.full(2, np.inf), np.full(2, -np.inf)
+        for _ in range(epochs):
+            # sequential chunks keep mmap reads contiguous; batches sampled within a chunk
+            for lo in range(0, n, step):
+                hi = min(n, lo + step)
+                X = np.asarray(locations[lo:hi], dtype=np.float64)
+                w = np.asarray(weights[lo:hi], dtype=np.float64)
+                lo_xy, hi_xy = np.minimum(lo_xy, X.min(0)), np.maximum(hi_xy, X.max(0))
+                for b in range(0, hi - lo, self.batch * 8):
+                    sel = self.rng.integers(b, min(hi - lo, b + self.batch * 8), self.batch)
+                    self._step(X[sel], w[sel])
+        self.bbox = (lo_xy, np.maximum(hi_xy - lo_xy, 1e-9))
+        return self
+
+    def _step(self, X, w):
+        a = _sq_dist(X, self.centers).argmin(1)
+        wsum = np.bincount(a, weights=w, minlength=self.k)
+        hit = wsum > 0
+        xsum = np.stack([np.bincount(a, weights=w * X[:, j], minlength=self.k) for j in range(X.shape[1])], 1)
+        self.counts += wsum
+        # per-center learning rate = batch weight / total weight seen (Sculley 2010)
+        eta = np.where(hit, wsum / np.maximum(self.counts, 1e-12), 0.0)[:, None]
+        self.centers[hit] += eta[hit] * (xsum[hit] / wsum[hit, None] - self.centers[hit])
+
+    def _cells(self, X):
+        lo, span = self.bbox
+        c = np.clip(((X - lo) / span * self.grid).astype(np.int64), 0, self.grid - 1)
+        return c[:, 0] * self.grid + c[:, 1]
+
+    def aggregate(self, locations, weights):
+        """One streamed pass: (centroid, demand) of every non-empty grid cell."""
+        G2, step = self.grid ** 2, _chunk_rows(self.k)
+        tot, sx, sy = np.zeros(G2), np.zeros(G2), np.zeros(G2)
+        for lo in range(0, len(locations), step):
+            X = np.asarray(locations[lo:lo + step], dtype=np.float64)
+            w = np.asarray(weights[lo:lo + step], dtype=np.float64)
+            c = self._cells(X)
+            tot += np.bincount(c, weights=w, minlength=G2)
+            sx += np.bincount(c, weights=w * X[:, 0], minlength=G2)
+            sy += np.bincount(c, weights=w * X[:, 1], minlength=G2)
+        self.cell_ids = np.nonzero(tot)[0]
+        q = tot[self.cell_ids]
+        return np.stack([sx[self.cell_ids] / q, sy[self.cell_ids] / q], 1), q
+
+    def constrain(self, P, q, iters=8, rtol=1e-3):
+        """Constrained k-means over cells; returns the final (cells x k) flow."""
+        from scipy import sparse
+        from scipy.optimize import linprog
+        m, k = len(q), self.k
+        cap = np.broadcast_to(np.asarray(self.capacity, dtype=np.float64), (k,))
+        if cap.sum() < q.sum():
+            raise ValueError("total capacity below total demand")
+        A_eq = sparse.kron(sparse.eye(m), np.ones((1, k)), format='csr')  # each cell fully served
+        A_ub = sparse.kron(np.ones((1, m)), sparse.eye(k), format='csr')  # site load <= capacity
+        prev = np.inf
+        for _ in range(iters):
+            D = _sq_dist(P, self.centers).astype(np.float64)
+            s = float(np.median(D.min(1))) + 1e-12  # rescale costs for solver conditioning
+            res = linprog((D / s).ravel(), A_ub=A_ub, b_ub=cap, A_eq=A_eq, b_eq=q,
+                          bounds=(0, None), method='highs')
+            if res.status != 0:
+                raise RuntimeError(f"transportation LP failed: {res.message}")
+            x = res.x.reshape(m, k)
+            self.prices = -res.ineqlin.marginals * s
+            f = x.sum(0)
+            self.centers = np.where(f[:, None] > 0, (x.T @ P) / np.maximum(f, 1e-12)[:, None], self.centers)
+            cost = float((x * D).sum())
+            if prev - cost <= rtol * cost:
+                break
+            prev = cost
+        self._route(x)
+        return x
+
+    def _route(self, x):
+        # per-cell lookup tables: a single site, or cumulative fractions for split cells
+        G2 = self.grid ** 2
+        frac = x / x.sum(1, keepdims=True)
+        self.cell_site = np.full(G2, -1, dtype=np.int32)
+        self.cell_site[self.cell_ids] = frac.argmax(1)
+        split = np.nonzero((frac > 1e-9).sum(1) > 1)[0]
+        self.split_row = np.full(G2, -1, dtype=np.int32)
+        self.split_row[self.cell_ids[split]] = np.arange(len(split))
+        self.split_cum = np.cumsum(frac[split], 1)
+
+    def assign(self, locations, weights, out=None):
+        """Labels for every point (written to `out` if given) and per-center loads."""
+        n, step = len(locations), _chunk_rows(self.k)
+        labels = np.empty(n, dtype=np.int32) if out is None else out
+        loads = np.zeros(self.k)
+        for lo in range(0, n, step):
+            X = np.asarray(locations[lo:lo + step])
+            if self.cell_site is None:
+                a = _sq_dist(X, self.centers).argmin(1)
+            else:
+                c = self._cells(X)
+                a, r = self.cell_site[c], self.split_row[c]
+                s = r >= 0
+                if s.any():
+                    # golden-ratio sequence on the row index: stable, evenly spread split
+                    u = (np.arange(lo, lo + len(X))[s] * 0.6180339887498949) % 1.0
+                    a[s] = np.minimum((self.split_cum[r[s]] < u[:, None]).sum(1), self.k - 1)
+                miss = a < 0  # cell unseen at aggregation time
+                if miss.any():
+                    a[miss] = (_sq_dist(X[miss], self.centers) + self.prices.astype(np.float32)).argmin(1)
+            labels[lo:lo + step] = a
+            loads += np.bincount(a, weights=np.asarray(weights[lo:lo + step], dtype=np.float64), minlength=self.k)
+        return labels, loads
+
+    def update(self, locations, new_weights, iters=3):
+        """Hourly weight shift: re-bin demand, warm-start the LP rounds from current sites."""
+        if self.capacity is None:
+            self.counts *= 0.5  # let the new hour move the centers
+            self.fit(locations, new_weights)
+        else:
+            self.constrain(*self.aggregate(locations, new_weights), iters=iters)
+        return self.assign(locations, new_weights)
+
+def place_edge_nodes_streaming(locations, weights, k, capacity=None, epochs=1, random_state=0, out=None):
+    """Scalable place_edge_nodes for 10^7..10^8 points (arrays or np.memmap).
+
+    capacity: per-site weight capacity (scalar or (k,)); None skips balancing.
+    Returns: centers (k,2), assignments (N,), loads (k,), placer (for update()).
+    """
+    placer = GeoPlacer(k, capacity=capacity, random_state=random_state)
+    placer.fit(locations, weights, epochs=epochs)
+    if capacity is not None:
+        placer.constrain(*placer.aggregate(locations, weights))
+    labels, loads = placer.assign(locations, weights, out=out)
+    return placer.centers, labels, loads, placer
+
+def load_points(path):
+    # (N,2) float32 coordinates saved with np.save; memory-mapped, never fully loaded
+    return np.load(path, mmap_mode='r')
+
+def bench(sizes=(10_000_000, 50_000_000), k=64, path="/tmp/placement_bench_{}.npy"):
+    # runtime and peak RSS growth for the streamed path over mmapped synthetic cities
+    import resource, time, os
+    rng = np.random.default_rng(0)
+    for n in sizes:
+        f = path.format(n)
+        if not os.path.exists(f):
+            pts = np.lib.format.open_memmap(f, mode='w+', dtype=np.float32, shape=(n, 2))
+            hubs = rng.uniform(0, 1000, (40, 2)); spread = rng.uniform(5, 40, 40)
+            for lo in range(0, n, 5_000_000):
+                m = min(5_000_000, n - lo); h = rng.integers(0, 40, m)
+                pts[lo:lo + m] = hubs[h] + rng.normal(0, 1, (m, 2)) * spread[h, None]
+            pts.flush(); del pts
+        X = load_points(f)
+        w = np.lib.format.open_memmap(f + ".w.npy", mode='w+', dtype=np.float32, shape=(n,))
+        w[:] = rng.gamma(2.0, 1.0, n).astype(np.float32)
+        rss0 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        t0 = time.perf_counter()
+        labels = np.lib.format.open_memmap(f + ".lab.npy", mode='w+', dtype=np.int32, shape=(n,))
+        cap = 1.10 * float(w.sum(dtype=np.float64)) / k
+        _, _, loads, placer = place_edge_nodes_streaming(X, w, k, capacity=cap, out=labels)
+        t_fit = time.perf_counter() - t0
+        for lo in range(0, n, 5_000_000):  # hourly shift: east side doubles
+            w[lo:lo + 5_000_000] *= np.float32(1.0) + (X[lo:lo + 5_000_000, 0] > 500)
+        cap2 = placer.capacity = 1.10 * float(w.sum(dtype=np.float64)) / k
+        t1 = time.perf_counter()
+        _, loads2 = placer.update(X, w)
+        t2 = time.perf_counter()
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        print(f"N={n:,}: fit+constrain+assign {t_fit:.1f}s, update {t2 - t1:.1f}s, "
+              f"max load/cap {loads.max() / cap:.3f} -> {loads2.max() / cap2:.3f} after shift, "
+              f"peak RSS +{(rss - rss0) / 1024:.0f} MiB")
+        del X, w, labels
+        for g in (f + ".w.npy", f + ".lab.npy"):
+            os.remove(g)
+
+if __name__ == "__main__":
+    import sys
+    if "--bench" in sys.argv:
+        bench()
+
 # Example usage: sensor locations and hourly weights from telemetry
-# centers, assign, loads = place_edge_nodes(sensor_coords, hourly_weights, k=8)
\ No newline at end of file
+# centers, assign, loads = place_edge_nodes(sensor_coords, hourly_weights, k=8)
+# 50M-point catalog: centers, assign, loads, placer = place_edge_nodes_streaming(
+#     load_points("sensors.npy"), hourly_weights, k=64, capacity=per_site_capacity)
+# next hour: assign, loads = placer.update(load_points("sensors.npy"), next_weights)
@@ -1,15 +1,23 @@
 import hashlib
 import math
-from typing import Dict, Iterable, Tuple
+from typing import Dict, Iterable, List, Sequence, Tuple
+import numpy as np
+
+# Weighted rendezvous (HRW) hashing. Each key is hashed once (64-bit
+# blake2b); per node it is mixed with a precomputed 64-bit node seed by the
+# splitmix64 finalizer, so a key x node score costs a few integer ops.
+# Scores use the logarithmic method (an exponential race): node i wins with
+# probability w_i / sum(w), and changing one weight only moves keys to/from it.
+
+_M1, _M2 = np.uint64(0xbf58476d1ce4e5b9), np.uint64(0x94d049bb133111eb)
 
 def gini(loads: Iterable[float]) -> float:
-    L = sorted(float(x) for x in loads)
+    # O(n log n): G = sum_i (2i - n - 1) x_(i) / (n * sum x), x sorted ascending
+    L = np.sort(np.asarray(list(loads), dtype=float))
     n = len(L)
-    if n == 0: return 0.0
-    mean = sum(L) / n
-    if mean == 0: return 0.0
-    num = sum(abs(L[i] - L[j]) for i in range(n) for j in range(n))
-    return num / (2 * n * n * mean)
+    if n == 0 or L.sum() == 0: return 0.0
+    i = np.arange(1, n + 1)
+    return float(((2 * i - n - 1) * L).sum() / (n * L.sum()))
 
 def imbalance_factor(loads: Iterable[float]) -> float:
     L = list(loads)
@@ -18,25 +26,142 @@ def imbalance_factor(loads: Iterable[float]) -> float:
     mean = sum(L)/n
     return max(L)/mean if mean > 0 else float('inf')
 
-def _hash(key: bytes) -> int:
-    return int(hashlib.sha256(key).hexdigest(), 16)
+def _hash64(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little')
+
+def key_hashes(keys: Sequence[str]) -> np.ndarray:
+    return np.fromiter((_hash64(k.encode('utf-8')) for k in keys), dtype=np.uint64, count=len(keys))
+
+def _mix(kh: np.ndarray, seeds: np.ndarray) -> np.ndarray:
+    # splitmix64 finalizer of (key hash ^ node seed); uint64 arithmetic wraps
+    z = kh ^ seeds
+    z = (z ^ (z >> np.uint64(30))) * _M1
+    z = (z ^ (z >> np.uint64(27))) * _M2
+    return z ^ (z >> np.uint64(31))
+
+def _costs(kh: np.ndarray, seeds: np.ndarray, inv_w: np.ndarray) -> np.ndarray:
+    # -ln(u) / w with u uniform in (0,1): the argmin is the weighted HRW winner
+    # (same order as the score w / -ln u; inv_w = inf excludes a node)
+    u = ((_mix(kh, seeds) >> np.uint64(11)).astype(np.float64) + 0.5) * 2.0 ** -53
+    return -np.log(u) * inv_w
+
+def _inv(w: np.ndarray) -> np.ndarray:
+    with np.errstate(divide='ignore'):
+        return np.where(w > 0, 1.0 / w, np.inf)
+
+class RendezvousHash:
+    """Flat weighted HRW over a fixed node set; O(n) per key, vectorized in batches."""
+    def __init__(self, nodes: Dict[str, float], block: int = 1 << 21):
+        self.ids = list(nodes)
+        self.seeds = np.array([_hash64(b'node:' + n.encode('utf-8')) for n in self.ids], dtype=np.uint64)
+        self.inv_w = _inv(np.array([nodes[n] for n in self.ids], dtype=float))
+        self.rows = max(1, block // max(len(self.ids), 1))  # keys per (keys x nodes) block
+
+    def assign(self, key: str) -> str:
+        return self.ids[int(self.assign_batch([key])[0])]
+
+    def assign_batch(self, keys: Sequence[str], hashes: np.ndarray = None) -> np.ndarray:
+        """Node index for every key (indices into self.ids)."""
+        kh = key_hashes(keys) if hashes is None else hashes
+        out = np.empty(len(kh), dtype=np.int32)
+        for lo in range(0, len(kh), self.rows):
+            blk = kh[lo:lo + self.rows, None]
+            out[lo:lo + self.rows] = _costs(blk, self.seeds[None, :], self.inv_w[None, :]).argmin(1)
+        return out
+
+    def top(self, key: str, r: int) -> List[str]:
+        # r highest-scoring nodes, best first (replica sets)
+        c = _costs(key_hashes([key]), self.seeds, self.inv_w)
+        return [self.ids[i] for i in np.argsort(c)[:r]]
+
+class SkeletonHRW:
+    """Skeleton-based hierarchical HRW: O(fanout * log_fanout n) per key.
+
+    Nodes fill the leaves of a complete fanout-ary virtual tree in insertion
+    order; each level picks a child by weighted HRW on the child's configured
+    subtree weight, so the distribution stays proportional to weight. A down
+    node is masked at the leaf level only, so just its keys move (to its
+    siblings); a subtree is skipped only when every node in it is down.
+    Adding a node fills a free or down slot; outgrowing fanout**levels
+    rebuilds the tree (keys remap).
+    """
+    def __init__(self, nodes: Dict[str, float], fanout: int = 16):
+        self.fanout = fanout
+        self._build(list(nodes.items()))
+
+    def _build(self, items: List[Tuple[str, float]]):
+        f = self.fanout
+        self.levels = max(1, math.ceil(math.log(max(len(items), 2), f)))
+        size = f ** self.levels
+        self.ids: List[str] = [n for n, _ in items] + [None] * (size - len(items))
+        self.w = np.zeros(size)
+        self.w[:len(items)] = [w for _, w in items]
+        self.up = np.zeros(size, dtype=bool)
+        self.up[:len(items)] = True
+        # virtual-node seeds per level: level l holds f**(l+1) children slots
+        self.seeds = [np.array([_hash64(f'skel:{l}:{i}'.encode()) for i in range(f ** (l + 1))], dtype=np.uint64)
+                      for l in range(self.levels)]
+        self._refresh()
+
+    def _refresh(self):
+        # per level: inverse configured subtree weight, inf where nothing below is up
+        f, w, live = self.fanout, [self.w], [self.up]
+        for _ in range(self.levels - 1):
+            w.append(w[-1].reshape(-1, f).sum(1)); live.append(live[-1].reshape(-1, f).any(1))
+        self.inv_w = [np.where(lv, _inv(x), np.inf) for x, lv in zip(reversed(w), reversed(live))]
+
+    def add(self, node: str, weight: float = 1.0):
+        free = np.nonzero(~self.up)[0]
+        if len(free) == 0:
+            return self._build([(n, w) for n, w in zip(self.ids, self.w)] + [(node, weight)])
+        slot = int(free[0])
+        self.ids[slot], self.w[slot], self.up[slot] = node, weight, True
+        self._refresh()
+
+    def remove(self, node: str):
+        self.up[self.ids.index(node)] = False
+        self._refresh()
+
+    def assign(self, key: str) -> str:
+        return self.ids[int(self.assign_batch([key])[0])]
+
+    def assign_batch(self, keys: Sequence[str], hashes: np.ndarray = None) -> np.ndarray:
+        """Leaf (node) index per key: fanout candidates per level, all keys at once."""
+        kh = (key_hashes(keys) if hashes is None else hashes)[:, None]
+        f, cur = self.fanout, np.zeros(len(kh), dtype=np.int64)
+        kids = np.arange(f)
+        for l in range(self.levels):
+            child = cur[:, None] * f + kids[None, :]
+            c = _costs(kh, self.seeds[l][child], self.inv_w[l][child])
+            cur = child[np.arange(len(kh)), c.argmin(1)]
+        return cur
 
 def weighted_rendezvous_assign(key: str, nodes: Dict[str, float]) -> str:
-    # nodes: mapping node_id -> weight (capacity)
-    best = None
-    best_score = -math.inf
-    kh = key.encode('utf-8')
-    for nid, weight in nodes.items():
-        # combine key with node id deterministically
-        h = _hash(kh + nid.encode('utf-8'))
-        score = math.log(weight + 1e-12) - math.log(h + 1)  # high score favored
-        if score > best_score:
-            best_score = score
-            best = nid
-    return best
+    # nodes: mapping node_id -> weight (capacity); build RendezvousHash once for repeated lookups
+    return RendezvousHash(nodes).assign(key)
+
+def bench(n_keys=1_000_000, n_nodes=500):
+    import time
+    rng = np.random.default_rng(0)
+    nodes = {f"edge{i}": float(w) for i, w in enumerate(rng.choice([1.0, 2.0, 4.0], n_nodes))}
+    keys = [f"sensor-{i}" for i in range(n_keys)]
+    t0 = time.perf_counter(); kh = key_hashes(keys); t_hash = time.perf_counter() - t0
+    for name, h in (("flat", RendezvousHash(nodes)), ("skeleton", SkeletonHRW(nodes))):
+        t0 = time.perf_counter(); idx = h.assign_batch(keys, hashes=kh); dt = time.perf_counter() - t0 + t_hash
+        w = np.array([nodes[h.ids[i]] for i in range(len(nodes))])
+        load = np.bincount(idx, minlength=len(h.ids))[:len(nodes)] / w  # per unit weight
+        print(f"{name:8s}: {n_keys / dt:,.0f} keys/s over {n_nodes} nodes, "
+              f"gini(load/weight)={gini(load):.4f}, imbalance={imbalance_factor(load):.3f}")
+    t0 = time.perf_counter()
+    for k in keys[:2000]:
+        best = max(nodes, key=lambda nid: math.log(nodes[nid]) - math.log(int(hashlib.sha256((k + nid).encode()).hexdigest(), 16) + 1))
+    print(f"sha256 per-pair loop: {2000 / (time.perf_counter() - t0):,.0f} keys/s")
 
 # Example usage (to be called from orchestration code)
 if __name__ == "__main__":
+    import sys
+    if "--bench" in sys.argv:
+        bench(); sys.exit()
     loads = [100, 10, 5, 2]  # measured events/sec per shard
     print("Gini:", gini(loads))
     print("Imbalance factor:", imbalance_factor(loads))
@@ -44,4 +169,4 @@ if __name__ == "__main__":
     nodes = {"edge1": 1.0, "edge2": 4.0, "edge3": 8.0}  # weights reflect capacity
     key = "sensor-abc-123"
     assigned = weighted_rendezvous_assign(key, nodes)
-    print("Assigned node:", assigned)
\ No newline at end of file
+    print("Assigned node:", assigned)
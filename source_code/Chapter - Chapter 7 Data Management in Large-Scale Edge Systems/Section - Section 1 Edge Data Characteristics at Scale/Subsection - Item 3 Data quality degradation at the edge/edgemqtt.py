@@ -1,9 +1,22 @@
-import time, json, sqlite3
+import time, json, sqlite3, threading, queue, logging
+from collections import deque
+import numpy as np
 import ntplib, paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
 from prometheus_client import Gauge, start_http_server
 
-# Prometheus metric
-sensor_val = Gauge('edge_sensor_value', 'Smoothed sensor value', ['sensor_id'])
+DB_PATH = '/var/lib/edge/sensor_data.db'
+FLUSH_S = 0.05        # batch period of the filter worker
+COMMIT_S = 0.5        # write-behind transaction period
+GAUGE_S = 5.0         # gauge export period (sensors updated since the last export)
+INBOX_MAX = 200_000   # queued messages before on_message blocks the MQTT network thread
+ROWS_MAX = 64         # filtered batches awaiting commit before the filter stops draining
+# Unacked QoS1 messages the broker sends before waiting for PUBACKs. Requested as the
+# MQTT v5 Receive Maximum; v3.1.1 clients get the broker's max_inflight_messages
+# (mosquitto default 20), so raise that setting, and max_queued_messages for the
+# backlog, on the broker. Half a window unacked forces a commit.
+RECEIVE_MAX = 4096
 
 # Simple 1D Kalman filter
 class Kalman1D:
@@ -19,38 +32,288 @@ class Kalman1D:
         self.p *= (1 - k)
         return self.x
 
-# NTP offset (cached)
-ntp_client = ntplib.NTPClient()
-try:
-    resp = ntp_client.request('pool.ntp.org', version=3, timeout=1)
-    ntp_offset = resp.offset
-except Exception:
-    ntp_offset = 0.0
+class KalmanBank:
+    """Kalman1D state for many sensors in arrays indexed by sensor slot."""
+    def __init__(self, q=1e-3, r=1e-2, capacity=1024):
+        self.q, self.r = q, r
+        self.slots, self.ids = {}, []
+        self.x, self.p, self.init = np.zeros(capacity), np.ones(capacity), np.zeros(capacity, bool)
 
-db = sqlite3.connect('/var/lib/edge/sensor_data.db')
-db.execute('CREATE TABLE IF NOT EXISTS data(id TEXT, ts REAL, val REAL)')
-kalman = {}
+    def slot(self, sid):
+        s = self.slots.get(sid)
+        if s is None:
+            s = self.slots[sid] = len(self.ids); self.ids.append(sid)
+            if s == len(self.x):
+                self.x, self.p = np.concatenate([self.x, np.zeros(s)]), np.concatenate([self.p, np.ones(s)])
+                self.init = np.concatenate([self.init, np.zeros(s, bool)])
+        return s
 
-def on_message(_, __, msg):
+    def update(self, slots, z):
+        # messages of one sensor are applied in order: round r updates each sensor's r-th message
+        order = np.argsort(slots, kind='stable')
+        ss = slots[order]
+        first = np.r_[0, np.flatnonzero(ss[1:] != ss[:-1]) + 1]
+        rank = np.empty(len(slots), np.int64)
+        rank[order] = np.arange(len(ss)) - np.repeat(first, np.diff(np.r_[first, len(ss)]))
+        out = np.empty(len(slots))
+        for r in range(int(rank.max(initial=-1)) + 1):
+            m = np.flatnonzero(rank == r)
+            s, zr = slots[m], z[m]
+            new = ~self.init[s]
+            p = self.p[s] + self.q
+            k = p / (p + self.r)
+            x = np.where(new, zr, self.x[s] + k * (zr - self.x[s]))
+            self.x[s], self.p[s] = x, np.where(new, self.p[s], p * (1 - k))
+            self.init[s] = True
+            out[m] = x
+        return out
+
+class IngestPipeline:
+    """MQTT thread enqueues raw messages; a worker filters batches; a writer commits them.
+
+    on_message only appends to a deque. Every FLUSH_S the worker parses the
+    batch, runs KalmanBank over it and hands rows to the writer, which uses
+    one executemany transaction per COMMIT_S and only then acks the messages
+    (in arrival order, malformed ones included). The broker stops delivering
+    once `inflight` messages are unacked, so every inflight/2 arrivals wake the
+    filter and writer early instead of waiting out the timers. A failed commit is retried;
+    meanwhile the filter stops draining at ROWS_MAX and on_message blocks at
+    inbox_max, so the broker holds the backlog. Gauges are refreshed every GAUGE_S.
+    """
+    def __init__(self, db_path=DB_PATH, ntp_offset=0.0, gauge=None, ack=None, inbox_max=INBOX_MAX,
+                 inflight=None):
+        self.db_path, self.ntp_offset, self.gauge, self.ack = db_path, ntp_offset, gauge, ack
+        self.flush_at = max(1, inflight // 2) if inflight else None
+        self.received = self._next_flush = 0  # network thread only
+        self._flush, self._commit = threading.Event(), threading.Event()
+        self.bank = KalmanBank()
+        self.inbox, self.rows, self.inbox_max = deque(), queue.SimpleQueue(), inbox_max
+        self._room = threading.Event()
+        self.dirty, self.children = set(), {}
+        self.latencies = []          # enqueue -> commit, seconds (bench only)
+        self.track_latency = False
+        self._stop = threading.Event()
+        self._threads = [threading.Thread(target=f, daemon=True) for f in (self._filter_loop, self._write_loop)]
+
+    def on_message(self, _, __, msg):
+        while len(self.inbox) >= self.inbox_max and not self._stop.is_set():
+            self._room.clear()
+            self._room.wait(FLUSH_S)  # unacked messages stay with the broker meanwhile
+        self.inbox.append((time.monotonic(), msg))
+        self.received += 1
+        if self.flush_at and self.received >= self._next_flush:
+            self._next_flush = self.received + self.flush_at
+            self._flush.set()  # half the inflight window is waiting on our acks
+
+    def start(self):
+        for t in self._threads:
+            t.start()
+
+    def stop(self):
+        self._stop.set(); self._flush.set()
+        for t in self._threads:
+            t.join()
+
+    def _parse(self, batch):
+        sids, ts, vals, t_in = [], [], [], []
+        for t0, msg in batch:
+            try:
+                p = json.loads(msg.payload)
+                sid = p['sensor_id']; t = float(p['ts']); v = float(p['value'])
+            except Exception:
+                continue  # minimal handling; in production use structured logging and dead-letter queue
+            # basic validation
+            if -2000 < v < 2000:
+                sids.append(sid); ts.append(t); vals.append(v); t_in.append(t0)
+        return sids, ts, vals, t_in
+
+    def process(self, batch):
+        msgs = [m for _, m in batch]
+        sids, ts, vals, t_in = self._parse(batch)
+        if not sids:
+            if msgs:
+                self.rows.put(([], [], msgs))  # nothing to store, still acked in order
+            return
+        slot = self.bank.slot
+        slots = np.fromiter((slot(s) for s in sids), np.int64, len(sids))
+        sv = self.bank.update(slots, np.array(vals))
+        # correct timestamps using NTP offset
+        t = np.array(ts) + self.ntp_offset
+        self.dirty.update(slots.tolist())
+        self.rows.put((list(zip(sids, t.tolist(), sv.tolist())), t_in, msgs))
+
+    def export_gauges(self):
+        if self.gauge is None:
+            return
+        x, ids = self.bank.x, self.bank.ids
+        for s in self.dirty:
+            child = self.children.get(s)
+            if child is None:
+                child = self.children[s] = self.gauge.labels(sensor_id=ids[s])
+            child.set(x[s])
+        self.dirty.clear()
+
+    def _filter_loop(self):
+        last_export = time.monotonic()
+        while not self._stop.is_set() or self.inbox:
+            urgent = self._flush.wait(FLUSH_S)
+            self._flush.clear()
+            if self.rows.qsize() >= ROWS_MAX and not self._stop.is_set():
+                continue  # writer is behind or failing: let the inbox fill up
+            n = len(self.inbox)
+            batch = [self.inbox.popleft() for _ in range(n)]
+            self._room.set()
+            self.process(batch)
+            if urgent:
+                self._commit.set()
+            if time.monotonic() - last_export >= GAUGE_S:
+                self.export_gauges(); last_export = time.monotonic()
+        self.rows.put(None); self._commit.set()
+
+    def _open(self):
+        db = sqlite3.connect(self.db_path)
+        db.execute('PRAGMA journal_mode=WAL'); db.execute('PRAGMA synchronous=NORMAL')
+        db.execute('CREATE TABLE IF NOT EXISTS data(id TEXT, ts REAL, val REAL)')
+        return db
+
+    def _write_loop(self):
+        db, done, failed = None, False, False
+        rows, t_in, msgs = [], [], []
+        while not done:
+            if failed:
+                time.sleep(COMMIT_S)
+            else:
+                self._commit.wait(COMMIT_S); self._commit.clear()
+            while not failed:  # a failed batch is retried alone; ROWS_MAX pushes back upstream
+                try:
+                    item = self.rows.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    done = True; break
+                rows += item[0]; t_in += item[1]; msgs += item[2]
+            try:
+                if db is None:
+                    db = self._open()
+                if rows:
+                    with db:
+                        db.executemany('INSERT INTO data VALUES(?,?,?)', rows)
+            except sqlite3.Error:
+                logging.exception("commit of %d rows failed; retrying", len(rows))
+                if db is not None:
+                    db.close(); db = None  # reopen: recovers from a replaced or remounted file
+                failed = True
+                if self._stop.is_set():
+                    logging.error("stopping with %d messages unacked; the broker redelivers them", len(msgs))
+                    break
+                continue
+            failed = False
+            if self.ack:
+                for m in msgs:  # only after the commit is durable
+                    self.ack(m)
+            if self.track_latency:
+                now = time.monotonic()
+                self.latencies += [now - t for t in t_in]
+            rows, t_in, msgs = [], [], []
+        if db is not None:
+            db.close()
+
+def ntp_offset():
+    # NTP offset (cached)
     try:
-        p = json.loads(msg.payload.decode())
-        sid = p['sensor_id']; t = float(p['ts']); v = float(p['value'])
-        # correct timestamp using NTP offset
-        t += ntp_offset
-        # basic validation
-        if not (-2000 < v < 2000): return
-        k = kalman.setdefault(sid, Kalman1D())
-        sv = k.update(v)
-        sensor_val.labels(sensor_id=sid).set(sv)
-        db.execute('INSERT INTO data VALUES(?,?,?)', (sid, t, sv))
-        db.commit()
+        return ntplib.NTPClient().request('pool.ntp.org', version=3, timeout=1).offset
     except Exception:
-        # minimal logging; in production use structured logging and dead-letter queue
-        pass
-
-start_http_server(8000)  # Prometheus scrape endpoint
-client = mqtt.Client()
-client.on_message = on_message
-client.connect('localhost', 1883, 60)
-client.subscribe('sensors/+/vibration', qos=1)
-client.loop_forever()
\ No newline at end of file
+        return 0.0
+
+def main():
+    # Prometheus metric
+    sensor_val = Gauge('edge_sensor_value', 'Smoothed sensor value', ['sensor_id'])
+    # manual_ack: a message is acked once its row is committed, so a crash means redelivery
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id='edge_ingest',
+                         protocol=mqtt.MQTTv5, manual_ack=True)
+    pipe = IngestPipeline(DB_PATH, ntp_offset(), sensor_val, ack=lambda m: client.ack(m.mid, m.qos),
+                          inflight=RECEIVE_MAX)
+    pipe.start()
+    start_http_server(8000)  # Prometheus scrape endpoint
+    client.on_message = pipe.on_message
+    props = Properties(PacketTypes.CONNECT)
+    props.ReceiveMaximum, props.SessionExpiryInterval = RECEIVE_MAX, 3600  # persistent session
+    client.connect('localhost', 1883, 60, clean_start=False, properties=props)
+    client.subscribe('sensors/+/vibration', qos=1)
+    client.loop_forever()
+
+def bench(n_sensors=50_000, seconds=3.0, rate=100_000):
+    # the bench thread stands in for the MQTT network loop, offering `rate` msgs/s
+    import tempfile, os
+    class Msg:
+        __slots__ = ('payload',)
+        def __init__(self, p): self.payload = p
+    rng = np.random.default_rng(0)
+    msgs = [Msg(json.dumps({'sensor_id': f's{i % n_sensors}', 'ts': 1.7e9 + i * 1e-5,
+                            'value': float(v)}).encode()) for i, v in enumerate(rng.normal(0, 1, 200_000))]
+    d = tempfile.mkdtemp()
+
+    # previous path: parse, per-sensor object, INSERT + commit per message (sample)
+    db, kalman = sqlite3.connect(os.path.join(d, 'old.db')), {}
+    db.execute('CREATE TABLE IF NOT EXISTS data(id TEXT, ts REAL, val REAL)')
+    t0 = time.perf_counter()
+    for m in msgs[:5000]:
+        p = json.loads(m.payload.decode())
+        sv = kalman.setdefault(p['sensor_id'], Kalman1D()).update(float(p['value']))
+        db.execute('INSERT INTO data VALUES(?,?,?)', (p['sensor_id'], float(p['ts']), sv)); db.commit()
+    print(f"per-message commit: {5000 / (time.perf_counter() - t0):10,.0f} msgs/s")
+
+    for label, offered in (("saturated", None), ("paced", rate)):
+        pipe = IngestPipeline(os.path.join(d, f'{label}.db'), inbox_max=2_000_000)
+        pipe.track_latency = True
+        sent, t0 = 0, time.perf_counter()
+        if offered is None:  # backlog already queued: drain rate of filter + writer
+            for i in range(1_000_000):
+                pipe.on_message(None, None, msgs[i % len(msgs)])
+            sent, t0 = 1_000_000, time.perf_counter()
+        pipe.start()
+        while offered and (el := time.perf_counter() - t0) < seconds:
+            due = int(el * offered)
+            for i in range(sent, due):
+                pipe.on_message(None, None, msgs[i % len(msgs)])
+            sent = due
+            time.sleep(0.001)
+        pipe.stop()
+        dt = time.perf_counter() - t0
+        lat = np.array(pipe.latencies)
+        print(f"batched, {label:9s}: {len(lat) / dt:10,.0f} msgs/s committed"
+              + (f" at {offered:,} offered, p50 {np.percentile(lat, 50) * 1e3:.0f} ms, "
+                 f"p99 {np.percentile(lat, 99) * 1e3:.0f} ms enqueue->commit" if offered else ""))
+    ref = [Kalman1D() for _ in range(3)]
+    slots = np.array([pipe.bank.slots[f's{i}'] for i in range(3)])
+    for m in msgs * (sent // len(msgs)) + msgs[:sent % len(msgs)]:
+        p = json.loads(m.payload)
+        i = int(p['sensor_id'][1:])
+        if i < 3:
+            ref[i].update(float(p['value']))
+    print(f"max |x - Kalman1D| over checked sensors: {np.abs(pipe.bank.x[slots] - [k.x for k in ref]).max():.2e}")
+
+    # emulated broker: delivers QoS1 messages only while fewer than `window` are unacked,
+    # and each PUBACK (the pipeline's ack after commit) frees a slot
+    for label, window, inflight in (("timer commits", 20, None), ("window flush", 20, 20),
+                                    ("window flush", RECEIVE_MAX, RECEIVE_MAX)):
+        slots, stop = threading.Semaphore(window), threading.Event()
+        pipe = IngestPipeline(os.path.join(d, f'broker{window}{inflight}.db'), ack=lambda m: slots.release(),
+                              inflight=inflight)
+        pipe.track_latency = True
+        def deliver():
+            i = 0
+            while not stop.is_set():
+                if slots.acquire(timeout=0.05):
+                    pipe.on_message(None, None, msgs[i % len(msgs)]); i += 1
+        broker = threading.Thread(target=deliver)
+        pipe.start(); broker.start()
+        t0 = time.perf_counter()
+        time.sleep(seconds)
+        n = len(pipe.latencies); dt = time.perf_counter() - t0
+        stop.set(); broker.join(); pipe.stop()
+        print(f"broker, inflight {window:5d}, {label:13s}: {n / dt:10,.0f} msgs/s committed and acked")
+
+if __name__ == '__main__':
+    import sys
+    bench() if '--bench' in sys.argv else main()
@@ -1,12 +1,19 @@
 #!/usr/bin/env python3
 # Production-ready: asyncio event loop, persistent counters, MinIO integration.
-import asyncio, time, math
+# Accesses only touch an in-memory forward-decayed counter; counters reach
+# LevelDB in periodic write batches, promotion runs from a threshold/top-K
+# index on a timer, and fetches are ranged, resumable and run in a bounded pool.
+# Promoted objects that cool below half the threshold are dropped from the local store.
+import asyncio, time, math, os, struct, heapq, hashlib
 import plyvel                # RocksDB binding; prebuilt on ARM64
+import urllib3
 from minio import Minio      # S3-compatible client for shared store
+from minio.error import MinioException, S3Error
 
 DB_PATH = "/var/lib/edge/state_counters"
 LOCAL_STORE = "/var/lib/edge/local_store"
 MINIO_ENDPOINT = "minio.cluster.local:9000"
+BUCKET = "shared-bucket"
 
 # cost profile (tunable by ops)
 L_LOC = 0.005    # sec
@@ -14,8 +21,16 @@ L_REM = 0.050    # sec
 B_COST = 0.002   # sec-equivalent per access
 S_COST = 0.0005  # sec-equivalent per second amortized
 
-client = Minio(MINIO_ENDPOINT, access_key="AK", secret_key="SK", secure=False)
-db = plyvel.DB(DB_PATH, create_if_missing=True)
+TAU = 300.0              # decay time constant, seconds
+FLUSH_INTERVAL = 5.0     # seconds between counter write batches
+PROMOTE_INTERVAL = 1.0   # seconds between promotion scans
+PROMOTE_TOP_K = 64       # max promotions started per scan
+DEMOTE_FRACTION = 0.5    # local copies go once their score is below this share of the threshold
+FETCH_WORKERS = 8        # concurrent object fetches
+RANGE_BYTES = 8 << 20    # bytes per ranged GET
+_REC = struct.Struct("<dd")  # (decayed count, unix time) per key
+FETCH_RETRY = (OSError, MinioException, urllib3.exceptions.HTTPError)  # transient: resume the .part
+PERMANENT_S3 = {"NoSuchKey", "NoSuchBucket", "AccessDenied"}
 
 def lambda_threshold(l_rem=L_REM, l_loc=L_LOC, b=B_COST, s=S_COST):
     denom = (l_rem - l_loc - b)
@@ -23,36 +38,291 @@ def lambda_threshold(l_rem=L_REM, l_loc=L_LOC, b=B_COST, s=S_COST):
 
 LAMBDA_STAR = lambda_threshold()
 
+class AccessTracker:
+    """Forward-decayed float counters with a promotion threshold index.
+
+    A counter is stored as sum(exp((t_i - t0) / tau)); its decayed value at
+    time t is that sum * exp(-(t - t0) / tau). All keys share t0, so an
+    access is one add, and ranking keys needs no decay at all. t0 is moved
+    forward (rescaling every counter) before the exponent can overflow.
+    """
+    def __init__(self, db, tau=TAU, threshold=LAMBDA_STAR * TAU, now=None):
+        self.db, self.tau, self.threshold = db, tau, threshold
+        self.t0 = time.time() if now is None else now
+        self.scores = {}     # key -> forward-decayed score (reference t0)
+        self.dirty = set()
+        self.hot = set()     # keys above threshold, not yet local
+        self.local = set()   # keys already promoted
+        self.flushed_at = time.monotonic()  # last counter write batch / demotion scan
+        self._tick, self._w = None, 1.0
+        for key, raw in db:  # one sequential scan at startup instead of a get per access
+            if len(raw) == _REC.size:
+                count, ts = _REC.unpack(raw)
+            else:  # text b"count,ts" from the previous per-access path; rewritten packed on flush
+                try:
+                    count, ts = map(float, raw.split(b","))
+                except ValueError:
+                    continue
+                self.dirty.add(key)
+            self.scores[key] = count * math.exp((ts - self.t0) / tau)
+
+    def _weight(self, now):
+        # exp((now - t0)/tau), recomputed at most once per second
+        tick = int(now)
+        if tick != self._tick:
+            if (now - self.t0) / self.tau > 600:
+                self._rebase(now)
+            self._tick, self._w = tick, math.exp((tick - self.t0) / self.tau)
+        return self._w
+
+    def _rebase(self, now):
+        f = math.exp(-(now - self.t0) / self.tau)
+        for k in self.scores:
+            self.scores[k] *= f
+        self.t0, self._tick = now, None
+
+    def record(self, key: bytes, now=None):
+        w = self._weight(time.time() if now is None else now)
+        s = self.scores.get(key, 0.0) + w
+        self.scores[key] = s
+        self.dirty.add(key)
+        if s > self.threshold * w and key not in self.local:
+            self.hot.add(key)
+
+    def value(self, key: bytes, now=None):
+        now = time.time() if now is None else now
+        return self.scores.get(key, 0.0) * math.exp(-(now - self.t0) / self.tau)
+
+    def drain(self, now=None):
+        # snapshot of counters touched since the last flush, as packed records
+        now = time.time() if now is None else now
+        f = math.exp(-(now - self.t0) / self.tau)
+        rows = [(k, _REC.pack(self.scores[k] * f, now)) for k in self.dirty]
+        self.dirty.clear()
+        return rows
+
+    def write(self, rows):
+        # one LevelDB write batch; safe off the event loop (touches no tracker state)
+        with self.db.write_batch() as wb:
+            for k, v in rows:
+                wb.put(k, v)
+        return len(rows)
+
+    def flush(self, now=None):
+        return self.write(self.drain(now))
+
+    def take_promotions(self, k=PROMOTE_TOP_K, now=None):
+        # hottest keys still above threshold (they may have cooled since crossing it)
+        w = math.exp(((time.time() if now is None else now) - self.t0) / self.tau)
+        for key in [key for key in self.hot if self.scores[key] <= self.threshold * w]:
+            self.hot.discard(key)
+        top = heapq.nlargest(k, self.hot, key=self.scores.__getitem__)
+        self.hot.difference_update(top)
+        self.local.update(top)
+        return top
+
+    def take_demotions(self, now=None):
+        # promoted keys that have cooled well below the threshold (hysteresis against flapping)
+        w = math.exp(((time.time() if now is None else now) - self.t0) / self.tau)
+        cold = [k for k in self.local if self.scores.get(k, 0.0) <= DEMOTE_FRACTION * self.threshold * w]
+        self.local.difference_update(cold)
+        return cold
+
+class ObjectFetcher:
+    """Bounded pool of ranged, resumable downloads into LOCAL_STORE."""
+    def __init__(self, client, store=LOCAL_STORE, bucket=BUCKET, workers=FETCH_WORKERS, range_bytes=RANGE_BYTES):
+        self.client, self.store, self.bucket, self.range_bytes = client, store, bucket, range_bytes
+        self.slots = asyncio.Semaphore(workers)
+        self.inflight = {}
+
+    def path(self, key: bytes):
+        return os.path.join(self.store, key.decode() + ".blob")
+
+    def promote(self, key: bytes):
+        # idempotent: one task per key; completed files are never refetched
+        task = self.inflight.get(key)
+        if task is None:
+            task = self.inflight[key] = asyncio.ensure_future(self._promote(key))
+            task.add_done_callback(lambda _t: self.inflight.pop(key, None))
+        return task
+
+    def demote(self, key: bytes):
+        # drop the local copy (the shared store still has it); False while a fetch is running
+        if key in self.inflight:
+            return False
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+        return True
+
+    async def _promote(self, key: bytes):
+        if os.path.exists(self.path(key)):
+            return
+        async with self.slots:
+            loop = asyncio.get_running_loop()
+            for attempt in range(5):
+                try:
+                    return await loop.run_in_executor(None, self._download, key)
+                except FETCH_RETRY as e:
+                    if isinstance(e, S3Error) and e.code in PERMANENT_S3:
+                        raise
+                    await asyncio.sleep(0.5 * 2 ** attempt)  # .part keeps what arrived
+            raise RuntimeError(f"promotion of {key!r} failed")
+
+    def _download(self, key: bytes):
+        # ranged GETs appended to <name>.part; a retry resumes at its current size as long
+        # as the object's ETag (kept in <name>.part.etag) is unchanged, else starts over
+        name, final = key.decode(), self.path(key)
+        part, tag = final + ".part", final + ".part.etag"
+        st = self.client.stat_object(self.bucket, name)
+        etag = (st.etag or "").strip('"')
+        try:
+            with open(tag) as f:
+                same = f.read() == etag
+        except FileNotFoundError:
+            same = False
+        if not same:
+            open(part, "wb").close()
+            with open(tag, "w") as f:
+                f.write(etag)
+        with open(part, "ab") as f:
+            off = f.tell()
+            while off < st.size:
+                n = min(self.range_bytes, st.size - off)
+                # If-Match: a replaced object fails with 412 instead of splicing two versions
+                resp = self.client.get_object(self.bucket, name, offset=off, length=n,
+                                              request_headers={"If-Match": st.etag} if etag else None)
+                try:
+                    for chunk in resp.stream(256 * 1024):
+                        f.write(chunk); off += len(chunk)
+                finally:
+                    resp.close(); resp.release_conn()
+            f.flush(); os.fsync(f.fileno())
+        # single-part ETags are the content MD5; multipart ones ("...-N") can only be size-checked
+        got = os.path.getsize(part)
+        if got != st.size or (etag and "-" not in etag and _md5(part) != etag):
+            os.remove(part)
+            raise OSError(f"{name}: fetched {got} bytes, expected {st.size} (etag {etag}); refetching")
+        os.replace(part, final)  # atomic publish
+        os.remove(tag)
+
+def _md5(path):
+    h = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _on_fetched(tracker, key, task):
+    # a failed fetch makes the key eligible for promotion again
+    if task.cancelled() or task.exception() is not None:
+        tracker.local.discard(key)
+
+async def housekeeping(tracker, fetcher):
+    # every FLUSH_INTERVAL: one counter write batch, and cold local copies are removed
+    if time.monotonic() - tracker.flushed_at < FLUSH_INTERVAL:
+        return
+    tracker.flushed_at = time.monotonic()
+    for key in tracker.take_demotions():
+        if not fetcher.demote(key):
+            tracker.local.add(key)  # still fetching; retried next interval
+    await asyncio.get_running_loop().run_in_executor(None, tracker.write, tracker.drain())
+
+async def promotion_loop(tracker, fetcher):
+    # the per-access path never awaits I/O; this timer drains the threshold index
+    while True:
+        await asyncio.sleep(PROMOTE_INTERVAL)
+        for key in tracker.take_promotions():
+            fetcher.promote(key).add_done_callback(lambda t, k=key: _on_fetched(tracker, k, t))
+        await housekeeping(tracker, fetcher)
+
+_tracker = _fetcher = None
+
+def _defaults():
+    global _tracker, _fetcher
+    if _tracker is None:
+        _tracker = AccessTracker(plyvel.DB(DB_PATH, create_if_missing=True))
+        _fetcher = ObjectFetcher(Minio(MINIO_ENDPOINT, access_key="AK", secret_key="SK", secure=False))
+    return _tracker, _fetcher
+
 async def record_access(key: bytes):
-    # increment time-decayed counter (simple exponential decay)
-    now = int(time.time())
-    raw = db.get(key) or b"0,0"
-    count, last = map(int, raw.split(b","))
-    dt = now - last if last else 0
-    # decay factor per second, tau=300s
-    tau = 300.0
-    decayed = count * math.exp(-dt / tau)
-    decayed += 1.0
-    db.put(key, f"{int(decayed)},{now}".encode())
-
-    if decayed > LAMBDA_STAR * tau:   # map to comparable window
-        await promote_local(key)
+    # previous entry point: count the access; crossing the threshold promotes before returning.
+    # Counters are persisted from here too, so callers need not run promotion_loop.
+    tracker, fetcher = _defaults()
+    tracker.record(key)
+    await housekeeping(tracker, fetcher)
+    if key in tracker.hot:
+        tracker.hot.discard(key); tracker.local.add(key)
+        task = fetcher.promote(key)
+        task.add_done_callback(lambda t: _on_fetched(tracker, key, t))
+        await task
 
 async def promote_local(key: bytes):
-    # idempotent: check if present locally, otherwise fetch from MinIO and persist
-    local_path = f"{LOCAL_STORE}/{key.decode()}.blob"
-    try:
-        with open(local_path, "rb"):
-            return
-    except FileNotFoundError:
-        # stream from MinIO and write atomically
-        obj = client.get_object("shared-bucket", key.decode())
-        with open(local_path + ".tmp", "wb") as f:
-            for chunk in obj.stream(32*1024):
-                f.write(chunk)
-        # atomic rename
-        import os
-        os.replace(local_path + ".tmp", local_path)
-
-# example hook: called by local HTTP server or SDK on each data read
-# asyncio.run(record_access(b"sensor_42_stream"))
\ No newline at end of file
+    # previous entry point: fetch one object into LOCAL_STORE now (idempotent)
+    await _defaults()[1].promote(key)
+
+def main():
+    (tracker, fetcher), loop = _defaults(), asyncio.new_event_loop()
+    # example hook: the local HTTP server or SDK calls tracker.record(key) on each read
+    loop.run_until_complete(promotion_loop(tracker, fetcher))
+
+def bench(keys=50_000, accesses=1_000_000, obj_bytes=4 << 20):
+    # stand-ins: dict-backed LevelDB, and an S3 store with 20 ms first-byte latency and ~200 MB/s
+    import random, tempfile
+    class MemDB(dict):
+        def __iter__(self): return iter(self.items())
+        def put(self, k, v): self[k] = v
+        def write_batch(self):
+            db = self
+            class WB:
+                def __enter__(s): s.ops = []; return s
+                def put(s, k, v): s.ops.append((k, v))
+                def __exit__(s, *exc): db.update(s.ops)
+            return WB()
+    class S3Stub:
+        class Obj:
+            def __init__(self, n): self.n = n
+            def stream(self, amt):
+                left = self.n
+                while left:
+                    c = min(amt, left); time.sleep(c / 200e6); left -= c
+                    yield bytes(c)
+            def close(self): pass
+            def release_conn(self): pass
+        class Stat:
+            size, etag = obj_bytes, '"%s"' % hashlib.md5(bytes(obj_bytes)).hexdigest()
+        def stat_object(self, bucket, name): time.sleep(0.02); return self.Stat()
+        def get_object(self, bucket, name, offset=0, length=None, **kw): time.sleep(0.02); return self.Obj(length)
+    rng = random.Random(0)
+    stream = [b"obj-%d" % min(int(rng.paretovariate(1.2)), keys) for _ in range(accesses)]
+
+    db = MemDB()
+    t0 = time.perf_counter()
+    for key in stream:  # previous path: get + parse + int-truncated decay + put, per access
+        now = int(time.time()); count, last = map(int, (db.get(key) or b"0,0").split(b","))
+        decayed = count * math.exp(-(now - last if last else 0) / TAU) + 1.0
+        db.put(key, f"{int(decayed)},{now}".encode())
+    old = (time.perf_counter() - t0) / accesses
+
+    tracker = AccessTracker(MemDB(), threshold=200.0)
+    t0 = time.perf_counter()
+    for key in stream:
+        tracker.record(key)
+    new = (time.perf_counter() - t0) / accesses
+    t0 = time.perf_counter(); n = tracker.flush(); t_flush = time.perf_counter() - t0
+    print(f"per-access: {old * 1e6:.2f} us (get+put) -> {new * 1e6:.2f} us (in-memory); "
+          f"flush of {n} dirty counters {t_flush * 1e3:.1f} ms; hot keys {len(tracker.hot)}")
+
+    async def promote(workers):
+        with tempfile.TemporaryDirectory() as d:
+            f = ObjectFetcher(S3Stub(), store=d, workers=workers)
+            t0 = time.perf_counter()
+            await asyncio.gather(*(f.promote(b"obj-%d" % i) for i in range(32)))
+            return time.perf_counter() - t0
+    seq, par = asyncio.run(promote(1)), asyncio.run(promote(FETCH_WORKERS))
+    print(f"promote 32 x {obj_bytes >> 20} MiB: {seq:.2f}s with 1 worker, {par:.2f}s with {FETCH_WORKERS}")
+
+if __name__ == "__main__":
+    import sys
+    bench() if "--bench" in sys.argv else main()
@@ -1,5 +1,8 @@
-from typing import List, Dict, Tuple
-import hashlib, heapq
+from typing import List, Dict, Sequence
+import hashlib
+import numpy as np
+
+_M1, _M2 = np.uint64(0xbf58476d1ce4e5b9), np.uint64(0x94d049bb133111eb)
 
 class Node:
     def __init__(self, node_id: str, weight: float = 1.0,
@@ -9,44 +12,65 @@ class Node:
         self.domain = domain
         self.up = up
 
-def _score(node_id: str, key: str) -> int:
-    # stable 160-bit hash; deterministic across processes
-    h = hashlib.sha1(f"{node_id}:{key}".encode("utf-8")).digest()
-    return int.from_bytes(h, "big")
+def _hash64(data: bytes) -> int:
+    # stable 64-bit hash; deterministic across processes
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+def _costs(key_hashes: np.ndarray, seeds: np.ndarray, inv_w: np.ndarray) -> np.ndarray:
+    # weighted HRW: splitmix64(key ^ node seed) -> u in (0,1); cost -ln(u)/w, lowest wins
+    z = key_hashes[:, None] ^ seeds[None, :]
+    z = (z ^ (z >> np.uint64(30))) * _M1
+    z = (z ^ (z >> np.uint64(27))) * _M2
+    z ^= z >> np.uint64(31)
+    u = ((z >> np.uint64(11)).astype(np.float64) + 0.5) * 2.0 ** -53
+    return -np.log(u) * inv_w[None, :]
+
+class ReplicaPlacer:
+    """Precomputed node seeds/weights/domains for repeated replica placement.
+
+    Rebuild (cheap) when membership, weights or health change.
+    """
+    def __init__(self, nodes: List[Node], block: int = 1 << 21):
+        self.nodes = [n for n in nodes if n.up]
+        self.ids = [n.id for n in self.nodes]
+        self.seeds = np.array([_hash64(n.id.encode("utf-8")) for n in self.nodes], dtype=np.uint64)
+        self.inv_w = 1.0 / np.array([n.weight for n in self.nodes])
+        doms = {d: i for i, d in enumerate(sorted({n.domain for n in self.nodes}))}
+        self.dom = np.array([doms[n.domain] for n in self.nodes], dtype=np.int64)
+        self.n_domains = len(doms)
+        self.rows = max(1, block // max(len(self.nodes), 1))
+
+    def assign_batch(self, shard_keys: Sequence[str], R: int,
+                     avoid_same_domain: bool = True) -> np.ndarray:
+        """(len(keys), R) node indices into self.ids, best replica first."""
+        if len(self.nodes) < R:
+            raise RuntimeError("insufficient healthy nodes for replicas")
+        kh = np.fromiter((_hash64(k.encode("utf-8")) for k in shard_keys), dtype=np.uint64, count=len(shard_keys))
+        out = np.empty((len(kh), R), dtype=np.int32)
+        for lo in range(0, len(kh), self.rows):
+            c = _costs(kh[lo:lo + self.rows], self.seeds, self.inv_w)
+            rows = np.arange(len(c))
+            used = np.zeros((len(c), self.n_domains), dtype=bool)
+            for r in range(R):
+                pick = c
+                if avoid_same_domain and r < self.n_domains:
+                    # skip nodes in domains already holding a replica, while distinct domains remain
+                    pick = np.where(used[:, self.dom], np.inf, c)
+                j = pick.argmin(1)
+                out[lo + rows, r] = j
+                c[rows, j] = np.inf
+                used[rows, self.dom[j]] = True
+        return out
+
+    def assign(self, shard_key: str, R: int, avoid_same_domain: bool = True) -> List[str]:
+        return [self.ids[i] for i in self.assign_batch([shard_key], R, avoid_same_domain)[0]]
 
 def assign_replicas(shard_key: str, nodes: List[Node], R: int,
                     avoid_same_domain: bool = True) -> List[str]:
-    # filter healthy nodes
-    candidates = [n for n in nodes if n.up]
-    if len(candidates) < R:
-        raise RuntimeError("insufficient healthy nodes for replicas")
-
-    heap: List[Tuple[float, Node]] = []
-    # compute weighted score and select top R distinct-domain nodes
-    for n in candidates:
-        s = _score(n.id, shard_key)
-        # larger weight -> prefer node; normalize to float range
-        weighted = s * n.weight
-        heapq.heappush(heap, (-weighted, n))  # max-heap via negative
-    selected: List[Node] = []
-    seen_domains = set()
-    # pop until R selected, optionally skipping same-domain nodes
-    while heap and len(selected) < R:
-        _, n = heapq.heappop(heap)
-        if avoid_same_domain and n.domain in seen_domains:
-            # allow same-domain if not enough distinct domains
-            if len([nd for nd in candidates if nd.domain not in seen_domains]) == 0:
-                selected.append(n)
-                seen_domains.add(n.domain)
-            else:
-                continue
-        else:
-            selected.append(n)
-            seen_domains.add(n.domain)
-    if len(selected) < R:
-        raise RuntimeError("unable to satisfy placement constraints")
-    return [n.id for n in selected]
+    # one-off convenience; keep a ReplicaPlacer around for repeated or batched placement
+    return ReplicaPlacer(nodes).assign(shard_key, R, avoid_same_domain)
 
 # Example usage:
 # nodes = [Node("edge-01", weight=2.0, domain="siteA"), ...]
-# assign_replicas("shard-123", nodes, R=3)
\ No newline at end of file
+# assign_replicas("shard-123", nodes, R=3)
+# placer = ReplicaPlacer(nodes); placer.assign_batch(shard_keys, R=3)  # (len(keys), 3) indices
@@ -1,7 +1,15 @@
 #!/usr/bin/env python3
-"""Edge storage health agent: detect failing devices and proactively replicate objects."""
+"""Edge storage health agent: detect failing devices and proactively replicate objects.
 
-import hashlib, logging, os, shlex, shutil, sqlite3, subprocess, time
+Scrubbing is incremental: every cycle stats the tracked objects and re-hashes
+at once only those whose size/mtime fingerprint changed; full content
+verification is spread over SCRUB_WINDOW (oldest-verified first), hashed in
+parallel with large readinto buffers under a byte-rate limit. Replication is
+one rsync session per peer with a --files-from list.
+"""
+
+import hashlib, logging, os, shlex, shutil, sqlite3, subprocess, tempfile, threading, time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import List
 
@@ -10,6 +18,12 @@ PEERS = ["edge-peer-1.example.com:/data/replicas", "edge-peer-2.example.com:/dat
 DATA_DIR = Path("/var/lib/edge_data")
 DB_PATH = "/var/lib/edge_meta.sqlite"
 SMARTCTL = "/usr/sbin/smartctl"
+RSYNC = "rsync"
+SCRUB_WINDOW = 7 * 86400        # every object is fully re-hashed at least this often
+SCRUB_RATE = 200 * 2**20        # bytes/s budget for verification reads
+SCRUB_WORKERS = 4
+READ_BUF = 8 * 2**20            # per-worker readinto buffer
+CYCLE_S = 300
 
 logging.basicConfig(level=logging.INFO)
 
@@ -20,6 +34,40 @@ def sha256_file(path: Path) -> str:
             h.update(chunk)
     return h.hexdigest()
 
+class RateLimiter:
+    """Token bucket in bytes/s shared by the hashing workers."""
+    def __init__(self, rate: float, burst: float = None):
+        self.rate, self.burst = rate, burst or rate
+        self.tokens, self.t = self.burst, time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self, n: int):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.t) * self.rate)
+            self.t = now
+            self.tokens -= n
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+
+_buf = threading.local()
+
+def sha256_file_fast(path: Path, limiter: RateLimiter = None) -> str:
+    # one reusable buffer per thread; hashlib releases the GIL on large updates
+    buf = getattr(_buf, "b", None)
+    if buf is None:
+        buf = _buf.b = bytearray(READ_BUF)
+    mv, h = memoryview(buf), hashlib.sha256()
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                return h.hexdigest()
+            if limiter:
+                limiter.take(n)
+            h.update(mv[:n])
+
 def smart_good(device: str) -> bool:
     try:
         out = subprocess.check_output([SMARTCTL, "-H", device], stderr=subprocess.STDOUT)
@@ -28,48 +76,183 @@ def smart_good(device: str) -> bool:
         logging.warning("smartctl failed: %s", e)
         return False
 
+def init_db(conn):
+    # fingerprint/verification columns added in place to the existing objects table
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(objects)")}
+    for col, typ in (("size", "INTEGER"), ("mtime_ns", "INTEGER"), ("verified_at", "REAL")):
+        if col not in cols:
+            conn.execute(f"ALTER TABLE objects ADD COLUMN {col} {typ}")
+    conn.execute("CREATE INDEX IF NOT EXISTS objects_verified ON objects(verified_at)")
+    conn.commit()
+
 def get_tracked_objects(conn) -> List[tuple]:
     cur = conn.execute("SELECT path,sha256 FROM objects")
     return cur.fetchall()
 
+def changed_objects(conn) -> List[tuple]:
+    # cheap stat pass: size/mtime differs from the fingerprint recorded at last verification
+    out, first_seen = [], []
+    for path, expected, size, mtime_ns in conn.execute("SELECT path,sha256,size,mtime_ns FROM objects"):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        except OSError as e:  # EIO etc.: let scrub mark it corrupt so it is restored
+            logging.warning("stat %s failed: %s", path, e)
+            out.append((path, expected))
+            continue
+        if size is None:
+            # no fingerprint yet (new row or upgrade): record it; the windowed scrub hashes it
+            first_seen.append((st.st_size, st.st_mtime_ns, path))
+        elif st.st_size != size or st.st_mtime_ns != mtime_ns:
+            out.append((path, expected))
+    if first_seen:
+        with conn:
+            conn.executemany("UPDATE objects SET size=?, mtime_ns=? WHERE path=?", first_seen)
+    return out
+
+def due_objects(conn, budget_bytes: int, now: float) -> List[tuple]:
+    # oldest-verified first, up to this cycle's share of the scrub window
+    out, total = [], 0
+    cur = conn.execute("SELECT path,sha256,size FROM objects WHERE verified_at IS NULL OR verified_at < ? "
+                       "ORDER BY verified_at IS NOT NULL, verified_at", (now - SCRUB_WINDOW,))
+    for path, expected, size in cur:
+        out.append((path, expected)); total += size or 0
+        if total >= budget_bytes:
+            break
+    return out
+
+def scrub(conn, objects, limiter=None, workers=SCRUB_WORKERS):
+    """Hash objects in parallel; record fingerprints; return the corrupt paths (unreadable ones included)."""
+    def check(item):
+        path, expected = item
+        try:
+            st = os.stat(path)
+            return path, sha256_file_fast(Path(path), limiter) == expected, st.st_size, st.st_mtime_ns
+        except FileNotFoundError:
+            return path, None, None, None
+        except OSError as e:  # media error: treat as corrupt, the peer copy replaces it
+            logging.warning("reading %s failed: %s", path, e)
+            return path, False, None, None
+    now, bad, rows = time.time(), [], []
+    with ThreadPoolExecutor(workers) as pool:
+        for path, ok, size, mtime_ns in pool.map(check, objects):
+            if ok is None:
+                continue
+            if not ok:
+                bad.append(path)
+            rows.append((size, mtime_ns, now if ok else None, path))
+    with conn:  # one transaction for the whole batch
+        conn.executemany("UPDATE objects SET size=?, mtime_ns=?, verified_at=? WHERE path=?", rows)
+    return bad
+
+def _rel(paths):
+    # --files-from entries must lie under DATA_DIR; a "../" entry would fail the whole batch
+    rel = []
+    for p in paths:
+        r = os.path.relpath(p, DATA_DIR)
+        if r == os.pardir or r.startswith(os.pardir + os.sep):
+            logging.warning("Skipping %s: outside %s, not replicable", p, DATA_DIR)
+        else:
+            rel.append(r)
+    return rel
+
+def rsync_batch(paths, src, dst, checksum=False) -> bool:
+    # a single rsync session for the whole list (paths relative to src); checksum=True
+    # compares content instead of size+mtime, which bit rot leaves unchanged
+    if not paths:
+        return True
+    with tempfile.NamedTemporaryFile("w", suffix=".list") as lst:
+        lst.write("\n".join(paths) + "\n"); lst.flush()
+        cmd = [RSYNC, "-a"] + (["--checksum"] if checksum else []) + [f"--files-from={lst.name}", src, dst]
+        try:
+            subprocess.check_call(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+            return True
+        except subprocess.CalledProcessError:
+            return False
+
 def replicate_to_peer(src: Path, peer: str) -> bool:
     # Use rsync over SSH; rely on SSH keys and directory permissions
-    cmd = ["rsync", "-a", str(src), peer]
-    try:
-        subprocess.check_call(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
-        return True
-    except subprocess.CalledProcessError:
-        return False
+    return rsync_batch(_rel([src]), f"{DATA_DIR}/", peer)
+
+def push_to_peers(paths) -> int:
+    # degraded device: copy verified objects out; first peer that accepts the batch wins
+    for peer in PEERS:
+        if rsync_batch(_rel(paths), f"{DATA_DIR}/", peer):
+            logging.info("Replicated %d objects to %s", len(paths), peer)
+            return 1
+        logging.warning("Replication to %s failed, trying next peer", peer)
+    return 0
+
+def restore_from_peers(paths) -> int:
+    # corrupt local copies are pulled back, never pushed out
+    for peer in PEERS:
+        if rsync_batch(_rel(paths), f"{peer.rstrip('/')}/", f"{DATA_DIR}/", checksum=True):
+            logging.info("Restored %d objects from peer %s", len(paths), peer)
+            return 1
+    logging.error("Restore of %d objects failed on all peers", len(paths))
+    return 0
 
 def main():
     conn = sqlite3.connect(DB_PATH, timeout=30)
+    init_db(conn)
+    limiter = RateLimiter(SCRUB_RATE)
     while True:
+        now = time.time()
+        todo = {p: e for p, e in changed_objects(conn)}
+        # this cycle's share of a full pass: total bytes * cycle / window
+        total = conn.execute("SELECT COALESCE(SUM(size),0) FROM objects").fetchone()[0]
+        for p, e in due_objects(conn, max(READ_BUF, total * CYCLE_S // SCRUB_WINDOW), now):
+            todo.setdefault(p, e)
+        bad = scrub(conn, list(todo.items()), limiter)
+        for p in bad:
+            logging.warning("Detected corrupt object %s", p)
         # Device health check example on /dev/nvme0n1
         if not smart_good("/dev/nvme0n1"):
             logging.error("Device health degraded on /dev/nvme0n1; triggering proactive replication")
-            for path, expected in get_tracked_objects(conn):
-                p = Path(path)
-                if not p.exists(): continue
-                # verify checksum and push to peers
-                actual = sha256_file(p)
-                if actual != expected:
-                    logging.warning("Checksum mismatch %s; scheduling replication", p)
-                for peer in PEERS:
-                    if replicate_to_peer(p, peer):
-                        logging.info("Replicated %s to %s", p, peer)
-                        break
-                    else:
-                        logging.warning("Replication to %s failed, retrying later", peer)
-        # periodic verification sweep
-        for path, expected in get_tracked_objects(conn):
-            p = Path(path)
-            if not p.exists(): continue
-            if sha256_file(p) != expected:
-                logging.warning("Detected corrupt object %s", p)
-                for peer in PEERS:
-                    if replicate_to_peer(p, peer):
-                        logging.info("Restored %s from peer %s", p, peer)
-                        break
-        time.sleep(300)  # 5 minutes
+            corrupt = set(bad)
+            verified = [p for p, _ in get_tracked_objects(conn) if p not in corrupt and os.path.exists(p)]
+            push_to_peers(verified)
+        if bad and restore_from_peers(bad):
+            scrub(conn, [(p, todo[p]) for p in bad])  # re-verify restored copies
+        time.sleep(max(0.0, CYCLE_S - (time.time() - now)))
+
+def bench(n_files=64, file_mb=32, root="/tmp/edgeagent_bench"):
+    # scrub GB/s (old 64 KiB single-thread vs readinto pool) and rsync sessions per batch
+    global DATA_DIR, RSYNC
+    os.makedirs(root, exist_ok=True)
+    DATA_DIR, RSYNC = Path(root), shutil.which("true")  # rsync stand-in: counts spawns only
+    paths = []
+    for i in range(n_files):
+        p = os.path.join(root, f"obj{i}.bin")
+        if not os.path.exists(p):
+            with open(p, "wb") as f:
+                f.write(os.urandom(file_mb << 20))
+        paths.append(p)
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE objects(path TEXT PRIMARY KEY, sha256 TEXT)")
+    conn.executemany("INSERT INTO objects VALUES(?,?)", [(p, sha256_file_fast(Path(p))) for p in paths])
+    init_db(conn)
+    gb = n_files * file_mb / 1024
+    t0 = time.perf_counter()
+    for p in paths:
+        sha256_file(Path(p))
+    old = gb / (time.perf_counter() - t0)
+    t0 = time.perf_counter(); scrub(conn, get_tracked_objects(conn)); new = gb / (time.perf_counter() - t0)
+    t0 = time.perf_counter(); skipped = len(changed_objects(conn)); t_stat = time.perf_counter() - t0
+    print(f"scrub: {old:.2f} GB/s (64 KiB, 1 thread) -> {new:.2f} GB/s ({SCRUB_WORKERS} workers, "
+          f"{READ_BUF >> 20} MiB buffers) over {gb:.1f} GB, page cache warm, {os.cpu_count()} CPU(s)")
+    print(f"incremental pass: {skipped} of {n_files} changed, stat pass {t_stat * 1e3:.1f} ms")
+    t0 = time.perf_counter()
+    for p in paths:
+        for peer in PEERS:
+            subprocess.check_call([RSYNC, "-a", p, peer])
+    t_old = time.perf_counter() - t0
+    t0 = time.perf_counter(); push_to_peers(paths); restore_from_peers(paths[:8]); t_new = time.perf_counter() - t0
+    print(f"transfers: {n_files * len(PEERS)} rsync processes ({t_old:.2f}s spawn cost) -> "
+          f"2 sessions ({t_new * 1e3:.0f} ms)")
+    shutil.rmtree(root)
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    import sys
+    bench() if "--bench" in sys.argv else main()
@@ -1,6 +1,7 @@
 import hashlib
 import bisect
-from confluent_kafka import Producer
+import math
+import numpy as np
 
 class ConsistentPartitioner:
     def __init__(self, partitions, virtual_nodes=100, local_region=None):
@@ -32,20 +33,180 @@ class ConsistentPartitioner:
             idx = 0
         return self.ring[idx][1]
 
+_GOLDEN = 0x9e3779b97f4a7c15
+_MASK = (1 << 64) - 1
+
+def _hash64(data):
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+def _remix(h, i):
+    # i-th alternative hash of a key (splitmix64 step), for overflow probing
+    z = (h + (i + 1) * _GOLDEN) & _MASK
+    z = ((z ^ (z >> 30)) * 0xbf58476d1ce4e5b9) & _MASK
+    z = ((z ^ (z >> 27)) * 0x94d049bb133111eb) & _MASK
+    return z ^ (z >> 31)
+
+class MaglevPartitioner:
+    """O(1) partitioning through a dense Maglev lookup table.
+
+    table_size (prime) slots are filled from per-partition permutations, so
+    every partition owns ~M/n slots and add/remove moves close to 1/n of
+    the keys. With bounded=True a partition may take at most (1+eps) x the
+    mean recent load (Mirrokni et al.); overflow walks the key's probe
+    sequence and sticks there, so a key changes partition (and ordering
+    restarts) only when its home partition is saturated. Keys whose share
+    exceeds hot_share of a partition's bound are split over as many probe
+    partitions as their rate needs (at most max_split, default all);
+    consumers of such keys must tolerate reordering.
+    """
+    def __init__(self, partitions, table_size=65537, local_region=None, bounded=False,
+                 eps=0.25, window=100_000, hot_share=0.5, max_split=None):
+        self.M = table_size
+        self.local_region = local_region
+        self.bounded, self.eps, self.window = bounded, eps, window
+        self.hot_share, self.max_split = hot_share, max_split
+        self.partitions = []
+        self.load = {}      # partition -> decayed message count
+        self.total = 0.0    # sum(load.values()), kept current so _cap is O(1)
+        self.sticky = {}    # key hash -> overflow partition, reset every window
+        self.heavy = {}     # key hash -> decayed count (top keys only, space-saving style)
+        self.seen = 0
+        self.set_partitions(partitions)
+
+    def set_partitions(self, partitions):
+        self.partitions = sorted(partitions)
+        n, M = len(self.partitions), self.M
+        offs = [_hash64(b"off:%d" % p) % M for p in self.partitions]
+        skips = [_hash64(b"skip:%d" % p) % (M - 1) + 1 for p in self.partitions]
+        nxt, table, filled = [0] * n, [-1] * M, 0
+        while True:  # Maglev population: partitions claim preferred free slots in turn
+            for i in range(n):
+                c = (offs[i] + nxt[i] * skips[i]) % M
+                while table[c] >= 0:
+                    nxt[i] += 1
+                    c = (offs[i] + nxt[i] * skips[i]) % M
+                table[c] = self.partitions[i]; nxt[i] += 1; filled += 1
+                if filled == M:
+                    self.table = table
+                    self.table_np = np.array(table, dtype=np.int32)
+                    self.load = {p: self.load.get(p, 0.0) for p in self.partitions}
+                    self.total = sum(self.load.values())
+                    self.sticky.clear()
+                    return
+
+    def add_partition(self, p):
+        self.set_partitions(self.partitions + [p])
+
+    def remove_partition(self, p):
+        self.set_partitions([q for q in self.partitions if q != p])
+
+    def _key_hash(self, key_bytes, event_meta):
+        if event_meta and event_meta.get("region") == self.local_region:
+            key_bytes = b"LOCAL:" + key_bytes
+        return _hash64(key_bytes)
+
+    def partition(self, key_bytes, event_meta=None):
+        h = self._key_hash(key_bytes, event_meta)
+        if not self.bounded:
+            return self.table[h % self.M]
+        return self._place(h)
+
+    def _cap(self):
+        return (1 + self.eps) * (self.total + 1) / len(self.partitions)
+
+    def _place(self, h):
+        cap = self._cap()
+        # approximate heavy hitters: bounded dict, a min entry recycled every 64th miss
+        c = self.heavy.get(h)
+        if c is not None or len(self.heavy) < 256:
+            self.heavy[h] = (c or 0.0) + 1
+        elif self.seen % 64 == 0:
+            self.heavy.pop(min(self.heavy, key=self.heavy.get))
+            self.heavy[h] = 1.0
+        split = math.ceil(self.heavy.get(h, 0.0) / (self.hot_share * cap))
+        if split > 1:
+            # hot key: least-loaded of its first `split` probe partitions
+            split = min(split, self.max_split or len(self.partitions))
+            p = min((self.table[_remix(h, i) % self.M] for i in range(split)), key=self.load.get)
+            i = split
+        else:
+            p, i = self.sticky.get(h, self.table[h % self.M]), 0
+        start = i
+        while self.load[p] + 1 > cap and i < start + 2 * len(self.partitions):
+            p = self.table[_remix(h, i) % self.M]; i += 1
+        if i > start:
+            if self.load[p] + 1 > cap:
+                p = min(self.load, key=self.load.get)
+            if split <= 1:
+                self.sticky[h] = p
+        self.load[p] += 1; self.total += 1
+        self.seen += 1
+        if self.seen % self.window == 0:
+            self._decay()
+        return p
+
+    def _decay(self):
+        # halve the window counters; overflow assignments are re-evaluated
+        for p in self.load:
+            self.load[p] *= 0.5
+        self.total = sum(self.load.values())  # resummed once per window: no float drift
+        for k in list(self.heavy):
+            self.heavy[k] *= 0.5
+        self.sticky.clear()
+
+    def partition_batch(self, keys, event_meta=None):
+        """Partitions for a producer buffer of byte keys (np.int32 array)."""
+        h = np.fromiter((self._key_hash(k, event_meta) for k in keys), dtype=np.uint64, count=len(keys))
+        if not self.bounded:
+            return self.table_np[(h % np.uint64(self.M)).astype(np.int64)]
+        return np.array([self._place(int(x)) for x in h], dtype=np.int32)
+
+def bench(n_keys=200_000, n_msgs=500_000, n_parts=32, zipf=1.1):
+    import time
+    keys = [b"sensor:%d" % i for i in range(n_keys)]
+    rng = np.random.default_rng(0)
+    stream = [keys[i] for i in (rng.zipf(zipf, n_msgs) - 1) % n_keys]
+    ring, mag = ConsistentPartitioner(list(range(n_parts))), MaglevPartitioner(list(range(n_parts)))
+    bnd = MaglevPartitioner(list(range(n_parts)), bounded=True)
+    for name, fn in (("md5 ring", lambda: [ring.partition(k) for k in stream]),
+                     ("maglev", lambda: [mag.partition(k) for k in stream]),
+                     ("maglev batch", lambda: mag.partition_batch(stream)),
+                     ("maglev bounded", lambda: bnd.partition_batch(stream))):
+        t0 = time.perf_counter(); out = np.asarray(fn()); dt = time.perf_counter() - t0
+        load = np.bincount(out, minlength=n_parts)
+        print(f"{name:15s}: {n_msgs / dt:10,.0f} msgs/s, max/mean load {load.max() / load.mean():.2f} (zipf {zipf})")
+    uniq = np.array([mag.partition(k) for k in keys])
+    print(f"key spread (unique keys): ring max/mean {np.bincount([ring.partition(k) for k in keys]).max() / (n_keys / n_parts):.3f}, "
+          f"maglev {np.bincount(uniq).max() / (n_keys / n_parts):.3f}")
+    for label, change in (("add", lambda p: p.add_partition(n_parts)), ("remove", lambda p: p.remove_partition(5))):
+        m = MaglevPartitioner(list(range(n_parts)))
+        change(m)
+        moved = (np.array([m.partition(k) for k in keys]) != uniq).mean()
+        r = ConsistentPartitioner(list(range(n_parts + 1)) if label == "add" else [q for q in range(n_parts) if q != 5])
+        base = np.array([ring.partition(k) for k in keys])
+        rmoved = (np.array([r.partition(k) for k in keys]) != base).mean()
+        print(f"{label} partition: maglev moved {moved:.2%}, ring moved {rmoved:.2%} of keys (ideal {1 / (n_parts + (label == 'add')):.2%})")
+
 # Usage in producer callback
 def delivery_report(err, msg):
     if err:
         # handle retries, logging, or dead-letter routing
         print("Delivery failed:", err)
 
-# instantiate with topic partitions discovered from broker metadata
-partitions = [0,1,2,3,4]  # query via admin client in production
-part = ConsistentPartitioner(partitions, local_region="eu-west-1")
-p = Producer({'bootstrap.servers': 'broker:9092'})
-
-key = b"sensor:1234"
-meta = {"region": "eu-west-1"}
-partition_id = part.partition(key, event_meta=meta)
-p.produce("sensors", key=key, value=b"payload", partition=partition_id,
-          on_delivery=delivery_report)
-p.flush()
\ No newline at end of file
+if __name__ == "__main__":
+    import sys
+    if "--bench" in sys.argv:
+        bench(); sys.exit()
+    from confluent_kafka import Producer
+
+    # instantiate with topic partitions discovered from broker metadata
+    partitions = [0,1,2,3,4]  # query via admin client in production
+    part = MaglevPartitioner(partitions, local_region="eu-west-1", bounded=True)
+    p = Producer({'bootstrap.servers': 'broker:9092'})
+
+    key = b"sensor:1234"
+    meta = {"region": "eu-west-1"}
+    partition_id = part.partition(key, event_meta=meta)
+    p.produce("sensors", key=key, value=b"payload", partition=partition_id,
+              on_delivery=delivery_report)
+    p.flush()
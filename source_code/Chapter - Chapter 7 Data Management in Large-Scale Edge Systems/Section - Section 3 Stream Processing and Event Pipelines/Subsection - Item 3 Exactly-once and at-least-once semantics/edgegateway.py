@@ -1,45 +1,354 @@
-import sqlite3, json, uuid, time, requests
+import sqlite3, json, uuid, time, asyncio, hashlib, logging, threading
+import aiohttp
 import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
 
 DB_PATH = "/var/lib/edge/dedup.db"
 API_URL = "https://cloud.example/api/events/"
+BATCH_URL = API_URL + "batch"   # accepts [{"id", "payload"}]; id is the idempotency key
+BATCH_MAX = 500                 # events per upstream request / group commit
+BATCH_DELAY = 0.01              # seconds to fill a batch
+MAX_INFLIGHT = 16               # concurrent upstream requests
+# Unacked QoS1 messages the broker may have out to us (MQTT v5 Receive Maximum): enough
+# to fill every in-flight batch. v3.1.1 clients get the broker's max_inflight_messages
+# (mosquitto default 20) instead, so raise that (and max_queued_messages) on the broker.
+RECEIVE_MAX = MAX_INFLIGHT * BATCH_MAX
+DEDUP_TTL = 24 * 3600           # seconds an id is remembered
+PARTITION_S = 3600              # one id table per hour; pruning drops whole tables
+BLOOM_BITS = 1 << 27            # 16 MiB per generation, ~1% FP at ~14M ids
+BLOOM_K = 7
 
-# initialize durable dedup table
-conn = sqlite3.connect(DB_PATH, isolation_level="EXCLUSIVE", timeout=30)
-conn.execute("CREATE TABLE IF NOT EXISTS processed(id TEXT PRIMARY KEY, ts INTEGER)")
-conn.commit()
+class RotatingBloom:
+    """Two-generation Bloom filter; rotate() ages out the older generation."""
+    def __init__(self, bits=BLOOM_BITS, k=BLOOM_K):
+        self.bits, self.k = bits, k
+        self.gens = [bytearray(bits // 8), bytearray(bits // 8)]
 
-def mark_processed(tx, event_id):
-    # Durable insert; will fail on duplicates
-    tx.execute("INSERT INTO processed(id, ts) VALUES (?, ?)", (event_id, int(time.time())))
+    def _idx(self, key):
+        d = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1, h2 = int.from_bytes(d[:8], "little"), int.from_bytes(d[8:], "little") | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.k)]
 
-def already_processed(tx, event_id):
-    cur = tx.execute("SELECT 1 FROM processed WHERE id = ? LIMIT 1", (event_id,))
-    return cur.fetchone() is not None
+    def add(self, key):
+        g = self.gens[0]
+        for i in self._idx(key):
+            g[i >> 3] |= 1 << (i & 7)
 
-def forward_event(payload, event_id):
-    # idempotent PUT: server must treat event_id as idempotency key
-    r = requests.put(API_URL + event_id, json=payload, timeout=5)
-    r.raise_for_status()
+    def __contains__(self, key):
+        idx = self._idx(key)
+        return any(all(g[i >> 3] & (1 << (i & 7)) for i in idx) for g in self.gens)
 
-def on_message(client, userdata, msg):
-    # parse event and ensure id exists
-    obj = json.loads(msg.payload.decode())
-    event_id = obj.get("id") or str(uuid.uuid1())
-    payload = obj.get("payload", obj)
+    def rotate(self):
+        self.gens = [bytearray(self.bits // 8), self.gens[0]]
 
+class DedupStore:
+    """Bloom prefilter over time-partitioned `processed_<bucket>` tables."""
+    def __init__(self, path=DB_PATH):
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL;")
+        self.conn.execute("PRAGMA synchronous=FULL;")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS dead_letter(ts INTEGER, id TEXT, reason TEXT, payload BLOB)")
+        self.bloom = RotatingBloom()
+        self.bucket = None
+        self.prune(time.time())
+        for t in self.tables():  # warm the filter from surviving partitions
+            for (i,) in self.conn.execute(f"SELECT id FROM {t}"):
+                self.bloom.add(i)
+
+    def tables(self):
+        rows = self.conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name LIKE 'processed_%'")
+        return sorted(r[0] for r in rows)
+
+    def _current(self, now):
+        bucket = int(now // PARTITION_S)
+        if bucket != self.bucket:
+            self.conn.execute(f"CREATE TABLE IF NOT EXISTS processed_{bucket}(id TEXT PRIMARY KEY, ts INTEGER)")
+            if self.bucket is not None and bucket * PARTITION_S // DEDUP_TTL != self.bucket * PARTITION_S // DEDUP_TTL:
+                self.bloom.rotate()  # generations span one TTL, so two always cover every live id
+            self.bucket = bucket
+        return f"processed_{bucket}"
+
+    def prune(self, now):
+        # TTL pruning is DROP TABLE, not a DELETE scan over live rows
+        oldest = int((now - DEDUP_TTL) // PARTITION_S)
+        for t in self.tables():
+            if int(t.rsplit("_", 1)[1]) < oldest:
+                self.conn.execute(f"DROP TABLE {t}")
+
+    def seen(self, ids):
+        # Bloom negatives are definitive; only positives hit SQLite
+        maybe = [i for i in ids if i in self.bloom]
+        hits = set()
+        for t in self.tables() if maybe else ():
+            for j in range(0, len(maybe), 500):
+                chunk = maybe[j:j + 500]
+                q = f"SELECT id FROM {t} WHERE id IN ({','.join('?' * len(chunk))})"
+                hits.update(r[0] for r in self.conn.execute(q, chunk))
+        return hits
+
+    def mark(self, ids, now):
+        # one durable transaction per forwarded batch
+        table = self._current(now)
+        with self.conn:
+            self.conn.executemany(f"INSERT OR IGNORE INTO {table}(id, ts) VALUES (?, ?)",
+                                  [(i, int(now)) for i in ids])
+        for i in ids:
+            self.bloom.add(i)
+
+    def park(self, rows, now):
+        # (id or None, reason, raw payload): undecodable or permanently rejected, kept for replay
+        with self.conn:
+            self.conn.executemany("INSERT INTO dead_letter(ts, id, reason, payload) VALUES (?, ?, ?, ?)",
+                                  [(int(now), i, reason, payload) for i, reason, payload in rows])
+
+CONFIG_STATUS = (401, 403, 404)  # credentials or URL wrong: every event would fail, so retry instead
+
+class Inbox:
+    """Bounded hand-off from the MQTT network thread to the event loop.
+
+    put_threadsafe blocks the network thread while maxsize messages are queued,
+    so a slow pipeline pushes back on paho (and the broker) instead of piling up
+    pending puts; get() is awaited by the pipeline like asyncio.Queue.get.
+    """
+    def __init__(self, loop, maxsize=50_000):
+        self.loop, self.q, self.room = loop, asyncio.Queue(), threading.Semaphore(maxsize)
+
+    def put_threadsafe(self, msg):
+        self.room.acquire()
+        self.loop.call_soon_threadsafe(self.q.put_nowait, msg)
+
+    async def get(self):
+        msg = await self.q.get()
+        self.room.release()
+        return msg
+
+    def empty(self):
+        return self.q.empty()
+
+def permanent(status):
+    # 4xx will not succeed on retry, except timeout / too-early / rate-limit and config failures
+    return 400 <= status < 500 and status not in (408, 425, 429) + CONFIG_STATUS
+
+async def forward_batch(session, events):
+    # idempotent batch upload: the server treats each event id as its key
+    body = [{"id": eid, "payload": payload} for eid, payload, _ in events]
+    async with session.post(BATCH_URL, json=body) as r:
+        r.raise_for_status()
+
+async def pipeline(inbox, store, ack, window=None):
+    # batch -> dedup -> concurrent forward -> group commit -> ack
+    async with aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=MAX_INFLIGHT, keepalive_timeout=60),
+            timeout=aiohttp.ClientTimeout(total=5)) as session:
+        await _run(inbox, store, ack, session, window)
+
+async def _run(inbox, store, raw_ack, session, window=None):
+    # window: the broker's unacked-message limit; once reached nothing more arrives,
+    # so the batch being filled is closed without waiting out BATCH_DELAY
+    slots = asyncio.Semaphore(MAX_INFLIGHT)
+    lock = asyncio.Lock()  # serializes SQLite use across concurrent batches
+    pending = set()        # ids in flight, so redeliveries are not double-sent
+    tasks = set()          # ship() tasks, referenced until done
+    unacked = [0]
+
+    def ack(msg):
+        unacked[0] -= 1
+        raw_ack(msg)
+
+    def shipped(task):
+        tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.error("batch shipping failed; its messages stay unacked", exc_info=task.exception())
+
+    async def deliver(events):
+        # -> [(event, reason)] rejected for good; a rejected batch is bisected to find them
+        backoff = 0.5
+        while True:
+            try:
+                await forward_batch(session, events)
+                return []
+            except aiohttp.ClientResponseError as e:
+                if not permanent(e.status):
+                    if e.status in CONFIG_STATUS:
+                        logging.warning("upstream answered %d: check credentials / BATCH_URL; retrying", e.status)
+                    await asyncio.sleep(backoff); backoff = min(backoff * 2, 30)
+                elif len(events) == 1:
+                    return [(events[0], f"http {e.status}")]
+                else:
+                    mid = len(events) // 2
+                    return await deliver(events[:mid]) + await deliver(events[mid:])
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                await asyncio.sleep(backoff); backoff = min(backoff * 2, 30)
+
+    async def ship(batch):
+        try:
+            rejected = await deliver(batch)
+            bad = {e[0] for e, _ in rejected}
+            backoff = 0.5
+            while True:
+                try:
+                    async with lock:
+                        now = time.time()
+                        store.mark([e[0] for e in batch if e[0] not in bad], now)
+                        if rejected:
+                            store.park([(e[0], reason, e[2].payload) for e, reason in rejected], now)
+                    break
+                except sqlite3.Error:  # e.g. locked or disk full: delivered upstream, so keep trying
+                    logging.exception("recording %d delivered events failed; retrying", len(batch))
+                    await asyncio.sleep(backoff); backoff = min(backoff * 2, 30)
+            for _, _, msg in batch:  # ack only once the id (or its parked copy) is durable
+                ack(msg)
+        finally:
+            pending.difference_update(e[0] for e in batch)
+            slots.release()
+
+    last_prune = time.monotonic()
     try:
-        with conn:  # sqlite transaction ensures atomicity of dedup mark
-            if already_processed(conn, event_id):
-                return  # duplicate; ignore
-            forward_event(payload, event_id)  # may raise on network error
-            mark_processed(conn, event_id)    # durable commit happens only after successful forward
-    except Exception as e:
-        # transient failures: rely on MQTT at-least-once redelivery and retry later
-        client.reconnect()
-
-client = mqtt.Client()
-client.on_message = on_message
-client.connect("localhost", 1883)
-client.subscribe("sensors/vibration")
-client.loop_forever()
\ No newline at end of file
+        while True:
+            batch = [await inbox.get()]
+            unacked[0] += 1
+            deadline = asyncio.get_running_loop().time() + BATCH_DELAY
+            while len(batch) < BATCH_MAX and not (window and unacked[0] >= window and inbox.empty()):
+                try:
+                    batch.append(await asyncio.wait_for(inbox.get(), deadline - asyncio.get_running_loop().time()))
+                    unacked[0] += 1
+                except asyncio.TimeoutError:
+                    break
+            events, dups, bad = {}, [], []
+            for msg in batch:
+                try:
+                    obj = json.loads(msg.payload.decode())
+                    if not isinstance(obj, dict):
+                        raise ValueError("not a JSON object")
+                except ValueError as e:  # JSONDecodeError and UnicodeDecodeError included
+                    bad.append((None, f"undecodable: {e}", msg.payload)); dups.append(msg)
+                    continue
+                event_id = obj.get("id") or str(uuid.uuid1())
+                if event_id in events or event_id in pending:
+                    dups.append(msg); continue
+                events[event_id] = (event_id, obj.get("payload", obj), msg)
+            async with lock:
+                if bad:
+                    store.park(bad, time.time())
+                seen = store.seen(list(events))
+            for eid in seen:
+                dups.append(events.pop(eid)[2])
+            for msg in dups:  # duplicate (already durable upstream) or dead-lettered
+                ack(msg)
+            if events:
+                pending.update(events)
+                await slots.acquire()
+                task = asyncio.create_task(ship(list(events.values())))
+                tasks.add(task); task.add_done_callback(shipped)
+            if time.monotonic() - last_prune > PARTITION_S / 4:
+                async with lock:
+                    store.prune(time.time())
+                last_prune = time.monotonic()
+    finally:
+        for t in tasks:  # unfinished batches stay unacked; the broker redelivers them
+            t.cancel()
+
+def main():
+    store = DedupStore()
+    loop = asyncio.new_event_loop()
+    inbox = Inbox(loop)
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id="edge_gateway",
+                         protocol=mqtt.MQTTv5, manual_ack=True)
+    client.on_message = lambda c, u, msg: inbox.put_threadsafe(msg)  # waits while the inbox is full
+    props = Properties(PacketTypes.CONNECT)
+    props.ReceiveMaximum, props.SessionExpiryInterval = RECEIVE_MAX, 3600  # persistent session
+    client.connect("localhost", 1883, clean_start=False, properties=props)
+    client.subscribe("sensors/vibration", qos=1)
+    client.loop_start()
+    loop.run_until_complete(pipeline(inbox, store, lambda m: client.ack(m.mid, m.qos), window=RECEIVE_MAX))
+
+async def cancel(task):
+    # repeated: on Python < 3.12 wait_for can swallow a cancel that races its timeout
+    while not task.done():
+        task.cancel()
+        await asyncio.wait([task], timeout=0.1)
+
+async def bench(n=200_000, dup_rate=0.05, path="/tmp/edgegateway_bench.db", seconds=3.0):
+    # mock cloud endpoint on localhost; counts accepted events
+    import os, random, threading
+    from aiohttp import web
+    global BATCH_URL
+    for f in (path, path + "-wal", path + "-shm"):
+        if os.path.exists(f):
+            os.remove(f)
+    received = [0]
+    async def handler(request):
+        body = await request.json()
+        if any("reject" in e["payload"] for e in body):
+            return web.Response(status=422)
+        received[0] += len(body)
+        return web.Response(status=204)
+    app = web.Application(); app.router.add_post("/api/events/batch", handler)
+    runner = web.AppRunner(app); await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 18080); await site.start()
+    BATCH_URL = "http://127.0.0.1:18080/api/events/batch"
+
+    class Msg:
+        __slots__ = ("payload", "mid", "qos")
+        def __init__(self, payload, mid):
+            self.payload, self.mid, self.qos = payload, mid, 1
+    rng = random.Random(3)
+    msgs = []
+    for i in range(n):
+        eid = f"evt-{rng.randrange(i + 1)}" if rng.random() < dup_rate else f"evt-{i}"
+        if i % 10_000 == 1:
+            msgs.append(Msg(b"\xff{not json", i))
+        elif i % 10_000 == 2:
+            msgs.append(Msg(json.dumps({"id": f"evt-{i}", "payload": {"reject": i}}).encode(), i))
+        else:
+            msgs.append(Msg(json.dumps({"id": eid, "payload": {"v": i}}).encode(), i))
+    store, inbox, done = DedupStore(path), asyncio.Queue(), asyncio.Event()
+    acked = [0]
+    def ack(m):
+        acked[0] += 1
+        if acked[0] == n:
+            done.set()
+    t0 = time.perf_counter()
+    task = asyncio.create_task(pipeline(inbox, store, ack))
+    for m in msgs:
+        inbox.put_nowait(m)
+    await done.wait()
+    dt = time.perf_counter() - t0
+    await cancel(task)
+    parked = store.conn.execute("SELECT COUNT(*) FROM dead_letter").fetchone()[0]
+    print(f"{n / dt:,.0f} events/s, forwarded={received[0]} of {n} "
+          f"(dups suppressed={n - received[0] - parked}, dead-lettered={parked})")
+
+    # emulated broker: a thread hands messages over like main()'s on_message (blocking on the
+    # bounded Inbox) and stops delivering while `window` QoS1 messages are unacked
+    loop = asyncio.get_running_loop()
+    for window, flow in ((20, None), (20, 20), (RECEIVE_MAX, RECEIVE_MAX)):
+        p = f"{path}.{window}.{flow}"
+        for f in (p, p + "-wal", p + "-shm"):
+            if os.path.exists(f):
+                os.remove(f)
+        store, inbox, stop = DedupStore(p), Inbox(loop), threading.Event()
+        slots, acked = threading.Semaphore(window), [0]
+        def ack(m):
+            acked[0] += 1; slots.release()
+        def broker():
+            for m in msgs:
+                while not slots.acquire(timeout=0.05):
+                    if stop.is_set():
+                        return
+                inbox.put_threadsafe(m)
+        task = asyncio.create_task(pipeline(inbox, store, ack, window=flow))
+        th = threading.Thread(target=broker, daemon=True); th.start()
+        t0 = time.perf_counter()
+        await asyncio.sleep(seconds)
+        rate = acked[0] / (time.perf_counter() - t0)
+        stop.set(); await cancel(task)
+        await loop.run_in_executor(None, th.join)
+        print(f"broker, inflight {window:5d}, {'close batch at window' if flow else 'wait BATCH_DELAY':21s}: "
+              f"{rate:9,.0f} events/s acked")
+    await runner.cleanup()
+
+if __name__ == "__main__":
+    import sys
+    asyncio.run(bench()) if "--bench" in sys.argv else main()
@@ -1,21 +1,121 @@
+import os
 import time
+import bisect
 import threading
 import struct
-import queue
 import json
+from collections import deque
+import numpy as np
 import paho.mqtt.client as mqtt
 
+SEGMENT_BYTES = 16 << 20      # outage log segment size
+REPLAY_BATCH = 256            # frames replayed per window boundary while connected (and unacked at most)
+ACK_TIMEOUT_S = 60            # no PUBACK progress for this long: resend from the committed offset
+RING_WINDOWS = 8              # ring buffer capacity, in windows
+_HDR = struct.Struct(">I")    # frame = 4-byte big-endian length + payload
+
+def window_features(w):
+    """Per-row RMS and peak |x| of a (windows, samples) block."""
+    return np.sqrt(np.einsum("ij,ij->i", w, w) / w.shape[1]), np.abs(w).max(axis=1)
+
+class SegmentLog:
+    """Append-only outage log of length-prefixed frames in fixed-size segments.
+
+    Segment files are named by the global byte offset of their first frame;
+    the `offset` file records how far replay has been acknowledged, so a
+    restart resumes there and fully replayed segments are unlinked.
+    """
+    def __init__(self, path, segment_bytes=SEGMENT_BYTES):
+        os.makedirs(path, exist_ok=True)
+        self.path, self.segment_bytes = path, segment_bytes
+        self.segs = sorted(int(n[4:-4]) for n in os.listdir(path) if n.startswith("seg-") and n.endswith(".log"))
+        self.end = self.segs[-1] + self._repair(self.segs[-1]) if self.segs else 0
+        try:
+            with open(os.path.join(path, "offset")) as f:
+                self.committed = int(f.read())
+        except (FileNotFoundError, ValueError):
+            self.committed = self.segs[0] if self.segs else 0
+        self.committed = min(max(self.committed, self.segs[0] if self.segs else 0), self.end)
+        self._fd = None
+
+    def _name(self, base):
+        return os.path.join(self.path, "seg-%016d.log" % base)
+
+    def _repair(self, base):
+        # drop a torn frame at the tail of the last segment (crash mid-append)
+        good = 0
+        with open(self._name(base), "rb") as f:
+            while True:
+                hdr = f.read(4)
+                if len(hdr) < 4:
+                    break
+                sz = _HDR.unpack(hdr)[0]
+                if len(f.read(sz)) < sz:
+                    break
+                good += 4 + sz
+        os.truncate(self._name(base), good)
+        return good
+
+    def pending(self):
+        return self.end - self.committed
+
+    def append(self, payload):
+        if self._fd is None or self.end - self.segs[-1] >= self.segment_bytes:
+            if self._fd is not None:
+                os.close(self._fd)
+            if not self.segs or self.end - self.segs[-1] >= self.segment_bytes:
+                self.segs.append(self.end)
+            self._fd = os.open(self._name(self.segs[-1]), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        os.writev(self._fd, [_HDR.pack(len(payload)), payload])  # header and payload, no concatenation copy
+        self.end += 4 + len(payload)
+
+    def read(self, max_frames, start=None):
+        """Up to max_frames (next_offset, payload) pairs from start (default: the committed offset)."""
+        out, off = [], self.committed if start is None else start
+        i = bisect.bisect_right(self.segs, off) - 1
+        while len(out) < max_frames and off < self.end and i < len(self.segs):
+            base = self.segs[i]
+            with open(self._name(base), "rb") as f:
+                f.seek(off - base)
+                while len(out) < max_frames:
+                    hdr = f.read(4)
+                    if len(hdr) < 4:
+                        break
+                    payload = f.read(_HDR.unpack(hdr)[0])
+                    off += 4 + len(payload)
+                    out.append((off, payload))
+            i += 1
+            if i < len(self.segs):
+                off = max(off, self.segs[i])
+        return out
+
+    def commit(self, offset):
+        self.committed = offset
+        tmp = os.path.join(self.path, "offset.tmp")
+        with open(tmp, "w") as f:
+            f.write(str(offset))
+        os.replace(tmp, os.path.join(self.path, "offset"))
+        while len(self.segs) > 1 and self.segs[1] <= offset:  # fully replayed segments
+            os.remove(self._name(self.segs.pop(0)))
+
 class SensorAggregator:
-    def __init__(self, read_sample, mqtt_config, window_s=0.1, rms_threshold=0.5, buffer_file="buffer.bin"):
+    def __init__(self, read_sample, mqtt_config, window_s=0.1, rms_threshold=0.5, buffer_file="buffer.bin",
+                 read_block=None, sample_rate=None, buffer_dir="buffer.log", client=None):
         self.read_sample = read_sample                      # pluggable sensor read() -> float
+        self.read_block = read_block                        # optional read_block(out: float64 view) -> samples written
+        self.sample_rate = sample_rate                      # Hz; required with read_block
         self.window_s = window_s
         self.rms_threshold = rms_threshold
         self.mqtt_cfg = mqtt_config
-        self.client = mqtt.Client(client_id=mqtt_config.get("client_id"))
-        self.client.username_pw_set(mqtt_config.get("user"), mqtt_config.get("pass"))
-        self.client.will_set(mqtt_config.get("topic"), json.dumps({"status":"offline"}), qos=1, retain=True)
-        self.buffer = queue.Queue()
+        self.client = client or mqtt.Client(client_id=mqtt_config.get("client_id"))
+        if client is None:
+            self.client.username_pw_set(mqtt_config.get("user"), mqtt_config.get("pass"))
+            self.client.will_set(mqtt_config.get("topic"), json.dumps({"status":"offline"}), qos=1, retain=True)
+        self.log = SegmentLog(buffer_dir)
         self.buffer_file = buffer_file
+        # replayed frames awaiting PUBACK: (mid, next_offset) in log order; acked mids from on_publish
+        self._inflight, self._acked, self._ack_lock, self._progress = deque(), set(), threading.Lock(), time.monotonic()
+        self.client.on_publish = self._on_publish
         self._stop = threading.Event()
         self._connect()
 
@@ -23,50 +123,106 @@ class SensorAggregator:
         # start network loop in background thread for asynchronous publish
         self.client.connect(self.mqtt_cfg["host"], self.mqtt_cfg.get("port",1883))
         self.client.loop_start()
-        # attempt to replay persisted buffer on startup
+        # frames persisted by older versions are moved into the log, then replayed with it
         try:
             with open(self.buffer_file, "rb") as f:
                 while True:
                     size_bytes = f.read(4)
                     if not size_bytes: break
                     sz = struct.unpack(">I", size_bytes)[0]
-                    payload = f.read(sz)
-                    self.client.publish(self.mqtt_cfg["topic"], payload)
+                    self.log.append(f.read(sz))
+            os.remove(self.buffer_file)
         except FileNotFoundError:
             pass
+        self._replay()
 
-    def _persist_buffered(self):
-        # persist queue to file to survive reboots and network outages
-        items = []
-        while not self.buffer.empty():
-            items.append(self.buffer.get())
-        with open(self.buffer_file, "wb") as f:
-            for p in items:
-                f.write(struct.pack(">I", len(p)))
-                f.write(p)
-        # restore in-memory queue
-        for p in items:
-            self.buffer.put(p)
+    def _publish(self, payload):
+        # while a backlog exists new payloads queue behind it, preserving order
+        if not self.log.pending():
+            info = self.client.publish(self.mqtt_cfg["topic"], payload, qos=1)
+            if info.rc == mqtt.MQTT_ERR_SUCCESS:
+                return
+        self.log.append(payload)
 
-    def run(self):
-        # main loop: windowed RMS computation
+    def _on_publish(self, client, userdata, mid, *rest):
+        # network thread; paho holds its message lock here, so nothing below calls into paho under _ack_lock
+        with self._ack_lock:
+            self._acked.add(mid)
+
+    def _replay(self, max_frames=REPLAY_BATCH):
+        # incremental: commit the prefix the broker has acked, then top the window up to max_frames;
+        # publish().rc only means paho queued the frame, so it never moves the offset by itself
+        done = None
+        with self._ack_lock:
+            while self._inflight and self._inflight[0][0] in self._acked:
+                mid, done = self._inflight.popleft()
+                self._acked.discard(mid)
+            self._acked.intersection_update(m for m, _ in self._inflight)  # acks of live publishes
+        now = time.monotonic()
+        if done is not None:
+            self.log.commit(done)
+            self._progress = now
+        elif self._inflight and now - self._progress > ACK_TIMEOUT_S:
+            self._inflight.clear()  # acks lost with the session: resend from the committed offset
+        if not self.log.pending() or len(self._inflight) >= max_frames:
+            return
+        if not self._inflight:
+            self._progress = now
+        start = self._inflight[-1][1] if self._inflight else None
+        for off, payload in self.log.read(max_frames - len(self._inflight), start):
+            info = self.client.publish(self.mqtt_cfg["topic"], payload, qos=1)
+            rc = info.rc
+            if rc not in (mqtt.MQTT_ERR_SUCCESS, mqtt.MQTT_ERR_NO_CONN):
+                break  # not queued; read again next call
+            self._inflight.append((info.mid, off))
+            if rc == mqtt.MQTT_ERR_NO_CONN:
+                break  # paho holds it until the reconnect
+
+    def _emit(self, ts, rms, peak):
+        for t, r, p in zip(ts.tolist(), rms.tolist(), peak.tolist()):
+            if r >= self.rms_threshold:
+                self._publish(json.dumps({"ts": int(t*1000), "rms": r, "peak": p}).encode())
+        self._replay()
+
+    def _run_blocks(self):
+        # block reads into a preallocated ring; windows never straddle the wrap point
+        n = max(1, round(self.window_s * self.sample_rate))
+        ring = np.empty(n * RING_WINDOWS)
+        pos = done = 0
+        total, t0 = 0, time.time()
+        while not self._stop.is_set():
+            got = self.read_block(ring[pos:])
+            pos += got; total += got
+            full = pos // n
+            if full > done:
+                rms, peak = window_features(ring[done*n:full*n].reshape(-1, n))
+                # sample-clock timestamps of each window's end
+                ends = total - (pos - np.arange(done + 1, full + 1) * n)
+                self._emit(t0 + ends / self.sample_rate, rms, peak)
+                done = full
+            if pos == len(ring):
+                pos = done = 0
+
+    def _run_samples(self):
+        # per-sample reader (legacy): wall-clock windows, features computed once per window
         samples = []
         start = time.time()
+        while not self._stop.is_set():
+            samples.append(self.read_sample())
+            now = time.time()
+            if now - start >= self.window_s:
+                rms, peak = window_features(np.array(samples).reshape(1, -1))
+                self._emit(np.array([now]), rms, peak)
+                samples.clear()
+                start = now
+
+    def run(self):
+        # main loop: windowed RMS/peak computation
         try:
-            while not self._stop.is_set():
-                samples.append(self.read_sample())
-                now = time.time()
-                if now - start >= self.window_s:
-                    rms = (sum(x*x for x in samples)/len(samples))**0.5
-                    payload = json.dumps({"ts": int(now*1000), "rms": rms}).encode()
-                    if rms >= self.rms_threshold:
-                        info = self.client.publish(self.mqtt_cfg["topic"], payload, qos=1)
-                        if info.rc != mqtt.MQTT_ERR_SUCCESS:
-                            # enqueue when publish failed
-                            self.buffer.put(payload)
-                            self._persist_buffered()
-                    samples.clear()
-                    start = now
+            if self.read_block is not None:
+                self._run_blocks()
+            else:
+                self._run_samples()
         finally:
             self.client.loop_stop()
             self.client.disconnect()
@@ -80,9 +236,102 @@ def dummy_reader():
     t = time.time()
     return 0.1*math.sin(2*math.pi*100*t) + 0.01*random.gauss(0,1)
 
-# MQTT config example
-mqtt_cfg = {"host":"mqtt.local","topic":"site/line1/bearing","client_id":"agg01","user":"iot","pass":"s3cret"}
-agg = SensorAggregator(dummy_reader, mqtt_cfg, window_s=0.1, rms_threshold=0.02)
-thread = threading.Thread(target=agg.run, daemon=True)
-thread.start()
-# graceful shutdown handled by operator/OS signals in production
\ No newline at end of file
+def dummy_block_reader(rate=100_000, block=1024):
+    # block reader pacing itself to `rate` (an iio buffer read blocks the same way)
+    rng, t_next = np.random.default_rng(), [time.time()]
+    def read_block(out):
+        m = min(block, len(out))
+        t_next[0] += m / rate
+        time.sleep(max(0.0, t_next[0] - time.time()))
+        t = t_next[0] - np.arange(m, 0, -1) / rate
+        out[:m] = 0.1*np.sin(2*np.pi*100*t) + 0.01*rng.standard_normal(m)
+        return m
+    return read_block
+
+def bench(seconds=2.0, outage_windows=20_000):
+    # stand-in broker: publish fails while `down`, else acks at once; readers are unpaced (max throughput)
+    import tempfile, shutil, math, queue
+    class Info:
+        def __init__(self, rc, mid): self.rc, self.mid = rc, mid
+    class Client:
+        down, mid, on_publish = False, 0, None
+        def connect(self, *a): pass
+        def loop_start(self): pass
+        def loop_stop(self): pass
+        def disconnect(self): pass
+        def publish(self, topic, payload, qos=0):
+            if self.down:
+                return Info(mqtt.MQTT_ERR_NO_CONN, 0)
+            self.mid += 1
+            self.on_publish(self, None, self.mid)
+            return Info(mqtt.MQTT_ERR_SUCCESS, self.mid)
+    d = tempfile.mkdtemp()
+    cfg = {"host": "bench", "topic": "bench"}
+    src = np.random.default_rng(0).standard_normal(1 << 20)
+    it = iter(range(1 << 62))
+    def read_sample():
+        return src[next(it) & ((1 << 20) - 1)]
+    def read_block(out):
+        m = min(len(out), 4096); out[:m] = src[:m]; return m
+    samples, n, start, t_end = [], 0, time.time(), time.time() + seconds
+    while time.time() < t_end:  # previous loop: list append + generator RMS per window
+        samples.append(read_sample()); n += 1
+        now = time.time()
+        if now - start >= 0.1:
+            rms = (sum(x*x for x in samples)/len(samples))**0.5
+            samples.clear(); start = now
+    print(f"{'previous':10s}: {n / seconds:14,.0f} samples/s sustained (target 100,000)")
+    for label, kw in (("per-sample", {}), ("block", {"read_block": read_block, "sample_rate": 100_000})):
+        agg = SensorAggregator(read_sample, cfg, rms_threshold=0.0, buffer_dir=f"{d}/{label}", client=Client(), **kw)
+        counter = np.zeros(1)
+        if "read_block" in kw:
+            def counted(out, f=read_block):
+                m = f(out); counter[0] += m; return m
+            agg.read_block = counted
+        else:
+            def counted(f=read_sample):
+                counter[0] += 1; return f()
+            agg.read_sample = counted
+        threading.Timer(seconds, agg.stop).start()
+        agg.run()
+        print(f"{label:10s}: {counter[0] / seconds:14,.0f} samples/s sustained (target 100,000)")
+
+    # outage: the previous path rewrote the whole queue file per failed publish
+    q, path, payload = queue.Queue(), f"{d}/buffer.bin", json.dumps({"ts": 0, "rms": 1.0}).encode()
+    t0 = time.perf_counter()
+    for i in range(2000):
+        q.put(payload); items = []
+        while not q.empty(): items.append(q.get())
+        with open(path, "wb") as f:
+            for p in items:
+                f.write(struct.pack(">I", len(p))); f.write(p)
+        for p in items: q.put(p)
+    old = (time.perf_counter() - t0) / 2000
+    agg = SensorAggregator(read_sample, cfg, buffer_dir=f"{d}/outage", client=Client())
+    agg.client.down = True
+    t0 = time.perf_counter()
+    for i in range(outage_windows):
+        agg._publish(payload)
+    new = (time.perf_counter() - t0) / outage_windows
+    agg.client.down, rounds = False, 0
+    t0 = time.perf_counter()
+    while agg.log.pending():
+        agg._replay(); rounds += 1
+    rec = time.perf_counter() - t0
+    print(f"outage write: {old * 1e6:.0f} us/window at 2k queued (grows linearly) -> {new * 1e6:.1f} us/window append")
+    print(f"recovery: {outage_windows} buffered windows replayed in {rec * 1e3:.0f} ms over {rounds} batches "
+          f"({math.ceil(outage_windows / REPLAY_BATCH)} window boundaries at {REPLAY_BATCH}/batch)")
+    shutil.rmtree(d)
+
+if __name__ == "__main__":
+    import sys
+    if "--bench" in sys.argv:
+        bench(); sys.exit()
+    # MQTT config example
+    mqtt_cfg = {"host":"mqtt.local","topic":"site/line1/bearing","client_id":"agg01","user":"iot","pass":"s3cret"}
+    agg = SensorAggregator(dummy_reader, mqtt_cfg, window_s=0.1, rms_threshold=0.02,
+                           read_block=dummy_block_reader(100_000), sample_rate=100_000)
+    thread = threading.Thread(target=agg.run, daemon=True)
+    thread.start()
+    # graceful shutdown handled by operator/OS signals in production
+    thread.join()
@@ -1,58 +1,244 @@
 #!/usr/bin/env python3
 # Minimal, production-ready TTL enforcer for RocksDB -> S3 (MinIO compatible).
-import os, time, json, logging
+# Writers maintain a ts-ordered index (put_entry), so expiry reads only the
+# expired key range; expired entries are packed into gzip'd JSON-lines segments
+# uploaded concurrently (multipart), and deleted in bounded write batches.
+# Rows written without put_entry are only indexed by the backfill scan, which
+# runs at startup and then every BACKFILL_INTERVAL (0 = writers all use put_entry).
+import os, time, json, logging, gzip, io, hashlib, struct, threading, base64
+from concurrent.futures import ThreadPoolExecutor
 import boto3, plyvel
+from boto3.s3.transfer import TransferConfig
 
 # Config via env vars for containerized deployments.
 DB_PATH = os.environ.get('DB_PATH','/var/lib/app/rocksdb')
-S3_ENDPOINT = os.environ['S3_ENDPOINT']            # e.g., http://minio:9000
 S3_BUCKET = os.environ.get('S3_BUCKET','edge-archive')
 S3_REGION = os.environ.get('S3_REGION','us-east-1')
 MAX_AGE = int(os.environ.get('MAX_AGE', 7*24*3600))  # seconds
+SEGMENT_BYTES = int(os.environ.get('SEGMENT_BYTES', 64 << 20))   # uncompressed bytes per segment
+UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS', 4))        # segments in flight
+DELETE_BATCH = int(os.environ.get('DELETE_BATCH', 10_000))       # keys per write batch
+BACKFILL_INTERVAL = int(os.environ.get('BACKFILL_INTERVAL', 86400))  # seconds between index backfills
+# index keys: IDX_PREFIX + 8-byte big-endian ts + data key; data keys must not start with 0x00
+IDX_PREFIX = b'\x00ttl/'
+IDX_DONE = b'\x00ttl-meta/indexed'
 
 logging.basicConfig(level=logging.INFO)
-db = plyvel.DB(DB_PATH, create_if_missing=False)
-s3 = boto3.client('s3',
-    endpoint_url=S3_ENDPOINT,
-    aws_access_key_id=os.environ['S3_ACCESS_KEY'],
-    aws_secret_access_key=os.environ['S3_SECRET_KEY'],
-    region_name=S3_REGION,
-    config=boto3.session.Config(signature_version='s3v4'))
+
+def connect():
+    db = plyvel.DB(DB_PATH, create_if_missing=False)
+    s3 = boto3.client('s3',
+        endpoint_url=os.environ['S3_ENDPOINT'],            # e.g., http://minio:9000
+        aws_access_key_id=os.environ['S3_ACCESS_KEY'],
+        aws_secret_access_key=os.environ['S3_SECRET_KEY'],
+        region_name=S3_REGION,
+        config=boto3.session.Config(signature_version='s3v4', max_pool_connections=4 * UPLOAD_WORKERS))
+    return db, s3
 
 def key_metadata(raw_value):
     # Stored values are JSON with 'ts' and 'payload' fields.
     obj = json.loads(raw_value)
     return obj.get('ts'), obj.get('payload')
 
-def upload_to_s3(key, ts, payload):
-    # Compose object key as ISO timestamp plus original key for idempotency.
-    obj_key = f"{time.strftime('%Y%m%dT%H%M%SZ', time.gmtime(ts))}/{key}"
-    s3.put_object(Bucket=S3_BUCKET, Key=obj_key, Body=payload,
-                  Metadata={'source':'edge-node','ts':str(ts)})
+def _idx(ts, key):
+    return IDX_PREFIX + struct.pack('>Q', int(ts)) + key
+
+def _value_ts(raw):
+    try:
+        ts = key_metadata(raw.decode('utf-8'))[0]
+        return None if ts is None else int(ts)
+    except (ValueError, AttributeError, TypeError):
+        return None
+
+def put_entry(db, key, ts, payload, wb=None):
+    # writers go through here so the data and its index entry land atomically;
+    # rewriting a key moves its index entry (the old one would expire the new value)
+    val = json.dumps({'ts': ts, 'payload': payload}).encode('utf-8')
+    w = wb or db.write_batch(transaction=True)
+    prev = db.get(key)
+    old_ts = _value_ts(prev) if prev is not None else None
+    if old_ts is not None and old_ts != int(ts):
+        w.delete(_idx(old_ts, key))
+    w.put(key, val); w.put(_idx(ts, key), b'')
+    if wb is None:
+        w.write()
+
+def build_index(db, force=False):
+    # backfill for stores written before the index existed, or by writers bypassing put_entry;
+    # re-putting an existing index key is harmless
+    if db.get(IDX_DONE) and not force:
+        return
+    wb, n = db.write_batch(), 0
+    for k, v in db.iterator(start=b'\x01'):  # data keys only
+        try:
+            ts, _ = key_metadata(v.decode('utf-8'))
+        except ValueError:
+            continue
+        if ts is not None:
+            wb.put(_idx(ts, k), b''); n += 1
+            if n % DELETE_BATCH == 0:
+                wb.write(); wb = db.write_batch()
+    wb.put(IDX_DONE, b'1'); wb.write()
+    logging.info("indexed %d entries", n)
+
+def _archive_line(k, ts, v):
+    # keys are arbitrary bytes: non-UTF-8 keys go out base64'd under key_b64 instead of key
+    try:
+        key = b'"key":%s' % json.dumps(k.decode('utf-8')).encode()
+    except UnicodeDecodeError:
+        key = b'"key_b64":"%s"' % base64.b64encode(k)
+    return b'{%s,"ts":%d,"payload":%s}\n' % (key, ts, json.dumps(key_metadata(v.decode('utf-8'))[1]).encode())
+
+def expired_segments(db, cutoff):
+    """Yield (segment_body, first_ts, last_ts, keys) over the expired index range only."""
+    buf, keys, size, first = io.BytesIO(), [], 0, None
+    gz = gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=3, mtime=0)
+    for ik in db.iterator(start=IDX_PREFIX, stop=IDX_PREFIX + struct.pack('>Q', cutoff), include_value=False):
+        ts, k = struct.unpack('>Q', ik[len(IDX_PREFIX):len(IDX_PREFIX) + 8])[0], ik[len(IDX_PREFIX) + 8:]
+        v = db.get(k)
+        if v is None or _value_ts(v) != ts:
+            keys.append((None, ik, ts))  # stale index entry (deleted or rewritten key): drop it only
+            continue
+        try:
+            line = _archive_line(k, ts, v)
+        except Exception:  # one bad entry is kept in place, not the whole run aborted
+            logging.exception("cannot archive key %r; left for inspection", k)
+            continue
+        gz.write(line); size += len(line)
+        first = ts if first is None else first
+        keys.append((k, ik, ts))
+        if size >= SEGMENT_BYTES:
+            gz.close(); yield buf.getvalue(), first, ts, keys
+            buf, keys, size, first = io.BytesIO(), [], 0, None
+            gz = gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=3, mtime=0)
+    gz.close()
+    if keys:
+        yield buf.getvalue(), first if first is not None else ts, ts, keys
+
+def upload_segment(s3, body, first, last, count):
+    # content-addressed name: a retried upload of the same segment is idempotent
+    obj_key = (f"segments/{time.strftime('%Y%m%dT%H%M%SZ', time.gmtime(first))}-"
+               f"{time.strftime('%Y%m%dT%H%M%SZ', time.gmtime(last))}-{hashlib.sha256(body).hexdigest()[:16]}.jsonl.gz")
+    cfg = TransferConfig(multipart_threshold=8 << 20, multipart_chunksize=8 << 20, max_concurrency=4)
+    s3.upload_fileobj(io.BytesIO(body), S3_BUCKET, obj_key, Config=cfg,
+                      ExtraArgs={'ContentType': 'application/x-ndjson', 'ContentEncoding': 'gzip',
+                                 'Metadata': {'source': 'edge-node', 'count': str(count),
+                                              'ts-first': str(first), 'ts-last': str(last)}})
     return obj_key
 
-def enforce_once():
-    now = int(time.time())
-    batch = db.write_batch()
-    moved = 0
-    for k, v in db:
+def delete_entries(db, keys, lock):
+    # bounded write batches: data key + index key per entry; a key rewritten since it
+    # was archived keeps its new value (only the old index entry goes)
+    for i in range(0, len(keys), DELETE_BATCH):
+        with lock:
+            with db.write_batch() as wb:
+                for k, ik, ts in keys[i:i + DELETE_BATCH]:
+                    if k is not None:
+                        v = db.get(k)
+                        if v is not None and _value_ts(v) == ts:
+                            wb.delete(k)
+                    wb.delete(ik)
+
+def enforce_once(db, s3):
+    cutoff = int(time.time()) - MAX_AGE + 1  # ts <= now - MAX_AGE is expired
+    lock, moved, failed = threading.Lock(), [0], [0]  # lock serializes delete batches
+    slots = threading.BoundedSemaphore(2 * UPLOAD_WORKERS)  # bounds segments held in memory
+
+    def ship(body, first, last, keys):
+        live = sum(1 for k, _, _ in keys if k is not None)
         try:
-            ts, payload = key_metadata(v.decode('utf-8'))
-            if ts is None: continue
-            if now - int(ts) >= MAX_AGE:
-                obj_key = upload_to_s3(k.decode('utf-8'), int(ts), payload.encode('utf-8'))
-                # Verify then delete local entry.
-                head = s3.head_object(Bucket=S3_BUCKET, Key=obj_key)
-                if head.get('ResponseMetadata',{}).get('HTTPStatusCode') == 200:
-                    batch.delete(k)
-                    moved += 1
-        except Exception as e:
-            logging.exception("error processing key")
-    batch.write()
-    logging.info("moved %d entries to S3", moved)
+            obj_key = upload_segment(s3, body, first, last, live) if live else None
+            delete_entries(db, keys, lock)  # only after the upload completed
+            moved[0] += live
+            if live:
+                logging.info("archived %d entries to %s", live, obj_key)
+        except Exception:
+            failed[0] += live
+            logging.exception("segment upload failed; entries kept for the next run")
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(UPLOAD_WORKERS) as pool:
+        for seg in expired_segments(db, cutoff):
+            slots.acquire()
+            pool.submit(ship, *seg)
+    logging.info("moved %d entries to S3 (%d left for retry)", moved[0], failed[0])
+    return moved[0]
+
+def bench(n=200_000, payload_bytes=200, per_request_s=0.005):
+    # stand-ins: sorted in-memory KV with plyvel's surface, S3 with per-request latency
+    import bisect
+    global SEGMENT_BYTES
+    class KV:
+        def __init__(self): self.keys, self.vals = [], {}
+        def get(self, k): return self.vals.get(k)
+        def put(self, k, v):
+            if k not in self.vals: bisect.insort(self.keys, k)
+            self.vals[k] = v
+        def delete(self, k):
+            if self.vals.pop(k, None) is not None: self.keys.pop(bisect.bisect_left(self.keys, k))
+        def __iter__(self): return ((k, self.vals[k]) for k in list(self.keys))
+        def iterator(self, start=b'', stop=None, include_value=True):
+            i, j = bisect.bisect_left(self.keys, start), bisect.bisect_left(self.keys, stop) if stop else len(self.keys)
+            return iter([(k, self.vals[k]) if include_value else k for k in self.keys[i:j]])
+        def write_batch(self, transaction=False):
+            kv = self
+            class WB:
+                def __init__(s): s.ops = []
+                def put(s, k, v): s.ops.append((kv.put, (k, v)))
+                def delete(s, k): s.ops.append((kv.delete, (k,)))
+                def write(s):
+                    for f, a in s.ops: f(*a)
+                def __enter__(s): return s
+                def __exit__(s, *e): s.write()
+            return WB()
+    class S3:
+        def __init__(self): self.requests, self.bytes = 0, 0
+        def _req(self, n=0): time.sleep(per_request_s); self.requests += 1; self.bytes += n
+        def put_object(self, Bucket, Key, Body, Metadata): self._req(len(Body))
+        def head_object(self, Bucket, Key): self._req(); return {'ResponseMetadata': {'HTTPStatusCode': 200}}
+        def upload_fileobj(self, f, bucket, key, Config=None, ExtraArgs=None):
+            data = f.read(); parts = max(1, -(-len(data) // (8 << 20)))
+            for _ in range(parts + (2 if parts > 1 else 0)): self._req(len(data) // parts)
+    SEGMENT_BYTES = 8 << 20
+    old_ts = int(time.time()) - MAX_AGE - 3600
+    for label in ("per-entry put+head", "segments"):
+        db, s3 = KV(), S3()
+        for i in range(n):
+            pay = os.urandom(payload_bytes // 2).hex()  # hex telemetry: ~2x compressible
+            if label == "segments":
+                put_entry(db, b'sensor/%08d' % i, old_ts + i % 3600, pay)
+            else:
+                db.put(b'sensor/%08d' % i, json.dumps({'ts': old_ts + i % 3600, 'payload': pay}).encode())
+        t0 = time.perf_counter()
+        if label == "segments":
+            moved = enforce_once(db, s3)
+        else:
+            moved = 0
+            for k, v in db:  # the previous loop, limited to a sample (it is linear in requests)
+                if moved == 2000: break
+                ts, payload = key_metadata(v.decode('utf-8'))
+                key = f"{ts}/{k.decode()}"
+                s3.put_object(Bucket=S3_BUCKET, Key=key, Body=payload.encode(), Metadata={})
+                s3.head_object(Bucket=S3_BUCKET, Key=key); db.delete(k); moved += 1
+        dt = time.perf_counter() - t0
+        print(f"{label:18s}: {moved / dt:10,.0f} entries/s, {s3.requests} S3 requests for {moved} entries, "
+              f"{s3.bytes / max(moved, 1):.0f} B/entry uploaded")
 
 if __name__ == '__main__':
+    import sys
+    if '--bench' in sys.argv:
+        logging.getLogger().setLevel(logging.WARNING)
+        bench(); sys.exit()
+    db, s3 = connect()
+    build_index(db)
+    last_backfill = time.monotonic()
     # Simple loop; a Kubernetes CronJob can run snapshot enforcement instead.
     while True:
-        enforce_once()
-        time.sleep(int(os.environ.get('ENFORCE_INTERVAL', 300)))
\ No newline at end of file
+        if BACKFILL_INTERVAL and time.monotonic() - last_backfill >= BACKFILL_INTERVAL:
+            build_index(db, force=True); last_backfill = time.monotonic()
+        try:
+            enforce_once(db, s3)
+        except Exception:
+            logging.exception("enforcement run failed; retrying next interval")
+        time.sleep(int(os.environ.get('ENFORCE_INTERVAL', 300)))
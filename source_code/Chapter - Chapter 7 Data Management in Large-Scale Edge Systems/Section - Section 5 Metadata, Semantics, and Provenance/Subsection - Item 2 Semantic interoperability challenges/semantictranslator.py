@@ -1,15 +1,25 @@
 #!/usr/bin/env python3
 # Production-ready: robust reconnects, schema validation, unit conversion.
-import json, logging
+# Per-source mapping rules are compiled once into closures; unit conversions
+# are resolved through pint once per unit string and cached as (scale, offset);
+# the output schema is compiled to a type-check fast path. Messages are
+# translated in batches off the MQTT network thread.
+import json, logging, os, threading, time
+from collections import deque
+from functools import lru_cache
 import paho.mqtt.client as mqtt
 from pint import UnitRegistry
 from jsonschema import validate, ValidationError
+from jsonschema.validators import validator_for
 
 U = UnitRegistry()
 BROKER = "localhost"
 IN_TOPIC = "site/+/raw"
 OUT_TOPIC = "site/{site}/normalized"
 JSON_LD_CONTEXT = {"vibration_rms": "http://example.org/vocab#vibration_rms"}
+RULES_PATH = os.getenv("RULES_PATH", "/etc/edge/translation_rules.json")
+BATCH_S = 0.02   # translation batch period
+INBOX_MAX = 100_000   # queued messages before on_message blocks the MQTT network thread
 
 # minimal schema for normalized message
 NORMAL_SCHEMA = {
@@ -23,40 +33,196 @@ NORMAL_SCHEMA = {
   "required": ["site","timestamp","vibration_rms","unit"]
 }
 
+# mapping previously hard-coded in on_message; used for sources without a rule
+DEFAULT_RULE = {
+  "site": "site",
+  "timestamp": "ts",
+  "values": [["acc_rms_g", "g"], ["vibration_rms", None]],   # first present field wins; None = unit_field
+  "unit_field": "unit",
+  "default_unit": "m/s^2",
+}
+
 def convert_to_m_s2(value, unit_str):
     q = value * U(unit_str)
     return q.to("meter/second**2").magnitude
 
-def on_message(client, userdata, msg):
+# accelerometer payloads say "g" for standard gravity; pint reads it as gram
+UNIT_ALIASES = {"g": "standard_gravity", "G": "standard_gravity"}
+
+@lru_cache(maxsize=1024)
+def unit_factor(unit_str, target="meter/second**2"):
+    """(scale, offset) with target = scale*value + offset; pint is consulted once per unit."""
+    unit_str = UNIT_ALIASES.get(unit_str, unit_str)
+    zero = U.Quantity(0.0, unit_str).to(target).magnitude
+    return U.Quantity(1.0, unit_str).to(target).magnitude - zero, zero
+
+_JSON_TYPES = {"string": str, "number": (int, float), "integer": int, "boolean": bool, "object": dict, "array": list}
+
+def compile_schema(schema):
+    """Validator callable: type/required fast path when the schema allows it, else compiled jsonschema."""
+    full = validator_for(schema)(schema)
+    props = schema.get("properties", {})
+    simple = set(schema) <= {"type", "properties", "required"} and all(set(p) == {"type"} for p in props.values())
+    if not simple:
+        return full.validate
+    required = tuple(schema.get("required", ()))
+    types = tuple((k, _JSON_TYPES[p["type"]]) for k, p in props.items())
+    def check(out):
+        for k in required:
+            if k not in out:
+                break
+        else:
+            for k, t in types:
+                if k in out and (not isinstance(out[k], t) or (t is not bool and isinstance(out[k], bool))):
+                    break
+            else:
+                return
+        full.validate(out)  # slow path only to raise the detailed error
+    return check
+
+def valid_segment(site):
+    # the site becomes one topic level: wildcards make publish() raise, '/' adds levels
+    return isinstance(site, str) and site != "" and not any(c in site for c in "+#/\0")
+
+def compile_rule(rule):
+    """Closure rec -> normalized dict (None when no value field is present)."""
+    site_f, ts_f, unit_f = rule.get("site", "site"), rule.get("timestamp", "ts"), rule.get("unit_field", "unit")
+    default_unit = rule.get("default_unit", "m/s^2")
+    values = [(f, unit_factor(u) if u else None) for f, u in rule["values"]]
+    def translate(rec, site_hint=None):
+        for field, conv in values:
+            raw = rec.get(field)
+            if raw:  # falsy values skipped, as the original `or` chain did
+                break
+        else:
+            return None
+        scale, offset = conv or unit_factor(rec.get(unit_f, default_unit))
+        return {"site": rec.get(site_f) or site_hint or "unknown", "timestamp": rec.get(ts_f),
+                "vibration_rms": float(raw) * scale + offset, "unit": "m/s^2"}
+    return translate
+
+class Translator:
+    """Compiled per-source rules (keyed by the topic's site segment) and a batch entry point."""
+    def __init__(self, rules=None, schema=NORMAL_SCHEMA):
+        self.rules = {src: compile_rule(r) for src, r in (rules or {}).items()}
+        self.default = compile_rule(DEFAULT_RULE)
+        self.check = compile_schema(schema)
+
+    def translate_batch(self, msgs):
+        """[(topic, payload)] -> [(out_topic, out_payload)]; bad messages are logged and dropped."""
+        out, rules, default, check = [], self.rules, self.default, self.check
+        for topic, payload in msgs:
+            src = topic.split("/", 2)[1] if topic.count("/") >= 2 else None
+            try:
+                rec = json.loads(payload)
+                norm = rules.get(src, default)(rec, src)
+                if norm is None:
+                    logging.warning("missing value; ignoring")
+                    continue
+                check(norm)  # schema enforcement
+                if not valid_segment(norm["site"]):
+                    logging.warning("invalid site %r; ignoring", norm["site"])
+                    continue
+            except (json.JSONDecodeError, ValidationError):
+                logging.exception("malformed message")
+                continue
+            except Exception:
+                logging.exception("unit conversion failed")
+                continue
+            out.append((OUT_TOPIC.format(site=norm["site"]), json.dumps(norm)))
+        return out
+
+def load_rules(path=RULES_PATH):
+    # {"<site>": {rule}, ...}; missing file = default mapping only
     try:
-        rec = json.loads(msg.payload)
-        # map lexical variants to canonical term
-        site = rec.get("site") or "unknown"
-        raw_val = rec.get("acc_rms_g") or rec.get("vibration_rms")
-        unit = "g" if "acc_rms_g" in rec else rec.get("unit","m/s^2")
-        if raw_val is None:
-            logging.warning("missing value; ignoring")
-            return
-        # unit-aware conversion
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def on_message(client, userdata, msg):
+    # network thread only queues; the batch loop translates and publishes
+    while len(userdata) >= INBOX_MAX:
+        time.sleep(BATCH_S)  # translator is behind: stop reading so the broker holds the backlog
+    userdata.append((msg.topic, msg.payload))
+
+def batch_loop(client, inbox, translator, stop=None):
+    while stop is None or not stop.is_set():
+        time.sleep(BATCH_S)
+        batch = [inbox.popleft() for _ in range(len(inbox))]
         try:
-            normalized = convert_to_m_s2(float(raw_val), unit)
+            out = translator.translate_batch(batch)
         except Exception:
-            logging.exception("unit conversion failed")
-            return
-        out = {"site": site, "timestamp": rec.get("ts"), 
-               "vibration_rms": normalized, "unit": "m/s^2"}
-        validate(out, NORMAL_SCHEMA)  # schema enforcement
-        client.publish(OUT_TOPIC.format(site=site), json.dumps(out), qos=1)
-    except (json.JSONDecodeError, ValidationError):
-        logging.exception("malformed message")
+            logging.exception("translation batch failed; %d messages dropped", len(batch))
+            continue
+        for topic, payload in out:
+            try:
+                client.publish(topic, payload, qos=1)
+            except Exception:  # one bad topic must not kill the only translation thread
+                logging.exception("publish to %s failed", topic)
 
 def main():
-    client = mqtt.Client()
+    inbox, translator = deque(), Translator(load_rules())
+    client = mqtt.Client(userdata=inbox)
     client.on_message = on_message
     client.connect(BROKER)
     client.subscribe(IN_TOPIC, qos=1)
+    threading.Thread(target=batch_loop, args=(client, inbox, translator), daemon=True).start()
     client.loop_forever()
 
+def bench(n_sources=100, n_msgs=100_000):
+    # 100 sources, each with its own value field and unit; previous path on the default format
+    import random
+    rng = random.Random(0)
+    units = ["g", "m/s^2", "ft/s^2", "mm/s^2", "cm/s^2", "in/s^2", "Gal", "standard_gravity"]
+    rules, sources = {}, []
+    for i in range(n_sources):
+        src = f"line{i}"
+        if i % 3 == 0:  # unit in the payload
+            rules[src] = {"site": "plant", "timestamp": "time", "values": [[f"acc_{i}", None]], "unit_field": "u"}
+        else:
+            rules[src] = {"site": "plant", "timestamp": "time", "values": [[f"acc_{i}", units[i % len(units)]]]}
+        sources.append(src)
+    msgs = []
+    for j in range(n_msgs):
+        i = rng.randrange(n_sources)
+        rec = {"plant": f"line{i}", "time": "2024-05-01T00:00:00Z", f"acc_{i}": rng.uniform(0.1, 5.0)}
+        if i % 3 == 0:
+            rec["u"] = units[j % len(units)]
+        msgs.append((f"site/line{i}/raw", json.dumps(rec).encode()))
+    old_msgs = [(f"site/s{j % n_sources}/raw", json.dumps({"site": f"s{j % n_sources}", "ts": "2024-05-01T00:00:00Z",
+                 "vibration_rms": rng.uniform(0.1, 5.0), "unit": "ft/s^2"}).encode()) for j in range(5000)]
+
+    class Msg:
+        def __init__(self, topic, payload): self.topic, self.payload = topic, payload
+    class Client:
+        def publish(self, topic, payload, qos=0): pass
+    def old_on_message(client, userdata, msg):  # the previous per-message path
+        rec = json.loads(msg.payload)
+        site = rec.get("site") or "unknown"
+        raw_val = rec.get("acc_rms_g") or rec.get("vibration_rms")
+        unit = "g" if "acc_rms_g" in rec else rec.get("unit","m/s^2")
+        out = {"site": site, "timestamp": rec.get("ts"), "vibration_rms": convert_to_m_s2(float(raw_val), unit), "unit": "m/s^2"}
+        validate(out, NORMAL_SCHEMA)
+        client.publish(OUT_TOPIC.format(site=site), json.dumps(out), qos=1)
+    c = Client()
+    t0 = time.perf_counter()
+    for topic, payload in old_msgs:
+        old_on_message(c, None, Msg(topic, payload))
+    old = len(old_msgs) / (time.perf_counter() - t0)
+
+    tr = Translator(rules)
+    t0 = time.perf_counter()
+    for i in range(0, n_msgs, 1000):
+        tr.translate_batch(msgs[i:i + 1000])
+    new = n_msgs / (time.perf_counter() - t0)
+    a = json.loads(tr.translate_batch(old_msgs[:1])[0][1])["vibration_rms"]
+    b = convert_to_m_s2(json.loads(old_msgs[0][1])["vibration_rms"], "ft/s^2")
+    print(f"previous (pint parse + jsonschema.validate per msg): {old:10,.0f} msgs/s, 1 schema")
+    print(f"compiled rules, batches of 1000                    : {new:10,.0f} msgs/s, {n_sources} source schemas")
+    print(f"cached factor vs pint: |diff| = {abs(a - b):.1e} m/s^2")
+
 if __name__ == "__main__":
+    import sys
     logging.basicConfig(level=logging.INFO)
-    main()
\ No newline at end of file
+    bench() if "--bench" in sys.argv else main()
@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 # Portable provenance capture for Linux-based edge nodes (e.g., Jetson, Raspberry Pi)
-import sqlite3, json, time, hashlib, logging
+# Records are queued and sealed in batches: one ECDSA signature over the batch
+# Merkle root, an inclusion proof stored per record, one SQLite transaction
+# and one publish per batch on a persistent MQTT connection.
+import sqlite3, json, time, hashlib, logging, atexit, threading, queue
 import paho.mqtt.client as mqtt
 from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.asymmetric import ec
@@ -11,17 +14,34 @@ DB_PATH = "/var/lib/provenance/prov.db"
 MQTT_BROKER = "edge-kafka-proxy.local"  # or use Kafka producer in production
 MQTT_TOPIC = "provenance/signed"
 AGENT_ID = "spiffe://example.org/agent/edge-node-01"
+BATCH_MAX = 1024      # records sealed per batch at most
+BATCH_S = 0.2         # max wait before a partial batch is sealed
+RETRY_MAX_S = 30      # backoff cap while a batch fails to seal
+CLOSE_RETRIES = 5     # attempts per batch once close() was called
 
-# Ensure database and append-only table
-conn = sqlite3.connect(DB_PATH, isolation_level=None, detect_types=sqlite3.PARSE_DECLTYPES)
-conn.execute("PRAGMA journal_mode=WAL;")
-conn.execute("""CREATE TABLE IF NOT EXISTS prov (
-    seq INTEGER PRIMARY KEY AUTOINCREMENT,
-    timestamp REAL NOT NULL,
-    prov_json TEXT NOT NULL,
-    hash TEXT NOT NULL,
-    signature BLOB NOT NULL
-)""")
+def init_db(path=DB_PATH):
+    # Ensure database and append-only tables; batch columns added in place
+    conn = sqlite3.connect(path, isolation_level=None, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("""CREATE TABLE IF NOT EXISTS prov (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp REAL NOT NULL,
+        prov_json TEXT NOT NULL,
+        hash TEXT NOT NULL,
+        signature BLOB NOT NULL
+    )""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS prov_batch (
+        batch_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp REAL NOT NULL,
+        root TEXT NOT NULL,
+        signature BLOB NOT NULL,
+        size INTEGER NOT NULL
+    )""")
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(prov)")}
+    for col, typ in (("batch_id", "INTEGER"), ("proof", "TEXT")):
+        if col not in cols:
+            conn.execute(f"ALTER TABLE prov ADD COLUMN {col} {typ}")
+    return conn
 
 # In-memory ECDSA key for example. In production, use TPM-backed key.
 private_key = ec.generate_private_key(ec.SECP256R1())
@@ -31,14 +51,165 @@ def sign_blob(blob: bytes) -> bytes:
     sig = private_key.sign(blob, ec.ECDSA(hashes.SHA256()))
     return sig
 
-def publish_signed(record: dict, sig: bytes):
-    client = mqtt.Client()
-    client.connect(MQTT_BROKER, 1883, 60)
+def _leaf(record_hash: bytes) -> bytes:
+    return hashlib.sha256(b"\x00" + record_hash).digest()
+
+def _node(left: bytes, right: bytes) -> bytes:
+    return hashlib.sha256(b"\x01" + left + right).digest()
+
+def merkle_tree(record_hashes):
+    """Levels of a binary Merkle tree (leaves first); an odd last node is paired with itself."""
+    levels = [[_leaf(h) for h in record_hashes]]
+    while len(levels[-1]) > 1:
+        lv = levels[-1]
+        if len(lv) % 2:
+            lv = lv + [lv[-1]]
+        levels.append([_node(lv[i], lv[i + 1]) for i in range(0, len(lv), 2)])
+    return levels
+
+def merkle_proof(levels, i):
+    # sibling hashes bottom-up, as hex; a leading "L"/"R" marks the sibling's side
+    proof = []
+    for lv in levels[:-1]:
+        j = i ^ 1
+        sib = lv[j] if j < len(lv) else lv[i]
+        proof.append(("L" if j < i else "R") + sib.hex())
+        i //= 2
+    return proof
+
+def verify_record(prov_json: str, proof, root_hex: str, signature: bytes, public_key) -> bool:
+    """Check a stored record against its batch: inclusion proof, then the root signature."""
+    h = _leaf(hashlib.sha256(prov_json.encode("utf-8")).hexdigest().encode("ascii"))
+    for step in proof:
+        sib = bytes.fromhex(step[1:])
+        h = _node(sib, h) if step[0] == "L" else _node(h, sib)
+    if h.hex() != root_hex:
+        return False
+    try:
+        public_key.verify(signature, bytes.fromhex(root_hex), ec.ECDSA(hashes.SHA256()))
+        return True
+    except Exception:
+        return False
+
+class Publisher:
+    """One MQTT connection for the life of the process; the paho loop thread reconnects."""
+    def __init__(self, broker=MQTT_BROKER, topic=MQTT_TOPIC, client=None):
+        self.topic, self.own = topic, client is None
+        self.client = client or mqtt.Client()
+        self.pending, self.early, self.lock = set(), set(), threading.Lock()  # unacked / acked-before-recorded mids
+        if self.own:
+            self.client.on_publish = lambda c, u, mid, *rest: self._acked(mid)
+            self.client.reconnect_delay_set(min_delay=1, max_delay=30)
+            self.client.connect_async(broker, 1883, 60)
+            self.client.loop_start()
+
+    def _acked(self, mid):
+        # paho calls this holding its outgoing-message lock, so publish() must not hold ours
+        with self.lock:
+            if mid in self.pending:
+                self.pending.discard(mid)
+            else:
+                self.early.add(mid)
+
+    def publish(self, payload: str):
+        # qos=1, non-blocking: paho queues and retries while disconnected
+        info = self.client.publish(self.topic, payload, qos=1)
+        if self.own:
+            with self.lock:
+                if info.mid in self.early:
+                    self.early.discard(info.mid)
+                else:
+                    self.pending.add(info.mid)
+        return info
+
+    def close(self, timeout=10.0):
+        # flush: give queued publishes up to timeout to be acked, then stop the loop; idempotent
+        if self.own:
+            self.own = False
+            deadline = time.monotonic() + timeout
+            while self.pending and time.monotonic() < deadline:
+                time.sleep(0.05)
+            if self.pending:
+                logging.warning("%d provenance publishes unacked at close", len(self.pending))
+            self.client.disconnect(); self.client.loop_stop()
+
+def publish_signed(record: dict, sig: bytes, publisher=None):
+    pub = publisher or Publisher()
     payload = json.dumps({"record": record, "signature": sig.hex()})
-    client.publish(MQTT_TOPIC, payload, qos=1)
-    client.disconnect()
+    pub.publish(payload)
+    if publisher is None:
+        pub.close()
+
+class ProvenanceBatcher:
+    """Queue of records sealed by a background thread in Merkle-signed batches."""
+    def __init__(self, conn, publisher, batch_max=BATCH_MAX, batch_s=BATCH_S):
+        self.conn, self.publisher = conn, publisher
+        self.batch_max, self.batch_s = batch_max, batch_s
+        self.q, self.closing = queue.Queue(), threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
 
-def capture_provenance(activity_id: str, inputs: list, operator_version: str):
+    def submit(self, ts, prov_bytes, h):
+        self.q.put((ts, prov_bytes, h))
+
+    def close(self):
+        if self.thread.is_alive():
+            self.closing.set(); self.q.put(None); self.thread.join()
+
+    def _run(self):
+        done = False
+        while not done:
+            batch = [self.q.get()]
+            deadline = time.monotonic() + self.batch_s
+            while len(batch) < self.batch_max and batch[-1] is not None:
+                try:
+                    batch.append(self.q.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                batch.pop(); done = True
+            backoff, attempts = 0.1, 0
+            while batch:  # a failed batch is retried, not dropped; later records wait in the queue
+                try:
+                    self.seal(batch)
+                    break
+                except Exception:
+                    attempts += 1
+                    if self.closing.is_set() and attempts >= CLOSE_RETRIES:
+                        logging.exception("sealing %d provenance records failed; dropped at close", len(batch))
+                        break
+                    logging.exception("sealing %d provenance records failed; retry in %.1fs", len(batch), backoff)
+                    time.sleep(backoff); backoff = min(backoff * 2, RETRY_MAX_S)
+
+    def seal(self, batch):
+        levels = merkle_tree([h for _, _, h in batch])
+        root = levels[-1][0]
+        sig = sign_blob(root)  # one signature per batch
+        now = time.time()
+        # Append batch and records atomically
+        with self.conn:
+            self.conn.execute("BEGIN")
+            bid = self.conn.execute("INSERT INTO prov_batch (timestamp, root, signature, size) VALUES (?, ?, ?, ?)",
+                                    (now, root.hex(), sig, len(batch))).lastrowid
+            rows = [(ts, pb.decode("utf-8"), h.decode("ascii"), sig, bid, json.dumps(merkle_proof(levels, i)))
+                    for i, (ts, pb, h) in enumerate(batch)]
+            self.conn.executemany("INSERT INTO prov (timestamp, prov_json, hash, signature, batch_id, proof) "
+                                  "VALUES (?, ?, ?, ?, ?, ?)", rows)
+        try:  # the batch is committed: a publish error must not make the caller seal it twice
+            self.publisher.publish(json.dumps({"batch_id": bid, "root": root.hex(), "signature": sig.hex(),
+                                               "records": [{"record": json.loads(r[1]), "proof": json.loads(r[5])} for r in rows]}))
+        except Exception:
+            logging.exception("batch %d stored but not published", bid)
+
+_batcher = None
+
+def capture_provenance(activity_id: str, inputs: list, operator_version: str, batcher=None):
+    global _batcher
+    if batcher is None:
+        if _batcher is None:
+            _batcher = ProvenanceBatcher(init_db(), Publisher())
+            atexit.register(shutdown)  # seal what is still queued, then flush the publisher
+        batcher = _batcher
     ts = time.time()
     prov = {
         "agent": AGENT_ID,
@@ -49,15 +220,66 @@ def capture_provenance(activity_id: str, inputs: list, operator_version: str):
     }
     prov_bytes = json.dumps(prov, separators=(",", ":"), sort_keys=True).encode("utf-8")
     h = hashlib.sha256(prov_bytes).hexdigest().encode("ascii")
-    sig = sign_blob(prov_bytes)
-    # Append to local store atomically
-    cur = conn.cursor()
-    cur.execute("INSERT INTO prov (timestamp, prov_json, hash, signature) VALUES (?, ?, ?, ?)",
-                (ts, prov_bytes.decode("utf-8"), h.decode("ascii"), sig))
-    cur.close()
-    publish_signed(prov, sig)
+    batcher.submit(ts, prov_bytes, h)  # signed, stored and published with its batch
+    return h
+
+def shutdown():
+    # seal the queue, then flush and stop the default batcher's publisher; idempotent
+    if _batcher is not None:
+        _batcher.close(); _batcher.publisher.close()
+
+def bench(n=20_000, connect_s=0.2):
+    # stand-in broker client; the previous path also paid connect_s per record (not slept here)
+    import os, tempfile
+    class Client:
+        def __init__(self): self.n = 0
+        def publish(self, topic, payload, qos=0): self.n += 1
+    d = tempfile.mkdtemp()
+    conn = init_db(os.path.join(d, "old.db"))
+    pub = Publisher(client=Client())
+    t0 = time.perf_counter()
+    for i in range(2000):  # previous path: sign + autocommit insert + publish per record
+        prov = {"agent": AGENT_ID, "activity": f"a{i}", "inputs": ["x"], "operator_version": "1", "timestamp": time.time()}
+        pb = json.dumps(prov, separators=(",", ":"), sort_keys=True).encode("utf-8")
+        sig = sign_blob(pb)
+        conn.execute("INSERT INTO prov (timestamp, prov_json, hash, signature) VALUES (?, ?, ?, ?)",
+                     (prov["timestamp"], pb.decode(), hashlib.sha256(pb).hexdigest(), sig))
+        publish_signed(prov, sig, pub)
+    old = 2000 / (time.perf_counter() - t0)
+    print(f"per-record : {old:9,.0f} records/s before connect cost; "
+          f"{1 / (1 / old + connect_s):,.1f} records/s with a {connect_s * 1e3:.0f} ms connect per record")
+
+    conn = init_db(os.path.join(d, "new.db"))
+    client = Client()
+    b = ProvenanceBatcher(conn, Publisher(client=client))
+    t0 = time.perf_counter()
+    for i in range(n):
+        capture_provenance(f"a{i}", ["x"], "1", batcher=b)
+    b.close()
+    dt = time.perf_counter() - t0
+    print(f"batched    : {n / dt:9,.0f} records/s, {conn.execute('SELECT COUNT(*) FROM prov_batch').fetchone()[0]} "
+          f"signatures, {client.n} publishes for {n} records")
+
+    pk = private_key.public_key()
+    rows = conn.execute("SELECT p.prov_json, p.proof, b.root, b.signature FROM prov p JOIN prov_batch b "
+                        "USING (batch_id) LIMIT 1000").fetchall()
+    t0 = time.perf_counter()
+    ok = all(verify_record(pj, json.loads(pf), root, sig, pk) for pj, pf, root, sig in rows)
+    per_rec = (time.perf_counter() - t0) / len(rows)
+    sig0 = sign_blob(b"x")
+    t0 = time.perf_counter()
+    for _ in range(1000):
+        pk.verify(sig0, b"x", ec.ECDSA(hashes.SHA256()))
+    ecdsa = (time.perf_counter() - t0) / 1000
+    bad = verify_record(rows[0][0].replace('"x"', '"y"'), json.loads(rows[0][1]), rows[0][2], rows[0][3], pk)
+    print(f"verify     : {per_rec * 1e6:.0f} us/record (proof of {len(json.loads(rows[0][1]))} hashes + root ECDSA, "
+          f"all ok={ok}, tampered ok={bad}); ECDSA alone {ecdsa * 1e6:.0f} us; a batch audit verifies the root once")
 
 # Example use
 if __name__ == "__main__":
+    import sys
+    if "--bench" in sys.argv:
+        bench(); sys.exit()
     capture_provenance("feature-extract:run:2025-12-29T12:00:00Z",
-                       ["sensor:temp:hash:abcd1234"], "edge-op:1.2.3")
\ No newline at end of file
+                       ["sensor:temp:hash:abcd1234"], "edge-op:1.2.3")
+    shutdown()
@@ -1,5 +1,9 @@
+import heapq
+import math
+from collections import Counter
 from dataclasses import dataclass
 from typing import Dict, List, Tuple
+import numpy as np
 
 @dataclass
 class Node:
@@ -19,9 +23,19 @@ class Task:
     net_bytes: float
     slo_seconds: float
 
+RESOURCES = ("cpu", "mem", "iops", "bw")
+BUCKETS_PER_OCTAVE = 4   # cpu-capacity index resolution
+
 def place_tasks(nodes: List[Node], tasks: List[Task],
-                latency_matrix: Dict[Tuple[str,str], float]) -> Dict[str,str]:
+                latency_matrix: Dict[Tuple[str,str], float], mode: str = "legacy") -> Dict[str,str]:
     # Sort tasks by strictness (SLO) and demand, greedy allocate best-fit node.
+    # mode="indexed" makes the same decisions through ResourcePlacer.
+    if mode == "indexed":
+        placement, unplaced = ResourcePlacer(nodes).place(tasks, latency_matrix)
+        if unplaced:
+            tid = next(iter(unplaced))
+            raise RuntimeError(f"No feasible node for task {tid}: {unplaced[tid]}")
+        return placement
     placement: Dict[str,str] = {}
     # mutable resource view
     avail: Dict[str, Node] = {n.id: Node(**n.__dict__) for n in nodes}
@@ -47,4 +61,190 @@ def place_tasks(nodes: List[Node], tasks: List[Task],
         n.storage_iops -= t.storage_iops
         n.net_bw -= t.net_bytes
         placement[t.id] = best_node
-    return placement
\ No newline at end of file
+    return placement
+
+class ResourcePlacer:
+    """Greedy multi-resource placement over a (nodes x 4) capacity array.
+
+    Decisions match place_tasks: tasks in (SLO, -cpu) order, each to the
+    feasible node of least latency + cpu / (0.9 * free cpu) within its SLO,
+    ties to the earlier node. Runs of tasks with the same SLO class and shape
+    are allocated as a batch from one vectorized scoring pass and a heap
+    (only the chosen node's cost changes between them); other tasks search a
+    cpu-capacity bucket index, most free cpu first, and stop once a bucket's
+    lower bound cannot beat the best cost found. Infeasible tasks are reported
+    with a reason instead of aborting the epoch.
+    """
+    def __init__(self, nodes: List[Node]):
+        self.ids = [n.id for n in nodes]
+        self.index = {nid: i for i, nid in enumerate(self.ids)}
+        self.cap = np.array([[n.cpu_cycles, n.mem_bytes, n.storage_iops, n.net_bw] for n in nodes], dtype=np.float64)
+        self.lat = np.array([n.base_latency for n in nodes], dtype=np.float64)
+        self.min_lat = float(self.lat.min()) if len(nodes) else 0.0
+        self.bucket = self._bucket_of(self.cap[:, 0])
+        self.counts = Counter(self.bucket.tolist())
+        self._members: Dict[int, np.ndarray] = {}
+
+    @staticmethod
+    def _bucket_of(cpu):
+        return np.floor(np.log2(np.maximum(cpu, 1.0)) * BUCKETS_PER_OCTAVE).astype(np.int64)
+
+    def _bucket_members(self, b):
+        m = self._members.get(b)
+        if m is None:
+            m = self._members[b] = np.flatnonzero(self.bucket == b)
+        return m
+
+    def _cost(self, cpu_free, lat, cpu):
+        return lat + cpu / np.maximum(cpu_free * 0.9, 1e-6)
+
+    def _allocate(self, i, d):
+        self.cap[i] -= d
+        b = int(self._bucket_of(self.cap[i:i + 1, 0])[0])
+        old = int(self.bucket[i])
+        if b != old:
+            self._members.pop(old, None); self._members.pop(b, None)
+            self.counts[old] -= 1; self.counts[b] += 1
+            if not self.counts[old]:
+                del self.counts[old]
+            self.bucket[i] = b
+
+    def _reason(self, d, slo):
+        short = [r for r, ok in zip(RESOURCES, (self.cap >= d).any(axis=0)) if not ok]
+        if short:
+            return "no node with enough " + "/".join(short)
+        if not (self.cap >= d).all(axis=1).any():
+            return "no node with all resources at once"
+        return f"no feasible node within SLO {slo:g}s"
+
+    def _search(self, d, slo, ov):
+        """Best (cost, node) for one task via the bucket index; ov = (node idx, latency) overrides."""
+        best = (math.inf, -1)
+        skip = None
+        if ov is not None:
+            idx, lat = ov
+            c = self._cost(self.cap[idx, 0], lat, d[0])
+            ok = (self.cap[idx] >= d).all(axis=1) & (c <= slo)
+            for j in np.flatnonzero(ok):
+                best = min(best, (float(c[j]), int(idx[j])))
+            skip = set(idx.tolist())
+        lo = int(self._bucket_of(np.array([d[0]]))[0])  # buckets below cannot hold the cpu demand
+        for b in sorted(self.counts, reverse=True):
+            if b < lo:
+                break
+            upper = 2.0 ** ((b + 1.001) / BUCKETS_PER_OCTAVE)  # slack for log2 rounding at the edge
+            bound = self.min_lat + d[0] / max(upper * 0.9, 1e-6)
+            if bound > min(best[0], slo):
+                break
+            m = self._bucket_members(b)
+            ok = (self.cap[m] >= d).all(axis=1)
+            if not ok.any():
+                continue
+            m = m[ok]
+            c = self._cost(self.cap[m, 0], self.lat[m], d[0])
+            if skip:
+                keep = np.fromiter((i not in skip for i in m.tolist()), bool, len(m))
+                m, c = m[keep], c[keep]
+            c_ok = c <= slo
+            if c_ok.any():
+                m, c = m[c_ok], c[c_ok]
+                j = np.lexsort((m, c))[0]
+                best = min(best, (float(c[j]), int(m[j])))
+        return best
+
+    def place(self, tasks: List[Task], latency_matrix: Dict[Tuple[str,str], float] = None):
+        """-> (placement {task: node}, unplaced {task: reason}); capacities are consumed."""
+        overrides: Dict[str, Tuple[list, list]] = {}
+        for (tid, nid), lat in (latency_matrix or {}).items():
+            i = self.index.get(nid)
+            if i is not None:
+                o = overrides.setdefault(tid, ([], []))
+                o[0].append(i); o[1].append(lat)
+        placement: Dict[str,str] = {}
+        unplaced: Dict[str,str] = {}
+        tasks_sorted = sorted(tasks, key=lambda t: (t.slo_seconds, -t.cpu_cycles))
+        k = 0
+        while k < len(tasks_sorted):
+            t = tasks_sorted[k]
+            shape = (t.slo_seconds, t.cpu_cycles, t.mem_bytes, t.storage_iops, t.net_bytes)
+            d = np.array(shape[1:], dtype=np.float64)
+            if t.id in overrides:
+                idx, lat = overrides[t.id]
+                cost, i = self._search(d, t.slo_seconds, (np.array(idx), np.array(lat)))
+                if i < 0:
+                    unplaced[t.id] = self._reason(d, t.slo_seconds)
+                else:
+                    self._allocate(i, d); placement[t.id] = self.ids[i]
+                k += 1
+                continue
+            # batch: following tasks of the same SLO class and shape, without latency overrides
+            e = k + 1
+            while (e < len(tasks_sorted) and tasks_sorted[e].id not in overrides and
+                   (tasks_sorted[e].slo_seconds, tasks_sorted[e].cpu_cycles, tasks_sorted[e].mem_bytes,
+                    tasks_sorted[e].storage_iops, tasks_sorted[e].net_bytes) == shape):
+                e += 1
+            if e - k == 1:
+                cost, i = self._search(d, t.slo_seconds, None)
+                if i < 0:
+                    unplaced[t.id] = self._reason(d, t.slo_seconds)
+                else:
+                    self._allocate(i, d); placement[t.id] = self.ids[i]
+                k = e
+                continue
+            c = self._cost(self.cap[:, 0], self.lat, d[0])
+            cand = np.flatnonzero((self.cap >= d).all(axis=1) & (c <= t.slo_seconds))
+            heap = list(zip(c[cand].tolist(), cand.tolist()))
+            heapq.heapify(heap)
+            for j in range(k, e):
+                if not heap:
+                    reason = self._reason(d, t.slo_seconds)
+                    for tt in tasks_sorted[j:e]:
+                        unplaced[tt.id] = reason
+                    break
+                _, i = heapq.heappop(heap)
+                self._allocate(i, d); placement[tasks_sorted[j].id] = self.ids[i]
+                if (self.cap[i] >= d).all():
+                    ci = float(self._cost(self.cap[i, 0], self.lat[i], d[0]))
+                    if ci <= t.slo_seconds:
+                        heapq.heappush(heap, (ci, i))
+            k = e
+        return placement, unplaced
+
+def bench(n_nodes=5_000, n_tasks=100_000, n_classes=20, seed=0):
+    import random, time
+    rng = random.Random(seed)
+    def make(n_nodes, n_tasks):
+        nodes = [Node(f"n{i}", rng.uniform(2e9, 4e10), rng.randrange(4, 256) << 30, rng.uniform(1e3, 1e5),
+                      rng.uniform(1e8, 1e10), rng.uniform(1e-3, 2e-2)) for i in range(n_nodes)]
+        classes = [(rng.uniform(1e7, 5e8), rng.randrange(64, 2048) << 20, rng.uniform(5, 200),
+                    rng.uniform(1e5, 5e6), rng.choice([0.02, 0.05, 0.1, 0.5])) for _ in range(n_classes)]
+        tasks = [Task(f"t{j}", *classes[rng.randrange(n_classes)][:4], classes[rng.randrange(n_classes)][4])
+                 for j in range(n_tasks)]
+        # 1% of tasks carry measured latencies to a few nodes
+        lat = {(t.id, f"n{rng.randrange(n_nodes)}"): rng.uniform(1e-4, 5e-3)
+               for t in rng.sample(tasks, n_tasks // 100) for _ in range(3)}
+        return nodes, tasks, lat
+
+    nodes, tasks, lat = make(500, 20_000)
+    t0 = time.perf_counter(); ref = place_tasks(nodes, tasks[:5000], lat); t_leg = time.perf_counter() - t0
+    t0 = time.perf_counter(); got = place_tasks(nodes, tasks[:5000], lat, mode="indexed"); t_idx = time.perf_counter() - t0
+    print(f"500 nodes x 5k tasks: legacy {t_leg:.2f}s, indexed {t_idx:.2f}s, identical placements: {got == ref}")
+
+    nodes, tasks, lat = make(n_nodes, n_tasks)
+    t0 = time.perf_counter()
+    try:
+        place_tasks(nodes, tasks[:1000], lat)
+    except RuntimeError:
+        pass
+    leg = (time.perf_counter() - t0) * n_tasks / 1000
+    t0 = time.perf_counter()
+    placement, unplaced = ResourcePlacer(nodes).place(tasks, lat)
+    dt = time.perf_counter() - t0
+    reasons = {}
+    for r in unplaced.values():
+        reasons[r] = reasons.get(r, 0) + 1
+    print(f"{n_nodes} nodes x {n_tasks // 1000}k tasks: legacy ~{leg:.0f}s (scaled from 1k tasks), indexed {dt:.2f}s; "
+          f"{len(placement)} placed, {len(unplaced)} unplaced {reasons}")
+
+if __name__ == "__main__":
+    bench()
@@ -1,24 +1,159 @@
 #!/usr/bin/env python3
 # Simple decentralized offloader for edge devices.
-import asyncio, aiohttp, json, logging, socket, time
+# Peers announce themselves (utilization, queue depth) over UDP multicast, or
+# through a stand-in registry where multicast is unavailable, and gossip what
+# they know about others. RTTs are probed concurrently over pooled keep-alive
+# connections and kept as EWMAs; the decision loop reads the head of a ranking
+# maintained by the background tasks instead of probing on the critical path.
+import asyncio, aiohttp, json, logging, os, random, socket, struct, time
+from aiohttp import web
 from typing import Dict, List
 
 logging.basicConfig(level=logging.INFO)
 PEER_PORT = 9000
 OFFLOAD_PATH = "/offload"
+HEALTH_PATH = "/health"
 UTIL_THRESHOLD = 0.75  # local util threshold
 DISCOVER_INTERVAL = 5.0
+MCAST_GROUP, MCAST_PORT = "239.255.42.99", 9001
+REGISTRY = os.getenv("OFFLOAD_REGISTRY")        # "host:port" of a stand-in registry; unset = multicast
+NODE_ID = os.getenv("NODE_ID", socket.gethostname())
+ANNOUNCE_INTERVAL = 1.0   # s between announcements (own state + gossip)
+PROBE_INTERVAL = 1.0      # s between concurrent RTT probe rounds
+PEER_TTL = 5.0            # s without news before a peer is dropped from the ranking
+RTT_ALPHA = 0.3           # EWMA weight of a new RTT sample
+GOSSIP_FANOUT = 8         # other peers' entries piggybacked per announcement
+QUEUE_COST = 0.02         # s of expected wait per task queued at a peer
+MAX_FAILS = 3             # consecutive failures before a peer is skipped until it answers a probe
 
 async def get_local_metrics() -> Dict:
     # Replace with psutil or hardware counters on Jetson/ARM
     # Placeholder minimal metrics
     return {"util": 0.6, "free_mem": 120*1024*1024}
 
-async def discover_peers() -> List[str]:
-    # Simple UDP multicast discovery (production: mDNS or control-plane registry)
-    peers = []
-    # multicast discovery omitted for brevity; return configured peers
-    return peers
+class PeerTable:
+    """Peer state merged from announcements, gossip and probes, with a maintained ranking."""
+    def __init__(self, self_id=NODE_ID):
+        self.self_id = self_id
+        self.peers: Dict[str, Dict] = {}
+        self.ranking: List[str] = []
+
+    def merge(self, entry: Dict):
+        # newest origin timestamp wins; RTT and failure state are local and kept
+        pid = entry.get("id")
+        if not pid or pid == self.self_id:
+            return
+        p = self.peers.get(pid)
+        if p is None:
+            p = self.peers[pid] = {"rtt": None, "fails": 0, "ts": 0.0}
+        if entry.get("ts", 0.0) > p["ts"]:
+            p.update({k: entry[k] for k in ("host", "port", "gport", "util", "queue", "ts") if k in entry})
+            p["seen"] = time.time()
+
+    def observe_rtt(self, pid: str, rtt: float):
+        p = self.peers.get(pid)
+        if p is not None:
+            p["rtt"] = rtt if p["rtt"] is None else (1 - RTT_ALPHA) * p["rtt"] + RTT_ALPHA * rtt
+            p["fails"] = 0
+
+    def fail(self, pid: str):
+        p = self.peers.get(pid)
+        if p is not None:
+            p["fails"] += 1
+            if p["fails"] >= MAX_FAILS and pid in self.ranking:
+                self.ranking.remove(pid)
+
+    def score(self, p: Dict) -> float:
+        return p["rtt"] + QUEUE_COST * p.get("queue", 0)
+
+    def rerank(self, now=None):
+        now = time.time() if now is None else now
+        for pid in [pid for pid, p in self.peers.items() if now - p.get("seen", 0) > 3 * PEER_TTL]:
+            del self.peers[pid]
+        live = [pid for pid, p in self.peers.items()
+                if p["rtt"] is not None and p["fails"] < MAX_FAILS and now - p["seen"] <= PEER_TTL
+                and p.get("util", 1.0) < UTIL_THRESHOLD]
+        self.ranking = sorted(live, key=lambda pid: self.score(self.peers[pid]))
+
+    def best(self):
+        # O(1): head of the ranking maintained by the probe/announce tasks
+        return self.ranking[0] if self.ranking else None
+
+    def gossip(self, k=GOSSIP_FANOUT) -> List[Dict]:
+        fresh = sorted(self.peers.items(), key=lambda kv: -kv[1]["ts"])[:k]
+        return [{"id": pid, **{f: p[f] for f in ("host", "port", "gport", "util", "queue", "ts") if f in p}} for pid, p in fresh]
+
+class DiscoveryProtocol(asyncio.DatagramProtocol):
+    # announcements and registry replies: {"self": entry, "gossip": [entries]}
+    def __init__(self, table: PeerTable):
+        self.table = table
+
+    def datagram_received(self, data, addr):
+        try:
+            msg = json.loads(data)
+        except ValueError:
+            return
+        for entry in [msg.get("self") or {}] + msg.get("gossip", []):
+            if entry.get("id") and "host" not in entry:
+                entry["host"] = addr[0]
+            self.table.merge(entry)
+
+class Registry(asyncio.DatagramProtocol):
+    """Stand-in for multicast: records announcements, replies with the freshest entries."""
+    def __init__(self):
+        self.table = PeerTable(self_id=None)
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            msg = json.loads(data)
+        except ValueError:
+            return
+        me = msg.get("self") or {}
+        me.setdefault("host", addr[0])
+        self.table.merge(me)
+        self.transport.sendto(json.dumps({"gossip": self.table.gossip(k=64)}).encode(), addr)
+
+async def open_discovery(table: PeerTable, registry=REGISTRY):
+    """UDP endpoint plus announce destinations (multicast group, or the registry)."""
+    loop = asyncio.get_running_loop()
+    if registry:
+        host, port = registry.rsplit(":", 1)
+        transport, _ = await loop.create_datagram_endpoint(lambda: DiscoveryProtocol(table), local_addr=("0.0.0.0", 0))
+        return transport, [(host, int(port))]
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("", MCAST_PORT))
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                    struct.pack("4sl", socket.inet_aton(MCAST_GROUP), socket.INADDR_ANY))
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+    transport, _ = await loop.create_datagram_endpoint(lambda: DiscoveryProtocol(table), sock=sock)
+    return transport, [(MCAST_GROUP, MCAST_PORT)]
+
+async def discover_peers(table: PeerTable) -> List[str]:
+    # ranked peer ids, best first (the background tasks keep this current)
+    return list(table.ranking)
+
+async def announce_loop(transport, dests, table: PeerTable, state, host=None, port=PEER_PORT, interval=ANNOUNCE_INTERVAL):
+    # own utilization/queue plus a gossip sample, to the group/registry and to a random known peer
+    gport = transport.get_extra_info("sockname")[1]
+    while True:
+        me = {"id": table.self_id, "port": port, "gport": gport, "util": state["util"], "queue": state["queue"],
+              "ts": time.time()}
+        if host:
+            me["host"] = host
+        msg = json.dumps({"self": me, "gossip": table.gossip()}).encode()
+        targets = list(dests)
+        if table.peers:
+            p = table.peers[random.choice(list(table.peers))]
+            if "host" in p and "gport" in p:
+                targets.append((p["host"], p["gport"]))
+        for d in targets:
+            transport.sendto(msg, d)
+        table.rerank()
+        await asyncio.sleep(interval)
 
 async def measure_rtt(peer: str, timeout=0.5) -> float:
     # Measure TCP connect RTT (approximate)
@@ -31,40 +166,198 @@ async def measure_rtt(peer: str, timeout=0.5) -> float:
     except Exception:
         return float('inf')
 
-async def offload_task(session: aiohttp.ClientSession, peer: str, payload: bytes) -> bool:
+async def probe_peer(session: aiohttp.ClientSession, host: str, port: int, timeout=0.5) -> float:
+    # application-level RTT over the session's pooled keep-alive connection; a peer that
+    # only serves POST /offload answers 404/405 here, which is still a full round trip
+    start = time.perf_counter()
+    try:
+        async with session.get(f"http://{host}:{port}{HEALTH_PATH}", timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+            await resp.read()
+            return time.perf_counter() - start if resp.status in (200, 404, 405) else float('inf')
+    except Exception:
+        return float('inf')
+
+async def probe_loop(session: aiohttp.ClientSession, table: PeerTable, interval=PROBE_INTERVAL):
+    # all peers at once: a round costs one (slowest) RTT, not the sum
+    while True:
+        peers = [(pid, p) for pid, p in table.peers.items() if "host" in p]
+        rtts = await asyncio.gather(*(probe_peer(session, p["host"], p.get("port", PEER_PORT)) for _, p in peers))
+        for (pid, _), rtt in zip(peers, rtts):
+            if rtt == float('inf'):
+                table.fail(pid)
+            else:
+                table.observe_rtt(pid, rtt)
+        table.rerank()
+        await asyncio.sleep(interval)
+
+def new_session() -> aiohttp.ClientSession:
+    # one keep-alive pool shared by probes and offloads, a few connections per peer
+    return aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0, limit_per_host=8, keepalive_timeout=60))
+
+async def offload_task(session: aiohttp.ClientSession, peer: str, payload: bytes, port=PEER_PORT) -> bool:
     # POST task to peer; integrate with container runtime or WASM runtimes in real deployments
-    url = f"http://{peer}:{PEER_PORT}{OFFLOAD_PATH}"
+    url = f"http://{peer}:{port}{OFFLOAD_PATH}"
     try:
-        async with session.post(url, data=payload, timeout=5) as resp:
+        async with session.post(url, data=payload, timeout=aiohttp.ClientTimeout(total=5)) as resp:
+            await resp.read()
             return resp.status == 200
     except Exception as e:
         logging.debug("offload failed: %s", e)
         return False
 
-async def decision_loop():
-    async with aiohttp.ClientSession() as session:
-        while True:
-            metrics = await get_local_metrics()
-            if metrics["util"] < UTIL_THRESHOLD:
-                await asyncio.sleep(1.0)
-                continue
-            peers = await discover_peers()
-            best_peer, best_score = None, float('inf')
-            for p in peers:
-                rtt = await measure_rtt(p)
-                score = rtt  # could add advertised price or capacity
-                if score < best_score:
-                    best_score, best_peer = score, p
-            if best_peer:
+async def offload(session, table: PeerTable, payload: bytes, attempts=2):
+    # best ranked peer; a refusal counts against it and the next one is tried
+    for _ in range(attempts):
+        pid = table.best()
+        if pid is None:
+            return None, False
+        p = table.peers[pid]
+        if await offload_task(session, p["host"], payload, p.get("port", PEER_PORT)):
+            return pid, True
+        table.fail(pid)
+        if pid in table.ranking:  # refused but reachable: demote until the next rerank
+            table.ranking.remove(pid); table.ranking.append(pid)
+    return pid, False
+
+def make_app(state, service_s=0.0, capacity=4, delay_s=0.0):
+    """Peer side: /offload runs (here: sleeps) a task, refusing when the queue is full; /health for probes."""
+    async def health(_):
+        await asyncio.sleep(delay_s)
+        return web.Response(text="ok")
+    async def run(request):
+        await asyncio.sleep(delay_s)
+        await request.read()
+        if state["inflight"] >= 2 * capacity:
+            return web.Response(status=503)
+        state["inflight"] += 1; state["util"] = min(1.0, state["inflight"] / capacity)
+        state["queue"] = max(0, state["inflight"] - capacity)
+        try:
+            await asyncio.sleep(service_s)
+        finally:
+            state["inflight"] -= 1; state["util"] = min(1.0, state["inflight"] / capacity)
+            state["queue"] = max(0, state["inflight"] - capacity)
+        return web.Response(text="done")
+    app = web.Application()
+    app.router.add_get(HEALTH_PATH, health)
+    app.router.add_post(OFFLOAD_PATH, run)
+    return app
+
+async def start_peer_server(state, port=PEER_PORT, host=None, **app_kw) -> web.AppRunner:
+    runner = web.AppRunner(make_app(state, **app_kw))
+    await runner.setup()
+    await web.TCPSite(runner, host or "0.0.0.0", port).start()
+    return runner
+
+async def serve_peer(node_id, port, registry=REGISTRY, host=None, interval=ANNOUNCE_INTERVAL, **app_kw):
+    state = {"util": 0.0, "queue": 0, "inflight": 0}
+    await start_peer_server(state, port, host, **app_kw)
+    table = PeerTable(node_id)
+    transport, dests = await open_discovery(table, registry)
+    await announce_loop(transport, dests, table, state, host=host, port=port, interval=interval)
+
+async def decision_loop(registry=REGISTRY, port=PEER_PORT):
+    # every node is also a peer: it serves /offload and /health on the port it announces
+    table = PeerTable()
+    transport, dests = await open_discovery(table, registry)
+    state = {"util": 0.0, "queue": 0, "inflight": 0}
+    runner = await start_peer_server(state, port)
+    async with new_session() as session:
+        tasks = [asyncio.ensure_future(announce_loop(transport, dests, table, state, port=port)),
+                 asyncio.ensure_future(probe_loop(session, table))]
+        try:
+            while True:
+                metrics = await get_local_metrics()
+                state["util"] = metrics["util"]
+                if metrics["util"] < UTIL_THRESHOLD:
+                    await asyncio.sleep(1.0)
+                    continue
                 payload = b'{"task":"inference","data":"..."}'
-                ok = await offload_task(session, best_peer, payload)
-                logging.info("Offloaded to %s success=%s rtt=%.3f", best_peer, ok, best_score)
-            else:
-                logging.info("No peer available; queueing locally")
-            await asyncio.sleep(DISCOVER_INTERVAL)
+                peer, ok = await offload(session, table, payload)
+                if peer:
+                    logging.info("Offloaded to %s success=%s rtt=%.3f", peer, ok, table.peers[peer]["rtt"] or 0.0)
+                else:
+                    logging.info("No peer available; queueing locally")
+                await asyncio.sleep(0.1)
+        finally:
+            for t in tasks:
+                t.cancel()
+            await runner.cleanup()
+
+def _peer_process(node_id, port, registry, delay_s, service_s, capacity):
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(serve_peer(node_id, port, registry, host="127.0.0.1", interval=0.2,
+                           delay_s=delay_s, service_s=service_s, capacity=capacity))
+
+def bench(n_peers=16, seconds=6.0, concurrency=16, base_port=19100):
+    # one process per peer on localhost (emulated RTT 2-40 ms, mixed capacity); peer 0 is fastest
+    # to reach but small, and the last peer is killed halfway through each run
+    import multiprocessing as mp
+    rng = random.Random(0)
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(("127.0.0.1", 0)); reg_port = s.getsockname()[1]
+    registry = f"127.0.0.1:{reg_port}"
+    specs = [(f"peer{i}", base_port + i, registry, 0.001 if i == 0 else rng.uniform(0.001, 0.02),
+              0.05, 1 if i == 0 else rng.choice([2, 4, 8])) for i in range(n_peers)]
+
+    async def run(label):
+        procs = [mp.get_context("fork").Process(target=_peer_process, args=spec, daemon=True) for spec in specs]
+        loop = asyncio.get_running_loop()
+        reg_t, _ = await loop.create_datagram_endpoint(Registry, local_addr=("127.0.0.1", reg_port))
+        for p in procs:
+            p.start()
+        table = PeerTable("client")
+        transport, dests = await open_discovery(table, registry)
+        lat, results = [], []
+        async with new_session() as session:
+            bg = [asyncio.ensure_future(announce_loop(transport, dests, table, {"util": 1.0, "queue": 0}, interval=0.2)),
+                  asyncio.ensure_future(probe_loop(session, table, interval=0.2))]
+            await asyncio.sleep(1.5)  # discovery warm-up
+            ports = {pid: (p["host"], p["port"]) for pid, p in table.peers.items()}
+            t_end = time.perf_counter() + seconds
+            killed = [False]
+
+            async def worker():
+                while time.perf_counter() < t_end:
+                    if not killed[0] and time.perf_counter() > t_end - seconds / 2:
+                        killed[0] = True; procs[-1].kill()
+                    t0 = time.perf_counter()
+                    if label == "serial probe":  # previous loop: probe every peer in turn on a fresh connection
+                        best, best_rtt = None, float('inf')
+                        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(force_close=True)) as fresh:
+                            for pid, (h, port) in ports.items():
+                                rtt = await probe_peer(fresh, h, port)
+                                if rtt < best_rtt:
+                                    best, best_rtt = pid, rtt
+                        lat.append(time.perf_counter() - t0)
+                        ok = False
+                        if best is not None:
+                            h, port = ports[best]
+                            ok = await offload_task(session, h, b"x", port)
+                    else:
+                        table.best()
+                        lat.append(time.perf_counter() - t0)
+                        _, ok = await offload(session, table, b"x")
+                    results.append(ok)
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            for t in bg:
+                t.cancel()
+        for p in procs:
+            p.kill(); p.join()
+        reg_t.close(); transport.close()
+        lat.sort()
+        print(f"{label:12s}: decision p50 {lat[len(lat) // 2] * 1e3:8.3f} ms, p99 {lat[int(len(lat) * 0.99)] * 1e3:8.3f} ms; "
+              f"{len(results)} offloads, success {sum(results) / max(len(results), 1):.1%}, "
+              f"{len(results) / seconds:.0f}/s")
+
+    logging.getLogger().setLevel(logging.WARNING)
+    for label in ("serial probe", "ranked"):
+        asyncio.run(run(label))
 
 if __name__ == "__main__":
+    import sys
+    if "--bench" in sys.argv:
+        bench(); sys.exit()
     try:
         asyncio.run(decision_loop())
     except KeyboardInterrupt:
-        pass
\ No newline at end of file
+        pass